@@ -0,0 +1,114 @@
+# ****************************************************************
+# Benchmarks for files.py
+# ****************************************************************
+
+import os
+import sys
+import shutil
+import tempfile
+import tracemalloc
+from time import time
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.files import load_csv, save_csv
+from utils.files import read_excel, write_excel, stream_excel
+from utils.files import EXCEL_CHUNKSIZE
+
+
+# CLI: python benchmarks/benchmark_files.py
+
+# ----------------------------------------------------------------
+# CSV Files
+# ----------------------------------------------------------------
+
+def benchmark_load_csv(filename=None, rows=1000000, repeat=3):
+    'Returns the load times of a CSV file with each engine and schema.'
+
+    with tempfile.TemporaryDirectory() as directory:
+        if filename is None:
+            # Generate a synthetic file shaped like the purchase datasets
+            rng = np.random.default_rng(0)
+            df = pd.DataFrame({
+                'customer_id': rng.integers(0, 100000, rows),
+                'product': rng.choice(['A', 'B', 'C', 'D'], rows),
+                'date': pd.Timestamp('2023-01-01') +
+                        pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+                'quantity': rng.integers(1, 10, rows),
+                'price': rng.random(rows).round(2) * 100})
+        # Work on a copy so that the original file has no sidecar written
+        pathname = os.path.join(directory, 'benchmark.csv')
+        if filename is None:
+            save_csv(df, pathname)
+        else:
+            shutil.copy(filename, pathname)
+
+        results = []
+        for engine in ['c', 'pyarrow']:
+            for schema in [False, True]:
+                if schema is True:
+                    load_csv(pathname, engine=engine, schema=True)
+                times = []
+                for _ in range(repeat):
+                    start = time()
+                    load_csv(pathname, engine=engine, schema=schema)
+                    times.append(time() - start)
+                results.append({'engine': engine, 'schema': schema,
+                                'seconds': round(min(times), 3)})
+
+    return pd.DataFrame(results)
+
+
+# ----------------------------------------------------------------
+# Excel Files
+# ----------------------------------------------------------------
+
+def benchmark_excel(rows=200000, columns=10, chunksize=EXCEL_CHUNKSIZE):
+    'Returns the wall time and peak memory of Excel reads and writes.'
+
+    df = pd.DataFrame(np.random.default_rng(0).random((rows, columns)),
+                      columns=[f'col{i}' for i in range(columns)])
+    df['label'] = [f'row{i}' for i in range(rows)]
+
+    def measure(function):
+        tracemalloc.start()
+        start = time()
+        function()
+        elapsed = time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return round(elapsed, 2), round(peak / 2**20, 1)
+
+    def consume():
+        for chunk in stream_excel(filename, chunksize):
+            pass
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'benchmark.xlsx')
+        tests = [('write', 'default', lambda: write_excel(df, filename,
+                                                          streaming=False)),
+                 ('write', 'streaming', lambda: write_excel(df, filename,
+                                                            streaming=True)),
+                 ('read', 'default', lambda: read_excel(filename)),
+                 ('read', 'streaming', consume)]
+        for operation, mode, function in tests:
+            elapsed, peak = measure(function)
+            results.append({'operation': operation, 'mode': mode,
+                            'seconds': elapsed, 'peak_mb': peak})
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+    print(benchmark_load_csv().to_string(index=False))
+    print(benchmark_excel().to_string(index=False))
+
+
+# ****************************************************************
+# End of File
+# ****************************************************************
@@ -0,0 +1,129 @@
+# ****************************************************************
+# Benchmarks for storage.py
+# ****************************************************************
+
+import os
+import sys
+import asyncio
+import tempfile
+from time import time, sleep
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.files import save_csv, compressed_filename, open_file
+from utils.storage import load_data_file, save_data_file, run_blocking
+
+
+# CLI: python benchmarks/benchmark_storage.py
+
+# ----------------------------------------------------------------
+# Compression
+# ----------------------------------------------------------------
+
+def benchmark_frame(rows=100000, seed=0):
+    'Returns a dataframe resembling the product datasets of the models.'
+
+    rng = np.random.default_rng(seed)
+    categories = ['garden', 'kitchen', 'bathroom', 'tools', 'lighting',
+                  'flooring', 'paint', 'plumbing']
+    words = ['steel', 'white', 'oak', 'led', 'outdoor', 'kit', 'set', 'mm',
+             'adjustable', 'waterproof', 'black', 'pack', 'premium']
+    descriptions = [' '.join(rng.choice(words, 5)) for _ in range(1000)]
+    return pd.DataFrame({
+        'product_id': rng.integers(10**7, 10**8, rows),
+        'category': rng.choice(categories, rows),
+        'description': rng.choice(descriptions, rows),
+        'price': rng.gamma(2.0, 30.0, rows).round(2),
+        'quantity': rng.integers(1, 20, rows),
+        'date': pd.date_range('2023-01-01', periods=rows,
+                              freq='min').strftime('%Y-%m-%d')})
+
+
+def benchmark_compression(df=None, data_types=('csv', 'json'),
+                          codecs=(None, 'gzip', 'zstd'), repeat=3):
+    'Returns the compression ratio and save/load throughput of each codec.'
+
+    df = benchmark_frame() if df is None else df
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for data_type in data_types:
+            data = df.to_dict(orient='records') if data_type == 'json' else df
+            filename = os.path.join(directory, f'benchmark.{data_type}')
+            for codec in codecs:
+                pathname = compressed_filename(filename, codec)
+                save_time, load_time = [], []
+                for _ in range(repeat):
+                    start = time()
+                    save_data_file(data, pathname, data_type)
+                    save_time.append(time() - start)
+                    start = time()
+                    load_data_file(pathname, data_type)
+                    load_time.append(time() - start)
+
+                # Throughputs are measured in MB of uncompressed data
+                with open_file(pathname, 'rb') as f:
+                    raw_size = len(f.read())
+                size = os.path.getsize(pathname)
+                megabytes = raw_size / 2**20
+                rows.append({'data_type': data_type,
+                             'codec': codec or 'none',
+                             'size_mb': round(size / 2**20, 2),
+                             'ratio': round(raw_size / size, 2),
+                             'save_mb_s': round(megabytes / min(save_time), 2),
+                             'load_mb_s': round(megabytes / min(load_time), 2)})
+
+    return pd.DataFrame(rows)
+
+
+# ----------------------------------------------------------------
+# Asynchronous API
+# ----------------------------------------------------------------
+
+def benchmark_async_loads(datasets=20, latency=0.2, rows=10000):
+    'Compares sequential and gathered loads of datasets with a latency.'
+
+    df = benchmark_frame(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        pathnames = []
+        for i in range(datasets):
+            pathname = os.path.join(directory, f'dataset-{i}.csv')
+            save_csv(df, pathname)
+            pathnames.append(pathname)
+
+        # Stands in for the round trip of a Google Storage or BQ request
+        def stand_in_load(pathname):
+            sleep(latency)
+            return load_data_file(pathname, 'csv')
+
+        async def gather_loads():
+            return await asyncio.gather(*[run_blocking(stand_in_load, pathname)
+                                          for pathname in pathnames])
+
+        start = time()
+        for pathname in pathnames:
+            stand_in_load(pathname)
+        sequential = time() - start
+
+        start = time()
+        asyncio.run(gather_loads())
+        concurrent = time() - start
+
+    results = {'datasets': datasets, 'latency': latency,
+               'sequential_s': round(sequential, 2),
+               'concurrent_s': round(concurrent, 2),
+               'speedup': round(sequential / concurrent, 1)}
+    return results
+
+
+if __name__ == '__main__':
+    print(benchmark_compression().to_string(index=False))
+    print(benchmark_async_loads())
+
+
+# ****************************************************************
+# End of File
+# ****************************************************************
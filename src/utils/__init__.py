@@ -0,0 +1,22 @@
+# ****************************************************************
+# Python Utilities
+# ****************************************************************
+
+# NB: Submodules are imported on first access, e.g. utils.storage, so
+# that importing the package does not import every dependency.
+
+import importlib
+
+__all__ = ['data', 'files', 'gpt', 'graph', 'mail', 'nlp', 'pdf', 'queries',
+           'scraper', 'storage', 'utils', 'web']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+# ****************************************************************
+# End of File
+# ****************************************************************
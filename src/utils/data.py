@@ -3,14 +3,15 @@
 # KGML Data Manipulation Functions.
 # *******************************************************************
 
-# Data science imports
-import numpy as np
-import pandas as pd
 import math
 import logging
 import itertools
 
-from utils.utils import timing
+from utils.utils import timing, lazy_import
+
+# Data science imports
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 # ----------------------------------------------------------
 
@@ -200,6 +201,59 @@ def clean_data(df, tcol='text', ccol='class', tokens_col='tokens',
     return df
 
 
+# ---------------------------------------------------------------
+# Memory Optimization
+# ---------------------------------------------------------------
+
+def memory_usage_mb(df):
+    'Returns the deep memory usage of df in megabytes.'
+    return round(df.memory_usage(deep=True).sum() / 2**20, 2)
+
+
+def _lossless_float32(series):
+    'Returns True if series can be stored as float32 without loss.'
+    downcast = series.astype('float32')
+    return bool(((downcast == series) | series.isna()).all())
+
+
+def compact_dtypes(df, categorical_threshold=0.5, arrow_strings=False,
+                   verbose=False):
+    'Downcasts numeric columns and converts low cardinality string columns.'
+
+    # NB: Integers are downcast to the smallest signed type, floats to
+    # float32 only when no precision is lost, and string columns, either
+    # object or StringDtype as read by pandas 3, whose ratio of unique
+    # values is below categorical_threshold become categoricals (or
+    # pyarrow strings if arrow_strings is True).
+
+    before = memory_usage_mb(df)
+    df = df.copy(deep=False)
+
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        elif pd.api.types.is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            if series.dtype != np.float32 and _lossless_float32(series):
+                df[col] = series.astype('float32')
+        elif pd.api.types.is_string_dtype(series) and \
+                pd.api.types.infer_dtype(series, skipna=True) == 'string':
+            ratio = series.nunique() / max(series.shape[0], 1)
+            if ratio < categorical_threshold:
+                df[col] = series.astype('category')
+            elif arrow_strings is True:
+                df[col] = series.astype('string[pyarrow]')
+
+    after = memory_usage_mb(df)
+    df.attrs['memory_usage'] = {'before': before, 'after': after}
+    if verbose is True:
+        print(f'Memory usage reduced from {before} MB to {after} MB.')
+
+    return df
+
+
 # ---------------------------------------------------------------
 # Tabular Data
 # ---------------------------------------------------------------
@@ -225,6 +279,7 @@ def normalize_table(table):
 # --------------------------------------------------------------
 
 def save_table(table, filename):
+    from utils.files import write_excel
     table = normalize_table(table)
     df = pd.DataFrame(table)
     write_excel(df, filename)
@@ -232,11 +287,10 @@ def save_table(table, filename):
 
 # --------------------------------------------------------------
 
-def save_dict(data, filename, pprint=True):
-    indent = 4 if pprint is True else 0
-    with open(filename, 'w', encoding='utf-8') as data_file:
-        json.dump(data, data_file, ensure_ascii=False, indent=indent)
-    return True
+def save_dict(data, filename, pprint=False):
+    # NB: utils.files imports this module, see utils.files.save_dict
+    from utils.files import save_dict as save_json
+    return save_json(data, filename, pprint=pprint)
 
 
 # --------------------------------------------------------------
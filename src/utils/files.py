@@ -21,14 +21,30 @@
 # Standard Python imports
 import os
 import re
+import io
 import csv
+import gzip
 import json
+import struct
+import fnmatch
+import zipfile
+import threading
 
-from os import listdir
 from os.path import isfile, join
 
-import pandas as pd
 from time import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.utils import lazy_import
+from utils.data import compact_dtypes
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+pacsv = lazy_import('pyarrow.csv')
+zstandard = lazy_import('zstandard')
+openpyxl = lazy_import('openpyxl')
 
 
 # ----------------------------------------------------------------------
@@ -36,20 +52,183 @@ from time import time
 # ----------------------------------------------------------------------
 
 def files_in_dir(dir, filter=''):
-    files = [join(dir, f) for f in listdir(dir) if isfile(join(dir, f))]
-    return [f for f in files if filter in f]
+    return [f for f in scan_files(dir, sort='name') if filter in f]
 
 
 def file_exists(filename):
     return os.path.exists(filename)
 
 
+# ----------------------------------------------------------------------
+# File Discovery
+# ----------------------------------------------------------------------
+
+# NB: Directories are listed with os.scandir, which returns the type of
+# each entry without a stat call. Sizes and modification times are only
+# read when a filter or sort order needs them. With cache=True the
+# entries of each directory are kept in memory until the modification
+# time of the directory changes, i.e. until files are added, removed or
+# renamed in it. Files rewritten in place do not change the directory,
+# so cached sizes and times may then be stale.
+# scan_files matches pattern, a glob, against file names and searches
+# regex in the pathnames relative to directory. Sizes are in bytes,
+# after and before are timestamps and sort is one of SORT_KEYS.
+
+SORT_KEYS = {'name': 0, 'size': 1, 'mtime': 2}
+
+_scan_cache = {}
+_scan_cache_lock = threading.Lock()
+
+
+def scan_directory(directory, stat=False, cache=False):
+    'Returns the (name, is_dir, size, mtime) entries of a directory.'
+
+    if cache is True:
+        modified = os.stat(directory).st_mtime_ns
+        with _scan_cache_lock:
+            cached = _scan_cache.get(directory)
+        if cached is not None and cached[0] == modified:
+            return cached[1]
+        stat = True
+
+    entries = []
+    with os.scandir(directory) as iterator:
+        for entry in iterator:
+            try:
+                # Symbolic links to directories are not followed
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir is False and entry.is_file() is False:
+                    continue
+                size, mtime = None, None
+                if stat is True and is_dir is False:
+                    info = entry.stat()
+                    size, mtime = info.st_size, info.st_mtime
+            except OSError:
+                continue
+            entries.append((entry.name, is_dir, size, mtime))
+
+    if cache is True:
+        with _scan_cache_lock:
+            _scan_cache[directory] = (modified, entries)
+    return entries
+
+
+def clear_scan_cache():
+    with _scan_cache_lock:
+        _scan_cache.clear()
+
+
+def scan_files(directory, pattern=None, regex=None, recursive=False,
+               min_size=None, max_size=None, after=None, before=None,
+               sort=None, reverse=False, cache=False):
+    'Yields the pathnames of the files in directory matching the filters.'
+
+    if sort is not None and sort not in SORT_KEYS:
+        raise ValueError(f'Unknown sort order: {sort}')
+    stat = sort in ('size', 'mtime') or \
+        any(value is not None for value in [min_size, max_size, after, before])
+    if isinstance(regex, str):
+        regex = re.compile(regex)
+
+    def walk(path, relative):
+        for name, is_dir, size, mtime in scan_directory(path, stat=stat,
+                                                        cache=cache):
+            pathname = join(path, name)
+            if is_dir is True:
+                if recursive is True:
+                    yield from walk(pathname, relative + name + '/')
+                continue
+            if pattern is not None and not fnmatch.fnmatch(name, pattern):
+                continue
+            if regex is not None and not regex.search(relative + name):
+                continue
+            if (min_size is not None and size < min_size) or \
+               (max_size is not None and size > max_size) or \
+               (after is not None and mtime < after) or \
+               (before is not None and mtime >= before):
+                continue
+            yield pathname, size, mtime
+
+    files = walk(directory, '')
+    if sort is None:
+        for pathname, _, _ in files:
+            yield pathname
+    else:
+        key = SORT_KEYS[sort]
+        for file in sorted(files, key=lambda file: file[key], reverse=reverse):
+            yield file[0]
+
+
+# ----------------------------------------------------------------------
+# Compressed Files
+# ----------------------------------------------------------------------
+
+# NB: Text files, e.g. csv, json or html files, may be compressed with
+# gzip or zstd. The codec is inferred from the .gz or .zst extension of
+# the filename, so a file is always read back the way it was written.
+
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def infer_compression(filename):
+    'Returns the compression codec implied by the extension of filename.'
+
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if str(filename).endswith(extension):
+            return compression
+    return None
+
+
+def compressed_filename(filename, compression):
+    'Returns filename with the extension of the specified codec appended.'
+
+    if compression is None:
+        return filename
+    elif compression in COMPRESSION_EXTENSIONS:
+        return filename + COMPRESSION_EXTENSIONS[compression]
+    else:
+        raise ValueError(f'Unsupported compression {compression}.')
+
+
+def find_compressed_file(filename):
+    'Returns the most recent of the plain, gzip and zstd copies of filename.'
+
+    candidates = [compressed_filename(filename, compression)
+                  for compression in [None, *COMPRESSION_EXTENSIONS]]
+    existing = [candidate for candidate in candidates if isfile(candidate)]
+    if len(existing) == 0:
+        return filename
+    return max(existing, key=os.path.getmtime)
+
+
+def open_file(filename, mode='r', compression='infer', encoding='utf-8'):
+    'Opens filename, compressing or decompressing its contents on the fly.'
+
+    if compression == 'infer':
+        compression = infer_compression(filename)
+
+    # Text mode unless binary mode is requested
+    binary = 'b' in mode
+    if binary is False and 't' not in mode:
+        mode = mode + 't'
+    encoding = None if binary is True else encoding
+
+    if compression is None:
+        return open(filename, mode.replace('t', ''), encoding=encoding)
+    elif compression == 'gzip':
+        return gzip.open(filename, mode, encoding=encoding)
+    elif compression == 'zstd':
+        return zstandard.open(filename, mode, encoding=encoding)
+    else:
+        raise ValueError(f'Unsupported compression {compression}.')
+
+
 # ----------------------------------------------------------------------
 # Load and save text files as strings
 # ----------------------------------------------------------------------
 
 def load_text_file(pathname):
-    fileptr = open(pathname, 'r')
+    fileptr = open_file(pathname, 'r')
     html = fileptr.read()
     fileptr.close()
     return html
@@ -58,7 +237,7 @@ def load_text_file(pathname):
 # ----------------------------------------------------------------------
 
 def save_text_file(html, pathname):
-    fileptr = open(pathname, 'w')
+    fileptr = open_file(pathname, 'w')
     fileptr.write(html)
     fileptr.close()
     return True
@@ -68,18 +247,203 @@ def save_text_file(html, pathname):
 # Load & Save CSV
 # ------------------------------------------------------------
 
-def load_csv(filename, delimiter=',', index_col=False):
+# NB: engine='pyarrow' parses with multiple threads. With schema=True
+# the column dtypes are read from a sidecar file, e.g. data.csv.schema.json
+# for data.csv, data.csv.gz or data.csv.zst, so that repeated loads skip
+# type inference. The sidecar is written after the first full load and
+# by save_csv(..., schema=True). It records the size and modification
+# time of the CSV file and is ignored once the file changes. Explicit
+# dtypes take precedence over the sidecar.
+
+def load_csv(filename, delimiter=',', index_col=False, usecols=None,
+             dtype=None, chunksize=None, optimize_memory=False,
+             compression='infer', engine='c', schema=False):
     'Loads the specified CSV file using the specified parameters.'
 
-    df = pd.read_csv(filename, delimiter=delimiter,
-                     index_col=index_col)
+    # Use the dtypes of the schema sidecar when it is current
+    sidecar = load_csv_schema(filename) if schema is True else None
+    if sidecar is not None and (dtype is None or isinstance(dtype, dict)):
+        dtype = {**sidecar['dtypes'], **(dtype or {})}
+        if usecols is not None:
+            dtype = {k: v for k, v in dtype.items() if k in usecols}
+
+    # The C engine parses dates separately from the other dtypes
+    # NB: date_format only exists from pandas 2, so it is only passed
+    # along with dates to parse.
+    dates = {}
+    if engine != 'pyarrow' and isinstance(dtype, dict):
+        parse_dates = [column for column, value in dtype.items()
+                       if str(value).startswith('datetime64')]
+        dtype = {k: v for k, v in dtype.items() if k not in parse_dates}
+        if parse_dates:
+            dates = {'parse_dates': parse_dates, 'date_format': 'ISO8601'}
+
+    # NB: When chunksize is specified an iterator of dataframes is returned.
+    # The pyarrow engine converts types while parsing rather than after.
+    if engine == 'pyarrow' and index_col in (False, None) and \
+       (dtype is None or isinstance(dtype, dict)):
+        if chunksize is not None:
+            return CSVChunks(stream_csv_arrow(filename, chunksize,
+                                              delimiter=delimiter,
+                                              usecols=usecols, dtype=dtype,
+                                              compression=compression))
+        df = read_csv_arrow(filename, delimiter=delimiter, usecols=usecols,
+                            dtype=dtype, compression=compression)
+    else:
+        if engine == 'pyarrow' and index_col is False:
+            index_col = None
+        df = pd.read_csv(filename, delimiter=delimiter,
+                         index_col=index_col, usecols=usecols, dtype=dtype,
+                         chunksize=chunksize, **dates,
+                         compression=compression, engine=engine)
+    if schema is True and sidecar is None and chunksize is None and \
+       usecols is None:
+        save_csv_schema(df, filename)
+    if optimize_memory is True and chunksize is None:
+        df = compact_dtypes(df)
     return df
 
 
-def save_csv(df, filename, index=False):
+class CSVChunks:
+    'An iterator of dataframes that can also be used as a context manager.'
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.chunks.close()
+
+
+def arrow_type(dtype):
+    'Returns the pyarrow type of a pandas dtype or None if unsupported.'
+
+    if str(dtype) in ('object', 'str', 'string', 'category'):
+        return pa.string()
+    try:
+        return pa.from_numpy_dtype(np.dtype(dtype))
+    except Exception:
+        return None
+
+
+def arrow_csv_options(delimiter=',', usecols=None, dtype=None):
+    'Returns the pyarrow parse and convert options of a CSV file.'
+
+    column_types = {}
+    if isinstance(dtype, dict):
+        column_types = {column: arrow_type(value)
+                        for column, value in dtype.items()}
+        column_types = {k: v for k, v in column_types.items() if v is not None}
+    return (pacsv.ParseOptions(delimiter=delimiter),
+            pacsv.ConvertOptions(include_columns=usecols,
+                                 column_types=column_types))
+
+
+def arrow_to_pandas(table, dtype=None):
+    'Converts a pyarrow table to a dataframe restoring categorical dtypes.'
+
+    df = table.to_pandas()
+    categories = {column: 'category' for column, value in (dtype or {}).items()
+                  if str(value) == 'category' and column in df.columns}
+    return df.astype(categories) if categories else df
+
+
+def read_csv_arrow(filename, delimiter=',', usecols=None, dtype=None,
+                   compression='infer'):
+    'Reads a CSV file with the multithreaded pyarrow parser.'
+
+    parse_options, convert_options = arrow_csv_options(delimiter, usecols,
+                                                       dtype)
+    with open_file(filename, 'rb', compression=compression) as file:
+        table = pacsv.read_csv(file, parse_options=parse_options,
+                               convert_options=convert_options)
+    return arrow_to_pandas(table, dtype)
+
+
+def stream_csv_arrow(filename, chunksize, delimiter=',', usecols=None,
+                     dtype=None, compression='infer'):
+    'Yields dataframes of at most chunksize rows parsed by pyarrow.'
+
+    parse_options, convert_options = arrow_csv_options(delimiter, usecols,
+                                                       dtype)
+    with open_file(filename, 'rb', compression=compression) as file:
+        reader = pacsv.open_csv(file, parse_options=parse_options,
+                                convert_options=convert_options)
+        batches, rows = [], 0
+        for batch in reader:
+            batches.append(batch)
+            rows += batch.num_rows
+            while rows >= chunksize:
+                table = pa.Table.from_batches(batches, schema=reader.schema)
+                yield arrow_to_pandas(table.slice(0, chunksize), dtype)
+                table = table.slice(chunksize)
+                batches, rows = table.to_batches(), table.num_rows
+        if rows > 0:
+            yield arrow_to_pandas(pa.Table.from_batches(
+                batches, schema=reader.schema), dtype)
+
+
+# ------------------------------------------------------------
+
+def schema_filename(filename):
+    'Returns the pathname of the schema sidecar of a CSV file.'
+
+    compression = infer_compression(filename)
+    if compression is not None:
+        filename = str(filename)[:-len(COMPRESSION_EXTENSIONS[compression])]
+    return f'{filename}.schema.json'
+
+
+def save_csv_schema(df, filename):
+    'Saves the column dtypes of df as the schema sidecar of filename.'
+
+    info = os.stat(filename)
+    schema = {'size': info.st_size, 'mtime': info.st_mtime,
+              'dtypes': {str(column): str(dtype)
+                         for column, dtype in df.dtypes.items()}}
+    return save_dict(schema, schema_filename(filename), pprint=False)
+
+
+def load_csv_schema(filename):
+    'Returns the schema sidecar of filename or None if missing or stale.'
+
+    pathname = schema_filename(filename)
+    if isfile(pathname) is False or isfile(filename) is False:
+        return None
+    try:
+        schema = load_dict(pathname)
+    except ValueError:
+        return None
+    info = os.stat(filename)
+    if schema.get('size') != info.st_size or schema.get('mtime') != info.st_mtime:
+        return None
+    return schema
+
+
+def load_csv_header(filename, delimiter=','):
+    'Returns the column names in the header of a CSV file.'
+
+    with open_file(filename, 'r') as file:
+        return next(csv.reader(file, delimiter=delimiter), [])
+
+
+def save_csv(df, filename, index=False, compression='infer', schema=False):
 
     'Saves the specified CSV file using the specified parameters.'
-    df.to_csv(filename, index=index)
+    df.to_csv(filename, index=index, compression=compression)
+    if schema is True:
+        save_csv_schema(df, filename)
     return True
 
 
@@ -87,35 +451,312 @@ def save_csv(df, filename, index=False):
 # Append CSV Rows
 # ------------------------------------------------------------------------------
 
+# NB: A CSVAppender keeps its file open and buffers rows in memory. The
+# buffer is written when it holds buffer_rows rows, by a timer thread at
+# most flush_interval seconds after a row is buffered, and on close. Rows
+# still buffered when the interpreter exits are lost, so close the
+# appender, e.g. with a with statement. Rows are encoded in binary mode
+# so that gzip and zstd files are appended to as additional compressed
+# frames. With max_bytes, a file that has reached that size on disk is
+# renamed before more rows are written to it, e.g. rows.csv.gz becomes
+# rows.1.csv.gz, and a new file is started with the same header.
+
+# Rows buffered before writing to disk
+CSV_BUFFER_ROWS = 1000
+
+# Maximum number of seconds rows remain buffered
+CSV_FLUSH_INTERVAL = 5.0
+
+
+def rotated_filename(filename, index):
+    'Returns filename with index inserted before its extensions.'
+
+    directory, name = os.path.split(filename)
+    stem, _, extensions = name.partition('.')
+    name = f'{stem}.{index}.{extensions}' if extensions else f'{stem}.{index}'
+    return join(directory, name)
+
+
+class CSVAppender:
+    'Appends rows to a CSV file through a buffered, thread safe handle.'
+
+    def __init__(self, filename, header=None, mode='a', compression='infer',
+                 buffer_rows=CSV_BUFFER_ROWS, flush_interval=CSV_FLUSH_INTERVAL,
+                 max_bytes=None, encoding='utf-8'):
+        self.filename = filename
+        self.header = header
+        self.compression = compression
+        self.buffer_rows = buffer_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.encoding = encoding
+        self.lock = threading.Lock()
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.rows = 0
+        self.file = None
+        self.timer = None
+        self.open(mode)
+
+    def open(self, mode='a'):
+        new = mode == 'w' or not isfile(self.filename) or \
+            os.path.getsize(self.filename) == 0
+        self.file = open_file(self.filename, mode + 'b',
+                              compression=self.compression)
+        self.flushed = time()
+        if new is True and self.header is not None:
+            header = io.StringIO()
+            csv.writer(header).writerow(self.header)
+            self.file.write(header.getvalue().encode(self.encoding))
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        with self.lock:
+            for row in rows:
+                self.writer.writerow(row)
+                self.rows += 1
+            if self.rows >= self.buffer_rows or \
+               time() - self.flushed >= self.flush_interval:
+                self._flush()
+            elif self.rows > 0 and self.timer is None:
+                # Buffered rows are written after flush_interval seconds
+                self.timer = threading.Timer(self.flush_interval,
+                                             self._flush_due)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush_due(self):
+        with self.lock:
+            self.timer = None
+            if self.file is not None:
+                self._flush()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.rows > 0:
+            if self.max_bytes is not None and \
+               os.path.getsize(self.filename) >= self.max_bytes:
+                self._rotate()
+            self.file.write(self.buffer.getvalue().encode(self.encoding))
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.rows = 0
+        self.file.flush()
+        self.flushed = time()
+
+    def _rotate(self):
+        self.file.close()
+        index = 1
+        while os.path.exists(rotated_filename(self.filename, index)):
+            index += 1
+        os.replace(self.filename, rotated_filename(self.filename, index))
+        self.open('w')
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._flush()
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# ------------------------------------------------------------------------------
+
 def write_csv_header(header, filename):
-    with open(filename, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(header)
+    with CSVAppender(filename, header=header, mode='w'):
+        pass
     return True
 
 
 # ------------------------------------------------------------------------------
 
 def append_csv_rows(rows, filename):
-    with open(filename, 'a', newline='') as file:
-        writer = csv.writer(file)
-        for row in rows:
-            writer.writerow(row)
+    with CSVAppender(filename) as appender:
+        appender.writerows(rows)
     return True
 
 
+# --------------------------------------------------------------
+# Parquet Files
+# --------------------------------------------------------------
+
+# NB: filters are pyarrow predicates in disjunctive normal form, e.g.
+# [('year', '>=', 2021), ('status3P', '==', True)], and are pushed down
+# to skip the row groups that cannot match.
+
+def load_parquet(filename, columns=None, filters=None):
+    'Loads the specified columns and matching rows of a parquet file.'
+
+    df = pd.read_parquet(filename, engine='pyarrow', columns=columns,
+                         filters=filters)
+    return df
+
+
+# --------------------------------------------------------------
+
+def save_parquet(df, filename, compression='snappy', index=False):
+    'Saves df as a parquet file using the specified compression codec.'
+
+    df.to_parquet(filename, engine='pyarrow', compression=compression,
+                  index=index)
+    return True
+
+
+# --------------------------------------------------------------
+
+def stream_parquet(file, chunksize, columns=None):
+    'Yields dataframes of at most chunksize rows from a parquet file.'
+
+    parquet_file = pq.ParquetFile(file)
+    for batch in parquet_file.iter_batches(batch_size=chunksize,
+                                           columns=columns):
+        yield batch.to_pandas()
+
+
 # --------------------------------------------------------------
 # Excel Files
 # --------------------------------------------------------------
 
-def read_excel(file):
-    return pd.read_excel(file, engine='openpyxl')
+# NB: Workbooks are written in openpyxl write-only mode when the data is
+# large or is an iterator of dataframe chunks, so that rows are streamed
+# to disk instead of building the whole workbook in memory. Streamed
+# sheets have no header formatting. Sheets are read in read-only mode,
+# either in chunks with stream_excel or, for multiple sheets, one after
+# the other. Each process parses the whole workbook, so sheets are only
+# read in parallel processes when workers is given.
+
+# Dataframes with at least this many rows are written in write-only mode
+EXCEL_STREAMING_ROWS = 10000
+
+# Number of rows converted at a time when streaming a dataframe
+EXCEL_CHUNKSIZE = 10000
+
+
+def excel_sheet_names(file):
+    'Returns the names of the sheets of an Excel workbook.'
+
+    workbook = openpyxl.load_workbook(file, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def read_excel_sheet(file, sheet_name=0):
+    'Reads one sheet of an Excel workbook.'
+
+    return pd.read_excel(file, sheet_name=sheet_name, engine='openpyxl')
+
+
+def read_excel(file, sheet_name=0, workers=None):
+    'Reads a sheet, a list of sheets or all sheets (None) of a workbook.'
+
+    if sheet_name is not None and not isinstance(sheet_name, list):
+        return read_excel_sheet(file, sheet_name)
+
+    # Read multiple sheets in parallel when asked and the workbook is a file
+    if not isinstance(file, (str, os.PathLike)):
+        return pd.read_excel(file, sheet_name=sheet_name, engine='openpyxl')
+    names = excel_sheet_names(file) if sheet_name is None else sheet_name
+    if len(names) < 2 or workers is None or workers <= 1:
+        return {name: read_excel_sheet(file, name) for name in names}
+    with ProcessPoolExecutor(max_workers=min(workers, len(names))) as executor:
+        frames = executor.map(read_excel_sheet, [file] * len(names), names)
+        return dict(zip(names, frames))
+
+
+# --------------------------------------------------------------
+
+def stream_excel(file, chunksize=EXCEL_CHUNKSIZE, sheet_name=0):
+    'Yields dataframes of at most chunksize rows from a sheet.'
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[sheet_name] \
+            if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunksize:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
 
 
 # --------------------------------------------------------------
 
-def write_excel(df, file, index=False):
-    df.to_excel(file, engine='openpyxl', index=index)
+def excel_rows(chunks, index=False):
+    'Yields the header and rows of an iterator of dataframes.'
+
+    header = None
+    for chunk in chunks:
+        if index is True:
+            chunk = chunk.reset_index()
+        if header is None:
+            header = [str(column) for column in chunk.columns]
+            yield header
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+
+def dataframe_chunks(df, chunksize=EXCEL_CHUNKSIZE):
+    'Yields dataframes of at most chunksize rows of df.'
+
+    for start in range(0, max(len(df), 1), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def write_excel_streaming(sheets, file, index=False):
+    'Writes a dict of sheet names to dataframe chunk iterators.'
+
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name, chunks in sheets.items():
+        worksheet = workbook.create_sheet(title=sheet_name)
+        for row in excel_rows(chunks, index=index):
+            worksheet.append(row)
+    workbook.save(file)
+    return True
+
+
+def write_excel(data, file, index=False, sheet_name='Sheet1', streaming=None):
+    'Writes a dataframe, dataframe chunks or a dict of sheets to file.'
+
+    sheets = data if isinstance(data, dict) else {sheet_name: data}
+    if streaming is None:
+        streaming = any(not isinstance(df, pd.DataFrame) or
+                        len(df) >= EXCEL_STREAMING_ROWS
+                        for df in sheets.values())
+
+    if streaming is True:
+        sheets = {name: dataframe_chunks(df)
+                  if isinstance(df, pd.DataFrame) else df
+                  for name, df in sheets.items()}
+        return write_excel_streaming(sheets, file, index=index)
+
+    with pd.ExcelWriter(file, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=index)
     return True
 
 
@@ -123,21 +764,193 @@ def write_excel(df, file, index=False):
 # Json Files
 # --------------------------------------------------------------
 
+# NB: JSON is encoded and decoded with orjson when it is installed and
+# with the standard json module otherwise. Files are compact unless
+# pprint is True, since they are mostly read by programs. NumPy scalars
+# and arrays, dates and timestamps are serialized by both codecs.
+
+_orjson = None
+
+
+def fast_json():
+    'Returns the orjson module if it is installed and None otherwise.'
+
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+            _orjson = orjson
+        except ImportError:
+            _orjson = False
+    return _orjson or None
+
+
+def json_default(value):
+    'Returns a JSON serializable version of value.'
+
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} '
+                    f'is not JSON serializable')
+
+
+def dumps_json(data, pprint=False):
+    'Returns the UTF-8 encoded JSON of data.'
+
+    orjson = fast_json()
+    if orjson is not None and pprint is False:
+        return orjson.dumps(data, default=json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY |
+                            orjson.OPT_NON_STR_KEYS)
+    indent = 4 if pprint is True else None
+    separators = None if pprint is True else (',', ':')
+    return json.dumps(data, ensure_ascii=False, indent=indent,
+                      separators=separators,
+                      default=json_default).encode('utf-8')
+
+
+def loads_json(text):
+    'Returns the data of a JSON string or bytes.'
+
+    orjson = fast_json()
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+
 def load_dict(filename):
-    with open(filename, 'r') as data_file:
-        data = json.load(data_file)
+    with open_file(filename, 'rb') as data_file:
+        data = loads_json(data_file.read())
     return data
 
 
 # --------------------------------------------------------------
 
-def save_dict(data, filename, pprint=True):
-    indent = 4 if pprint is True else 0
-    with open(filename, 'w', encoding='utf-8') as data_file:
-        json.dump(data, data_file, ensure_ascii=False, indent=indent)
+def save_dict(data, filename, pprint=False):
+    with open_file(filename, 'wb') as data_file:
+        data_file.write(dumps_json(data, pprint=pprint))
+    return True
+
+
+# --------------------------------------------------------------
+# JSON Lines Files
+# --------------------------------------------------------------
+
+# NB: JSON Lines files hold one JSON document per line, so records can
+# be written from and read into generators without holding the whole
+# file in memory.
+
+def save_jsonl(records, filename, compression='infer'):
+    'Writes an iterable of records to a JSON Lines file.'
+
+    with open_file(filename, 'wb', compression=compression) as file:
+        for record in records:
+            file.write(dumps_json(record) + b'\n')
+    return True
+
+
+def append_jsonl(records, filename, compression='infer'):
+    'Appends an iterable of records to a JSON Lines file.'
+
+    with open_file(filename, 'ab', compression=compression) as file:
+        for record in records:
+            file.write(dumps_json(record) + b'\n')
+    return True
+
+
+def iter_jsonl(filename, compression='infer'):
+    'Yields the records of a JSON Lines file.'
+
+    with open_file(filename, 'rb', compression=compression) as file:
+        for line in file:
+            if line.strip():
+                yield loads_json(line)
+
+
+def load_jsonl(filename, compression='infer'):
+    'Returns the list of records of a JSON Lines file.'
+    return list(iter_jsonl(filename, compression=compression))
+
+
+# --------------------------------------------------------------
+# NumPy Arrays
+# --------------------------------------------------------------
+
+# NB: Arrays are loaded as read-only memory maps so that processes
+# loading the same file share its pages instead of each holding a copy.
+# Files are replaced atomically so that existing maps remain valid.
+# npz files are written uncompressed so that each member can be mapped.
+
+def save_npy(array, filename):
+    'Saves an array as a npy file.'
+
+    tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+    os.replace(tmp_filename, filename)
     return True
 
 
+def load_npy(filename, mmap=True):
+    'Returns the array of a npy file, memory mapped read-only by default.'
+    return np.load(filename, mmap_mode='r' if mmap else None,
+                   allow_pickle=False)
+
+
+# --------------------------------------------------------------
+
+def save_npz(arrays, filename):
+    'Saves a dictionary of named arrays as an uncompressed npz file.'
+
+    tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_filename, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_filename, filename)
+    return True
+
+
+def npz_member_offset(file, info):
+    'Returns the offset of the data of a stored zip member.'
+
+    # The local file header is 30 bytes followed by the name and extra field
+    file.seek(info.header_offset)
+    header = file.read(30)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def load_npz(filename, mmap=True):
+    'Returns a dictionary of the arrays of a npz file, memory mapped by default.'
+
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') \
+                else info.filename
+
+            # Compressed members cannot be mapped and are read in memory
+            if mmap is False or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member,
+                                                            allow_pickle=False)
+                continue
+
+            f.seek(npz_member_offset(f, info))
+            if np.lib.format.read_magic(f) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            if dtype.hasobject or 0 in shape:
+                f.seek(npz_member_offset(f, info))
+                arrays[name] = np.lib.format.read_array(f, allow_pickle=False)
+            else:
+                arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                                         offset=f.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
 # --------------------------------------------------------------
 # Pickle Files
 # --------------------------------------------------------------
@@ -3,17 +3,19 @@
 # **************************************************************************
 
 import os
-import openai
 import json
 from datetime import datetime
-import pandas as pd
-
-# GCP Imports
-import vertexai
-from vertexai.language_models import TextGenerationModel
 
 # Project Imports
-from utils.storage import load_data, save_data
+from utils.utils import lazy_import
+from utils.storage import load_data, save_data, append_data
+
+openai = lazy_import('openai')
+pd = lazy_import('pandas')
+
+# GCP Imports
+vertexai = lazy_import('vertexai')
+language_models = lazy_import('vertexai.language_models')
 
 # --------------------------------------------------------------------------
 # OPENAI API Parameters
@@ -99,8 +101,8 @@ def save_openai_token_usage(bu, df, source='file', storage='misc',
     df = df[TOKENS_USAGE_COLUMNS]
     
     # Save the dataframe
-    df = save_data(bu, TOKENS_USAGE_LOG, 'csv', source, df,
-                   storage=storage, folder=folder)
+    save_data(bu, TOKENS_USAGE_LOG, 'csv', df, source,
+              storage=storage, folder=folder)
 
     return df
 
@@ -108,20 +110,17 @@ def save_openai_token_usage(bu, df, source='file', storage='misc',
 # Log New Token Usage
 # --------------------------------------------------------------------------
 
-# NB: This is different from save_openai_token_usage in that it retrieves
-# the current log, adds one new row and then writes thew current log.
+# NB: This is different from save_openai_token_usage in that it appends
+# one new row to the current log without reading or rewriting it.
 
 def log_openai_token_usage(bu, user, prompt, response, source='file',
                            destination='file', storage='misc',
                            folder='tokens'):
  
-    # Get current token usage log
-    df1 = get_openai_token_usage(bu, source, storage=storage, folder=folder)
-    
     # Prepare the new row
     prompt_tokens = response['prompt_tokens']
-    completion_tokens = response['completion_tokens'],
-    total_tokens = response['total_tokens'],
+    completion_tokens = response['completion_tokens']
+    total_tokens = response['total_tokens']
     response = response['response']
     today = datetime.today().strftime('%Y-%m-%d')
     new_row = {'user': user,
@@ -132,11 +131,10 @@ def log_openai_token_usage(bu, user, prompt, response, source='file',
                'total_tokens': total_tokens,
                'date': today}
 
-    # Add new row and save token consumption log
-    df2 = pd.DataFrame([new_row], columns=df1.columns)
-    df = pd.concat([df1, df2], axis=0)
-    save_data(bu, TOKENS_USAGE_LOG, 'csv', df, destination,
-              storage=storage, folder=folder)
+    # Append the new row to the token consumption log
+    df = pd.DataFrame([new_row], columns=TOKENS_USAGE_COLUMNS)
+    append_data(bu, TOKENS_USAGE_LOG, 'csv', df, destination,
+                storage=storage, folder=folder)
 
     return df
 
@@ -213,7 +211,7 @@ def complete_system_prompt(user, prompt, system_instruction, temperature=0.8,
     'Complete prompt using a system role with output format instructions.'
 
     messages = parse_prompt(prompt)
-    messages.extend(parse_prompt(system_instruction role='system'))
+    messages.extend(parse_prompt(system_instruction, role='system'))
 
     return _openai_chat_complete(user, messages, model,
                                  temperature, max_tokens, storage, folder)
@@ -251,7 +249,7 @@ VERTEXAI_MODEL = None
 def init_vertexai():
     vertexai.init()
     global VERTEXAI_MODEL
-    VERTEXAI_MODEL = TextGenerationModel.from_pretrained("text-bison@001")
+    VERTEXAI_MODEL = language_models.TextGenerationModel.from_pretrained("text-bison@001")
     return True
 
 
@@ -5,13 +5,15 @@
 # Python Imports
 import os
 import platform
-import pandas as pd
-
-# Neo4j imports
-from neo4j import GraphDatabase
 
 # Project imports
-from utils.utils import timing
+from utils.utils import timing, lazy_import
+
+# Data science imports
+pd = lazy_import('pandas')
+
+# Neo4j imports
+neo4j = lazy_import('neo4j')
 
 # *********************************************************************
 # Neo4j Connection
@@ -60,7 +62,7 @@ class Graph_app:
         self.driver = None
         try:
             self.driver = \
-                GraphDatabase.driver(self.uri, auth=(self.user, self.pwd))
+                neo4j.GraphDatabase.driver(self.uri, auth=(self.user, self.pwd))
         except Exception as e:
             print("Failed to create the driver:", e)
 
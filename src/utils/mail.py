@@ -7,10 +7,21 @@ import re
 import email
 import imaplib
 from email.header import decode_header
-from exchangelib import Credentials, Account, Configuration, DELEGATE
 
-HOTMAIL_USER = os.environ['HOTMAIL_USER']
-HOTMAIL_PWD =  os.environ['HOTMAIL_PWD']
+from utils.utils import lazy_import
+
+exchangelib = lazy_import('exchangelib')
+
+# NB: Hotmail credentials are read from the environment when used rather
+# than at import time, see the module __getattr__ below.
+
+def __getattr__(name):
+    if name == 'HOTMAIL_USER':
+        return os.environ['HOTMAIL_USER']
+    elif name == 'HOTMAIL_PWD':
+        return os.environ['HOTMAIL_PWD']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 # ********************************************************************************
 # Part 1: Sending Mail
@@ -56,7 +67,9 @@ def send_email(receiver_email, subject, content):
 # the actual code might need to be adjusted based on the exact
 # requirements and email server settings:
 
-def get_emails_from_sender(sender_email, user=HOTMAIL_USER, pwd=HOTMAIL_PWD):
+def get_emails_from_sender(sender_email, user=None, pwd=None):
+    user = user or os.environ['HOTMAIL_USER']
+    pwd = pwd or os.environ['HOTMAIL_PWD']
     email = f'{user}@hotmail.com'
     
     # Set up the IMAP client
@@ -119,19 +132,21 @@ def get_emails_from_sender(sender_email, user=HOTMAIL_USER, pwd=HOTMAIL_PWD):
 
 SENDER = "noreply@medium.com"
 
-def get_hotmail_messages(sender=SENDER, user=HOTMAIL_USER, pwd=HOTMAIL_PWD):
+def get_hotmail_messages(sender=SENDER, user=None, pwd=None):
     
+    user = user or os.environ['HOTMAIL_USER']
+    pwd = pwd or os.environ['HOTMAIL_PWD']
     email = f'{user}@hotmail.com'
 
-    credentials = Credentials(email, pwd)
+    credentials = exchangelib.Credentials(email, pwd)
 
-    config = Configuration(server="outlook.office365.com",
-                           credentials=credentials)
+    config = exchangelib.Configuration(server="outlook.office365.com",
+                                       credentials=credentials)
 
-    account = Account(primary_smtp_address="delaray@hotmail.com",
-                      config=config,
-                      autodiscover=False,
-                      access_type=DELEGATE)
+    account = exchangelib.Account(primary_smtp_address="delaray@hotmail.com",
+                                  config=config,
+                                  autodiscover=False,
+                                  access_type=exchangelib.DELEGATE)
 
     folder = account.inbox
     
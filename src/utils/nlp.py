@@ -16,11 +16,12 @@ import re
 import logging
 from functools import reduce
 
+# Project imports
+from utils.utils import lazy_import
+
 # Data science imports
-from numpy import dtype
-import pandas as pd
-import pandas_gbq
-import nltk
+pd = lazy_import('pandas')
+nltk = lazy_import('nltk')
 
 
 # ------------------------------------------------------------
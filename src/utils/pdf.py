@@ -36,9 +36,11 @@
 import os
 import re
 import platform
-import pandas as pd
 
-from PyPDF2 import PdfReader
+from utils.utils import lazy_import
+
+pd = lazy_import('pandas')
+PyPDF2 = lazy_import('PyPDF2')
 
 
 # ********************************************************************************
@@ -120,7 +122,7 @@ def load_pdf_directory(dir):
 
 def extract_information(pdf_path):
     with open(pdf_path, 'rb') as f:
-        pdf = PdfReader(f)
+        pdf = PyPDF2.PdfReader(f)
         information = pdf.metadata
         number_of_pages = len(pdf.pages)
 
@@ -246,7 +248,7 @@ def parse_authors(page):
 
 def parse_document(pathname):
     with open(pathname, 'rb') as f:
-        reader = PdfReader(f)
+        reader = PyPDF2.PdfReader(f)
         pages = reader.pages
         title = parse_title(pages[0])
         authors = parse_authors(pages[0])
@@ -3,12 +3,14 @@
 # ***********************************************************************************
 
 import os
-import pandas as pd
 import datetime as datetime
 
-from utils.utils import timing
+from utils.utils import timing, lazy_import
 from utils.files import load_csv, save_csv
 from utils.storage import data_directory_fs, run_pdbq
+from utils.storage import save_data as save_dataset, load_data as load_dataset
+
+pd = lazy_import('pandas')
 
 # ***********************************************************************************
 # User Web Views and Purchases Tables
@@ -105,6 +107,47 @@ def save_products_purchased(df, bu, data_date, ext='csv'):
     return True
 
 
+# ----------------------------------------------------------------------------------
+# Partitioned Product Purchases
+# ----------------------------------------------------------------------------------
+
+# NB: These store all purchases of a BU as a single dataset partitioned
+# by year and month of the order date, so a date range only reads the
+# months it spans.
+
+PURCHASES_DATASET = 'products-purchased'
+
+
+def save_products_purchased_dataset(df, bu, destination='file', data_type='csv'):
+    'Saves df to the year/month partitions of the purchases dataset of bu.'
+
+    dates = pd.to_datetime(df['orderDate'])
+    df = df.assign(year=dates.dt.strftime('%Y'), month=dates.dt.strftime('%m'))
+    save_dataset(bu, PURCHASES_DATASET, data_type, df, destination,
+                 folder='purchases', partition_cols=['year', 'month'])
+
+    return True
+
+
+def load_products_purchased_range(bu, start_date, end_date, source='file',
+                                  data_type='csv'):
+    'Returns the purchases of bu between start_date and end_date inclusive.'
+
+    def in_range(partition):
+        month = f"{partition['year']}-{partition['month']}"
+        return start_date[:7] <= month <= end_date[:7]
+
+    df = load_dataset(bu, PURCHASES_DATASET, data_type, source,
+                      folder='purchases', partition_filter=in_range)
+    if df.shape[0] == 0:
+        return df
+
+    dates = pd.to_datetime(df['orderDate']).dt.strftime('%Y-%m-%d')
+    return df[(dates >= start_date) & (dates <= end_date)].reset_index(drop=True)
+
+
+# ----------------------------------------------------------------------------------
+
 def month_date_range(year, month):
     'Return start and end dates of a particular month.'
     
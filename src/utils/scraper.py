@@ -1,15 +1,16 @@
 import re
-from bs4 import BeautifulSoup
-from selenium import webdriver
 
-options = webdriver.ChromeOptions()
+from utils.utils import lazy_import
+
+bs4 = lazy_import('bs4')
+webdriver = lazy_import('selenium.webdriver')
 
 class Edito:
     def __init__(self, url):
         self.url = url
-        browser = webdriver.Chrome(options=options)
+        browser = webdriver.Chrome(options=webdriver.ChromeOptions())
         browser.get(url)
-        self.htmlContent = BeautifulSoup(browser.page_source, "html.parser")
+        self.htmlContent = bs4.BeautifulSoup(browser.page_source, "html.parser")
         title = self.htmlContent.find("h1")
         self.title = title.string if title is not None else ''
         subTitles = self.htmlContent.find_all("h2", {"class": re.compile('article')})
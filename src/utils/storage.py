@@ -12,27 +12,56 @@
 import os
 import re
 import io
+import csv
+import json
+import base64
+import asyncio
+import hashlib
+import queue
+import atexit
+import shutil
+import tempfile
+import threading
+from uuid import uuid4
+from functools import partial
+from collections import Counter
+from types import SimpleNamespace
+from time import time, sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Project Imports
+from utils.utils import lazy_import
+from utils.files import load_csv, save_csv, load_csv_header
+from utils.files import load_text_file, save_text_file
+from utils.files import load_dict, save_dict, files_in_dir, scan_files
+from utils.files import save_jsonl, append_jsonl, iter_jsonl
+from utils.files import read_excel, write_excel
+from utils.files import load_parquet, save_parquet, stream_parquet
+from utils.files import load_npy, save_npy, load_npz, save_npz
+from utils.files import COMPRESSION_EXTENSIONS, infer_compression
+from utils.files import compressed_filename, find_compressed_file
+from utils.data import compact_dtypes
+
+# NB: Third party packages are imported on first use, see lazy_import.
 
 # Data science imports
-import numpy as np
-from numpy import dtype
-import pandas as pd
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
 
 # GCP Imports
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from google.cloud import bigquery
-from google.cloud import storage
-import gcsfs
-import pandas_gbq
-
-# Project Imports
-from utils.files import load_csv, save_csv
-from utils.files import load_text_file, save_text_file
-from utils.data import save_dict
+gspread = lazy_import('gspread')
+oauth2client_service_account = lazy_import('oauth2client.service_account')
+service_account = lazy_import('google.oauth2.service_account')
+discovery = lazy_import('googleapiclient.discovery')
+bigquery = lazy_import('google.cloud.bigquery')
+bigquery_storage = lazy_import('google.cloud.bigquery_storage')
+storage = lazy_import('google.cloud.storage')
+google_exceptions = lazy_import('google.api_core.exceptions')
+requests = lazy_import('requests')
+gcsfs = lazy_import('gcsfs')
+google_crc32c = lazy_import('google_crc32c')
+pandas_gbq = lazy_import('pandas_gbq')
 
 import logging
 logger = logging.getLogger()
@@ -49,8 +78,203 @@ PROJECT_DATASET = 'hmbu_opus_knowledge_graph'
 KGML_BUCKET = 'ccdp-kgml-hmbu-dev'
 KGML_STORAGE = 'orphans'
 
-# Local FileSystem Data Directory 
-DATA_DIR = os.environ['DATA_DIR']
+# NB: DATA_DIR and AUTH_FILE are read from the environment when used
+# rather than at import time, see the module __getattr__ below.
+
+def data_dir():
+    'Returns the local filesystem data directory.'
+    return os.environ['DATA_DIR']
+
+
+def auth_file():
+    'Returns the pathname of the GCP service account credentials.'
+    return os.environ['GOOGLE_APPLICATION_CREDENTIALS']
+
+
+def __getattr__(name):
+    if name == 'DATA_DIR':
+        return data_dir()
+    elif name == 'AUTH_FILE':
+        return auth_file()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+# Local blob cache: maximum total size in bytes of cached downloads and
+# maximum number of seconds manifest changes are kept in memory
+BLOB_CACHE_MAX_SIZE = int(os.environ.get('BLOB_CACHE_MAX_SIZE', 50 * 2**30))
+BLOB_CACHE_MANIFEST = '.blob-cache.json'
+BLOB_CACHE_SAVE_INTERVAL = 5.0
+
+# Default parquet compression codec
+PARQUET_COMPRESSION = 'snappy'
+
+# Data types whose files may be compressed with gzip or zstd as a whole
+COMPRESSIBLE_TYPES = ['csv', 'json', 'jsonl', 'text', 'html']
+
+# Default number of parallel BigQuery Storage Read API streams
+BQ_READ_STREAMS = 4
+
+# Query result cache: directory under DATA_DIR, maximum size in bytes and
+# default time to live in seconds (None means results never expire)
+QUERY_CACHE_DIR = '.query-cache'
+QUERY_CACHE_MAX_SIZE = int(os.environ.get('QUERY_CACHE_MAX_SIZE', 10 * 2**30))
+QUERY_CACHE_TTL = 24 * 3600
+
+# Maximum number of rows staged per BigQuery load job file
+BQ_LOAD_CHUNKSIZE = 1000000
+
+# Bulk transfers: number of concurrent uploads/downloads per call
+TRANSFER_WORKERS = int(os.environ.get('TRANSFER_WORKERS', 8))
+TRANSFER_RETRIES = 3
+
+# Google Drive downloads: chunk size in bytes, retries per file and
+# number of concurrent downloads
+DRIVE_CHUNKSIZE = 8 * 2**20
+DRIVE_RETRIES = 5
+DRIVE_WORKERS = int(os.environ.get('DRIVE_WORKERS', 4))
+
+# Google Sheets writes: maximum number of cells per batch update request
+SHEETS_BATCH_CELLS = 40000
+
+# Write-behind uploads: number of background upload threads
+WRITE_BEHIND_WORKERS = int(os.environ.get('WRITE_BEHIND_WORKERS', 4))
+WRITE_BEHIND_DIR = '.write-behind'
+
+# Async API: number of threads running blocking I/O for coroutines
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', 16))
+
+# Bucket listing index: seconds a prefix listing is trusted and whether
+# listings are also kept on disk under DATA_DIR across processes
+LISTING_TTL = int(os.environ.get('LISTING_TTL', 300))
+LISTING_INDEX_PERSIST = os.environ.get('LISTING_INDEX_PERSIST', '0') == '1'
+LISTING_INDEX_FILE = '.listing-index.json'
+
+# ****************************************************************
+# GCP CLIENTS
+# ****************************************************************
+
+# NB: Clients are created on first use and shared by the whole process.
+# A forked child must not reuse the connections of its parent, so the
+# registry is emptied in the child after a fork. Google API discovery
+# services are not thread safe and are therefore kept in thread local
+# storage, so that they are released along with their thread.
+
+SHEETS_SCOPES = ['https://spreadsheets.google.com/feeds',
+                 'https://www.googleapis.com/auth/drive']
+
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive']
+
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+_thread_clients = threading.local()
+
+
+def _forget_clients():
+    'Drops inherited clients without closing them, e.g. after a fork.'
+    global _clients_lock, _clients_pid, _thread_clients
+    _clients.clear()
+    _clients_lock = threading.Lock()
+    _clients_pid = os.getpid()
+    _thread_clients = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_clients)
+
+
+def get_client(kind, key, factory):
+    'Returns the shared client of kind for key, creating it with factory.'
+
+    if os.getpid() != _clients_pid:
+        _forget_clients()
+
+    client = _clients.get((kind, key))
+    if client is None:
+        with _clients_lock:
+            client = _clients.get((kind, key))
+            if client is None:
+                client = factory()
+                _clients[(kind, key)] = client
+    return client
+
+
+def reset_clients(kind=None):
+    'Closes and forgets the shared clients, or only those of kind.'
+
+    if kind is None or kind == 'drive':
+        _thread_clients.__dict__.pop('drive', None)
+    with _clients_lock:
+        for ident in list(_clients):
+            if kind is None or ident[0] == kind:
+                client = _clients.pop(ident)
+                try:
+                    # Executors are shut down without waiting for their tasks
+                    if hasattr(client, 'shutdown'):
+                        client.shutdown(wait=False)
+                    elif hasattr(client, 'close'):
+                        client.close()
+                except Exception as err:
+                    logger.warning(f'Error closing {ident[0]} client:\n{err}')
+    return True
+
+
+# ----------------------------------------------------------------
+
+def storage_client(project=PROJECT_ID):
+    return get_client('storage', project,
+                      lambda: storage.Client(project=project))
+
+
+def bigquery_client(project=PROJECT_ID):
+    return get_client('bigquery', project,
+                      lambda: bigquery.Client(project=project))
+
+
+def bqstorage_client():
+    return get_client('bqstorage', None, bigquery_storage.BigQueryReadClient)
+
+
+def gcs_filesystem():
+    return get_client('gcsfs', None, gcsfs.GCSFileSystem)
+
+
+def sheets_client(json_key_file=None):
+    'Returns the shared gspread client authorized with json_key_file.'
+
+    json_key_file = json_key_file or auth_file()
+    credentials = oauth2client_service_account.ServiceAccountCredentials
+
+    def authorize():
+        creds = credentials.from_json_keyfile_name(json_key_file, SHEETS_SCOPES)
+        return gspread.authorize(creds)
+
+    return get_client('sheets', json_key_file, authorize)
+
+
+def drive_credentials(json_key_file=None):
+    json_key_file = json_key_file or auth_file()
+    return get_client('drive-credentials', json_key_file,
+                      lambda: service_account.Credentials.from_service_account_file(
+                          json_key_file, scopes=DRIVE_SCOPES))
+
+
+def drive_service(json_key_file=None):
+    'Returns the Google Drive service of the current thread.'
+
+    json_key_file = json_key_file or auth_file()
+    if os.getpid() != _clients_pid:
+        _forget_clients()
+    services = getattr(_thread_clients, 'drive', None)
+    if services is None:
+        services = _thread_clients.drive = {}
+    if json_key_file not in services:
+        creds = drive_credentials(json_key_file)
+        services[json_key_file] = discovery.build('drive', 'v3',
+                                                  credentials=creds,
+                                                  cache_discovery=False)
+    return services[json_key_file]
+
 
 # ****************************************************************
 # Part 1:  Pandas GBQ
@@ -148,13 +372,295 @@ def bq_table_id(table_name, env='dev'):
 # Pandas GBQ API
 # --------------------------------------------------------------
 
-def run_pdbq(query, project_id=PROJECT_ID):
+def run_pdbq(query, project_id=PROJECT_ID, fast=False,
+             max_streams=BQ_READ_STREAMS, as_batches=False, client=None,
+             read_client=None, cache=False, cache_ttl=QUERY_CACHE_TTL,
+             optimize_memory=False, ordered=None):
     'Uses Pandas-GBQ to run a Google BQ query and returns a dataframe.'
 
-    df = pd.read_gbq(query, project_id=project_id)
+    # NB: Only dataframe results are cached, not batch iterators.
+    cache = cache is True and as_batches is False
+    if cache is True:
+        df = cached_query_result(query, project_id=project_id, ttl=cache_ttl)
+        if df is not None:
+            return compact_dtypes(df) if optimize_memory is True else df
+
+    # The fast path reads the results through the Storage Read API
+    if fast is True:
+        df = run_bq_storage_query(query, project_id=project_id,
+                                  max_streams=max_streams,
+                                  as_batches=as_batches, client=client,
+                                  read_client=read_client, ordered=ordered)
+    else:
+        df = pd.read_gbq(query, project_id=project_id)
+
+    if cache is True:
+        cache_query_result(query, df, project_id=project_id)
+    if optimize_memory is True and as_batches is False:
+        df = compact_dtypes(df)
     return df
 
 
+# --------------------------------------------------------------
+# Query Result Cache
+# --------------------------------------------------------------
+
+# NB: Query results are cached as parquet files under DATA_DIR, keyed
+# by the project and the normalized SQL, i.e. with comments and
+# redundant whitespace removed but string literals left untouched.
+
+QUERY_CACHE_STATS = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0,
+                     'invalidations': 0}
+
+_query_cache_lock = threading.RLock()
+
+_SQL_LITERALS_OR_SPACE = re.compile(
+    r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)"""
+    r'|((?:\s|--[^\n]*|#[^\n]*|/\*.*?\*/)+)', re.S)
+
+
+def normalize_sql(query):
+    'Returns query without comments, redundant whitespace or trailing ;'
+
+    def replace(match):
+        literal, _ = match.groups()
+        return literal if literal is not None else ' '
+
+    return _SQL_LITERALS_OR_SPACE.sub(replace, query).strip().rstrip(';').strip()
+
+
+def query_cache_key(query, project_id=PROJECT_ID):
+    text = f'{project_id}\n{normalize_sql(query)}'
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def query_cache_directory():
+    directory = os.path.join(data_dir(), QUERY_CACHE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def query_cache_manifest_pathname():
+    return os.path.join(query_cache_directory(), 'manifest.json')
+
+
+# --------------------------------------------------------------
+
+def cached_query_result(query, project_id=PROJECT_ID, ttl=QUERY_CACHE_TTL):
+    'Returns the cached dataframe of query or None if absent or expired.'
+
+    key = query_cache_key(query, project_id=project_id)
+    with _query_cache_lock:
+        pathname = query_cache_manifest_pathname()
+        manifest = load_manifest(pathname)
+        entry = manifest.get(key)
+        if entry is None or os.path.isfile(entry['path']) is False:
+            QUERY_CACHE_STATS['misses'] += 1
+            return None
+        if ttl is not None and time() - entry['created'] > ttl:
+            QUERY_CACHE_STATS['expired'] += 1
+            QUERY_CACHE_STATS['misses'] += 1
+            return None
+        entry['accessed'] = time()
+        save_manifest(manifest, pathname)
+        QUERY_CACHE_STATS['hits'] += 1
+    return load_parquet(entry['path'])
+
+
+def cache_query_result(query, df, project_id=PROJECT_ID):
+    'Stores the dataframe of query in the cache and enforces its size.'
+
+    key = query_cache_key(query, project_id=project_id)
+    file_pathname = os.path.join(query_cache_directory(), f'{key}.parquet')
+    try:
+        save_parquet(df, file_pathname, compression=PARQUET_COMPRESSION)
+    except Exception as err:
+        logger.error(f'Error caching query result:\n{err}')
+        return False
+
+    with _query_cache_lock:
+        pathname = query_cache_manifest_pathname()
+        manifest = load_manifest(pathname)
+        now = time()
+        manifest[key] = {'path': file_pathname,
+                         'size': os.path.getsize(file_pathname),
+                         'project': project_id,
+                         'query': normalize_sql(query)[:1000],
+                         'created': now,
+                         'accessed': now}
+        evicted = evict_lru(manifest, QUERY_CACHE_MAX_SIZE, keep=key)
+        QUERY_CACHE_STATS['evictions'] += len(evicted)
+        save_manifest(manifest, pathname)
+    return True
+
+
+def invalidate_query_cache(query=None, project_id=PROJECT_ID):
+    'Removes the cached result of query, or all cached results if None.'
+
+    with _query_cache_lock:
+        pathname = query_cache_manifest_pathname()
+        manifest = load_manifest(pathname)
+        if query is None:
+            keys = list(manifest.keys())
+        else:
+            keys = [query_cache_key(query, project_id=project_id)]
+        for key in keys:
+            entry = manifest.pop(key, None)
+            if entry is not None:
+                if os.path.isfile(entry['path']):
+                    os.remove(entry['path'])
+                QUERY_CACHE_STATS['invalidations'] += 1
+        save_manifest(manifest, pathname)
+    return len(keys)
+
+
+def query_cache_stats():
+    'Returns the query cache hit/miss counts and current size.'
+
+    manifest = load_manifest(query_cache_manifest_pathname())
+    with _query_cache_lock:
+        stats = dict(QUERY_CACHE_STATS)
+    stats['entries'] = len(manifest)
+    stats['size'] = sum(entry['size'] for entry in manifest.values())
+    stats['max_size'] = QUERY_CACHE_MAX_SIZE
+    return stats
+
+
+def reset_query_cache_stats():
+    with _query_cache_lock:
+        for key in QUERY_CACHE_STATS:
+            QUERY_CACHE_STATS[key] = 0
+    return True
+
+
+# --------------------------------------------------------------
+# BigQuery Storage Read API
+# --------------------------------------------------------------
+
+# NB: The Storage Read API splits a table into streams that are read in
+# parallel as Arrow record batches, which is much faster than paging
+# query results through the REST API. The results of a query are read
+# from the temporary table the query job writes them to. Batches from
+# parallel streams arrive interleaved, so the results of queries with an
+# ORDER BY clause are read from a single stream.
+
+def is_ordered_query(query):
+    'Returns True if query has an ORDER BY clause.'
+    return re.search(r'\bORDER\s+BY\b', normalize_sql(query),
+                     flags=re.IGNORECASE) is not None
+
+
+def create_bq_read_session(table_id, project_id=PROJECT_ID,
+                           max_streams=BQ_READ_STREAMS, columns=None,
+                           read_client=None):
+    'Returns a Storage Read API session over table_id.'
+
+    read_client = bqstorage_client() if read_client is None else read_client
+    project, dataset, table = table_id.strip('`').replace(':', '.').split('.')
+    requested_session = {
+        'table': f'projects/{project}/datasets/{dataset}/tables/{table}',
+        'data_format': bigquery_storage.types.DataFormat.ARROW}
+    if columns is not None:
+        requested_session['read_options'] = {'selected_fields': columns}
+
+    return read_client.create_read_session(parent=f'projects/{project_id}',
+                                           read_session=requested_session,
+                                           max_stream_count=max_streams)
+
+
+def bq_session_schema(session):
+    'Returns the Arrow schema of a read session.'
+    return pa.ipc.read_schema(
+        pa.py_buffer(session.arrow_schema.serialized_schema))
+
+
+def read_bq_batches(table_id, project_id=PROJECT_ID, max_streams=BQ_READ_STREAMS,
+                    columns=None, read_client=None, session=None):
+    'Yields the Arrow record batches of table_id read from parallel streams.'
+
+    read_client = bqstorage_client() if read_client is None else read_client
+    if session is None:
+        session = create_bq_read_session(table_id, project_id=project_id,
+                                         max_streams=max_streams,
+                                         columns=columns,
+                                         read_client=read_client)
+    streams = list(session.streams)
+    batches = queue.Queue(maxsize=2 * max(1, len(streams)))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while stop.is_set() is False:
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read_stream(stream):
+        try:
+            reader = read_client.read_rows(stream.name)
+            for page in reader.rows(session).pages:
+                put(page.to_arrow())
+        except Exception as err:
+            put(err)
+        finally:
+            put(done)
+
+    threads = [threading.Thread(target=read_stream, args=(stream,), daemon=True)
+               for stream in streams]
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = len(threads)
+        while remaining > 0:
+            item = batches.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def batches_to_df(batches, schema=None):
+    'Returns a dataframe of an iterable of Arrow record batches.'
+
+    batches = list(batches)
+    if len(batches) == 0:
+        return pd.DataFrame() if schema is None else \
+            schema.empty_table().to_pandas()
+    return pa.Table.from_batches(batches, schema=schema).to_pandas()
+
+
+def run_bq_storage_query(query, project_id=PROJECT_ID,
+                         max_streams=BQ_READ_STREAMS, as_batches=False,
+                         client=None, read_client=None, ordered=None):
+    'Runs query and reads its results through the Storage Read API.'
+
+    client = bigquery_client(project_id) if client is None else client
+    query_job = client.query(query)
+    query_job.result()
+    table = query_job.destination
+    table_id = f'{table.project}.{table.dataset_id}.{table.table_id}'
+
+    # Ordered results are read from a single stream, see NB above
+    if ordered is None:
+        ordered = is_ordered_query(query)
+    read_client = bqstorage_client() if read_client is None else read_client
+    session = create_bq_read_session(table_id, project_id=project_id,
+                                     max_streams=1 if ordered else max_streams,
+                                     read_client=read_client)
+    batches = read_bq_batches(table_id, project_id=project_id,
+                              read_client=read_client, session=session)
+    if as_batches is True:
+        return batches
+    return batches_to_df(batches, schema=bq_session_schema(session))
+
+
 # --------------------------------------------------------------
 
 def create_bq_table(table_name, df, project_id=PROJECT_ID, env='dev'):
@@ -172,7 +678,7 @@ def create_bq_table(table_name, df, project_id=PROJECT_ID, env='dev'):
 def run_bq_query(query, client=None):
     'Runs a qury on Google Big Query and returns the results.'
 
-    client = bigquery.Client(project=PROJECT_ID) if client is None else client
+    client = bigquery_client() if client is None else client
     query_job = client.query(query)
 
     # Waits for job to complete.
@@ -187,7 +693,7 @@ def delete_bq_table(table_name, project_id=PROJECT_ID, env='dev', client=None):
 
     # Construct a BigQuery client object unless provide
     if client is None:
-        client = bigquery.Client(project=PROJECT_ID)
+        client = bigquery_client()
 
     table_id = bq_table_id(table_name, env=env)[1:-1]
 
@@ -208,16 +714,26 @@ def delete_bq_table(table_name, project_id=PROJECT_ID, env='dev', client=None):
 def ensure_bq_column_type_values(df):
     'Replaces NaN values with actual value based on column type.'
     
+    # NB: This handles the compacted dtypes of compact_dtypes, i.e. all
+    # integer and float widths, categoricals and pyarrow strings.
     types = df.dtypes
     if 'alternatives' in df.columns:
         df['alternatives'].fillna('')
     for col in df.columns:
         col_type = types.loc[col]
-        if col_type == dtype('int32') or col_type == dtype('int64'):
+        if isinstance(col_type, pd.CategoricalDtype):
+            if df[col].isna().any():
+                if '' not in col_type.categories:
+                    df[col] = df[col].cat.add_categories('')
+                df[col] = df[col].fillna('')
+        elif pd.api.types.is_bool_dtype(col_type):
+            continue
+        elif pd.api.types.is_integer_dtype(col_type):
             df[col] = df[col].fillna(0)
-        if col_type == dtype('float32') or col_type == dtype('float64'):
+        elif pd.api.types.is_float_dtype(col_type):
             df[col] = df[col].fillna(0.0)
-        if col_type == dtype('object'):
+        elif col_type == np.dtype('object') or \
+                pd.api.types.is_string_dtype(col_type):
             df[col] = df[col].fillna('')
     df = df.fillna('')
     
@@ -226,17 +742,140 @@ def ensure_bq_column_type_values(df):
 
 # ----------------------------------------------------------------------
 
-def table_to_bq(df, project=PROJECT_ID, dataset='', table_name=''):
+# NB: Tables are written with load jobs of compressed parquet files
+# rather than streamed rows. The mode is one of:
+#
+#   replace: the table is overwritten with df
+#   append:  the rows of df are appended to the table
+#   upsert:  the rows of df are merged into the table on the key columns,
+#            i.e. matching rows are updated and the others inserted
+#
+# df may also be an iterable of dataframes, e.g. from load_data with a
+# chunksize, in which case frames larger than memory are written.
+
+def df_chunks(data, chunksize=BQ_LOAD_CHUNKSIZE):
+    'Yields data in dataframes of at most chunksize rows.'
+
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, max(data.shape[0], 1), chunksize):
+            yield data.iloc[start:start + chunksize]
+    else:
+        yield from data
+
+
+def load_df_to_bq(df, table_id, write_disposition, client=None):
+    'Stages df as a parquet file and loads it into table_id with one job.'
+
+    client = bigquery_client() if client is None else client
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=write_disposition)
+
+    with tempfile.TemporaryDirectory() as directory:
+        pathname = os.path.join(directory, 'staging.parquet')
+        save_parquet(df, pathname, compression=PARQUET_COMPRESSION)
+        with open(pathname, 'rb') as source:
+            job = client.load_table_from_file(source, table_id,
+                                              job_config=job_config)
+        job.result()
+
+    return job.output_rows
+
+
+def load_chunks_to_bq(data, table_id, truncate, chunksize=BQ_LOAD_CHUNKSIZE,
+                      client=None):
+    'Loads data chunk by chunk and returns the loaded columns.'
+
+    rows, columns = 0, []
+    for chunk in df_chunks(data, chunksize=chunksize):
+        disposition = bigquery.WriteDisposition.WRITE_TRUNCATE if truncate \
+            else bigquery.WriteDisposition.WRITE_APPEND
+        chunk = ensure_bq_column_type_values(chunk.copy())
+        rows += load_df_to_bq(chunk, table_id, disposition, client=client)
+        columns = list(chunk.columns)
+        truncate = False
+    logger.warning(f'\nLoaded {rows} rows into {table_id}.\n')
+    return columns
+
+
+def bq_table_exists(table_id, client=None):
+    client = bigquery_client() if client is None else client
+    try:
+        client.get_table(table_id)
+        return True
+    except google_exceptions.NotFound:
+        return False
+
+
+def key_columns(keys):
+    'Returns keys, a column name or a list of column names, as a list.'
+    return [keys] if isinstance(keys, str) else list(keys)
+
+
+def merge_bq_sql(target_id, staging_id, keys, columns):
+    'Returns the MERGE statement upserting staging_id into target_id.'
+
+    # NB: Rows are inserted by column name so that the staging table may
+    # hold a subset of the target columns, in any order.
+    keys = key_columns(keys)
+    on = ' AND '.join(f'T.`{key}` = S.`{key}`' for key in keys)
+    updates = ', '.join(f'`{col}` = S.`{col}`' for col in columns
+                        if col not in keys)
+    matched = f'WHEN MATCHED THEN UPDATE SET {updates}' if updates else ''
+    names = ', '.join(f'`{col}`' for col in columns)
+    values = ', '.join(f'S.`{col}`' for col in columns)
+    return f"""
+    MERGE `{target_id}` T
+    USING `{staging_id}` S
+    ON {on}
+    {matched}
+    WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})
+    """
+
+
+def merge_bq_tables(target_id, staging_id, keys, columns, client=None):
+    'Merges the rows of staging_id into target_id on the key columns.'
+
+    query = merge_bq_sql(target_id, staging_id, keys, columns)
+    return run_bq_query(query, client=client)
+
+
+# ----------------------------------------------------------------------
+
+def table_to_bq(df, project=PROJECT_ID, dataset='', table_name='',
+                mode='replace', keys=None, chunksize=BQ_LOAD_CHUNKSIZE,
+                env='dev'):
     'Write dataframe to Big Query.'
 
-    # Delete table if it already exists
-    delete_bq_table(table_name, project_id=project)
+    client = bigquery_client(project)
+    dataset = BQ_DATASET_NAME if dataset in [None, ''] else dataset
+    table_id = f'{bq_project_name(env)}.{dataset}.{table_name}'
 
-    # Ensure resasonable values
-    df = ensure_bq_column_type_values(df)
-    
-    # Create the new table
-    create_bq_table(table_name,  df, project_id=project)
+    if mode == 'upsert' and keys is None:
+        logger.error('Error: Upserts require key columns.')
+        return False
+    keys = key_columns(keys) if keys is not None else None
+
+    # Upserts into a new table are plain loads
+    if mode == 'upsert' and bq_table_exists(table_id, client=client) is False:
+        mode = 'replace'
+
+    if mode == 'replace' or mode == 'append':
+        load_chunks_to_bq(df, table_id, truncate=(mode == 'replace'),
+                          chunksize=chunksize, client=client)
+
+    elif mode == 'upsert':
+        staging_id = f'{table_id}_staging_{uuid4().hex[:8]}'
+        try:
+            columns = load_chunks_to_bq(df, staging_id, truncate=True,
+                                        chunksize=chunksize, client=client)
+            merge_bq_tables(table_id, staging_id, keys, columns, client=client)
+        finally:
+            client.delete_table(staging_id, not_found_ok=True)
+
+    else:
+        logger.error(f'Error: Invalid BQ write mode {mode}.')
+        return False
 
     return True
 
@@ -249,10 +888,11 @@ def table_to_bq(df, project=PROJECT_ID, dataset='', table_name=''):
 # Read & Write Buckets
 # --------------------------------------------------------------
 
-def blobs_in_bucket(bucket=KGML_BUCKET, prefix=""):
-    client = storage.Client(project=PROJECT_ID)
+def blobs_in_bucket(bucket=KGML_BUCKET, prefix="", client=None,
+                    delimiter=None):
+    client = storage_client() if client is None else client
     bucket = client.bucket(bucket)
-    blobs = client.list_blobs(bucket, prefix=prefix)
+    blobs = client.list_blobs(bucket, prefix=prefix, delimiter=delimiter)
     return blobs
 
 
@@ -261,43 +901,297 @@ def blob_name(blob):
     return blob.name.split('/')[-1]
 
 
+# --------------------------------------------------------------
+# Bucket Listing Index
+# --------------------------------------------------------------
+
+# NB: Listings are made one directory at a time and kept in memory for
+# LISTING_TTL seconds, so existence, size and generation queries on the
+# files of a directory cost a single listing. A prefix ending with '/'
+# lists that directory recursively. Any other prefix, e.g. a blob name,
+# only lists the files directly in its directory, not its subdirectories,
+# and matches those files only. Writes made through this module update
+# the index; writes made by others are only seen once the listing
+# expires, so downloads check the generation of indexed blobs first, see
+# download_blob_cached. Listings may also be persisted under DATA_DIR.
+
+LISTING_STATS = {'hits': 0, 'misses': 0}
+
+_listing_index = {}
+_listing_lock = threading.RLock()
+_listing_loaded = False
+
+
+def _forget_listings():
+    'Drops listings whose blobs are bound to the clients of the parent.'
+    global _listing_lock, _listing_loaded
+    _listing_index.clear()
+    _listing_lock = threading.RLock()
+    _listing_loaded = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_listings)
+
+
+def listing_index_pathname():
+    return os.path.join(data_dir(), LISTING_INDEX_FILE)
+
+
+def listing_prefix(name):
+    'Returns the directory of a blob name, i.e. the prefix that is listed.'
+    return name[:name.rfind('/') + 1]
+
+
+def load_listing_index():
+    'Loads the listings persisted on disk into the in-memory index.'
+
+    global _listing_loaded
+    with _listing_lock:
+        if _listing_loaded is True:
+            return False
+        _listing_loaded = True
+        if LISTING_INDEX_PERSIST is False:
+            return False
+        client = storage_client()
+        for listing in load_manifest(listing_index_pathname()).values():
+            gs_bucket = client.bucket(listing['bucket'])
+            blobs = {}
+            for properties in listing['blobs']:
+                blob = gs_bucket.blob(properties['name'])
+                blob._set_properties(properties)
+                blobs[blob.name] = blob
+            key = (listing['bucket'], listing['prefix'])
+            _listing_index.setdefault(key, {
+                'time': listing['time'], 'blobs': blobs,
+                'recursive': listing.get('recursive', True)})
+    return True
+
+
+def save_listing_index():
+    'Persists the in-memory listings if LISTING_INDEX_PERSIST is set.'
+
+    if LISTING_INDEX_PERSIST is False:
+        return False
+    with _listing_lock:
+        manifest = {f'{bucket}/{prefix}': {
+                        'bucket': bucket, 'prefix': prefix,
+                        'time': listing['time'],
+                        'recursive': listing['recursive'],
+                        'blobs': [blob._properties
+                                  for blob in listing['blobs'].values()]}
+                    for (bucket, prefix), listing in _listing_index.items()}
+        save_manifest(manifest, listing_index_pathname())
+    return True
+
+
+def listing_covers(listed_prefix, listing, name):
+    'Returns True if a listing of listed_prefix includes name, or prefix.'
+
+    if name.startswith(listed_prefix) is False:
+        return False
+    return listing['recursive'] is True or \
+        (name != listed_prefix and '/' not in name[len(listed_prefix):])
+
+
+def indexed_listing(prefix, bucket=KGML_BUCKET, ttl=LISTING_TTL):
+    'Returns the fresh listing of a directory enclosing prefix, if any.'
+
+    load_listing_index()
+    now = time()
+    with _listing_lock:
+        for (listed_bucket, listed_prefix), listing in _listing_index.items():
+            if listed_bucket == bucket and now - listing['time'] < ttl and \
+               listing_covers(listed_prefix, listing, prefix):
+                return listing
+    return None
+
+
+def list_blobs_indexed(prefix, bucket=KGML_BUCKET, ttl=LISTING_TTL,
+                       client=None):
+    'Returns the sorted blobs whose names start with prefix.'
+
+    listing = indexed_listing(prefix, bucket=bucket, ttl=ttl)
+    if listing is not None:
+        with _listing_lock:
+            LISTING_STATS['hits'] += 1
+            blobs = [blob for name, blob in listing['blobs'].items()
+                     if name.startswith(prefix)]
+        return sorted(blobs, key=lambda blob: blob.name)
+
+    # List the whole directory so that its other files are indexed too
+    directory = listing_prefix(prefix)
+    recursive = prefix == directory
+    blobs = list(blobs_in_bucket(bucket, directory, client=client,
+                                 delimiter=None if recursive else '/'))
+    with _listing_lock:
+        LISTING_STATS['misses'] += 1
+        _listing_index[(bucket, directory)] = {
+            'time': time(), 'blobs': {blob.name: blob for blob in blobs},
+            'recursive': recursive}
+    save_listing_index()
+    return [blob for blob in blobs if blob.name.startswith(prefix)]
+
+
+def find_blob(name, bucket=KGML_BUCKET, ttl=LISTING_TTL):
+    'Returns the indexed blob named name, e.g. for its size or generation.'
+
+    for blob in list_blobs_indexed(name, bucket=bucket, ttl=ttl):
+        if blob.name == name:
+            return blob
+    return None
+
+
+# --------------------------------------------------------------
+
+def index_blob(blob):
+    'Records a blob written by this process in the listings enclosing it.'
+
+    with _listing_lock:
+        for (bucket, prefix), listing in _listing_index.items():
+            if bucket == blob.bucket.name and \
+               listing_covers(prefix, listing, blob.name):
+                listing['blobs'][blob.name] = blob
+    save_listing_index()
+    return blob
+
+
+def unindex_blob(name, bucket=KGML_BUCKET):
+    'Removes a deleted blob from the listings enclosing it.'
+
+    with _listing_lock:
+        for (listed_bucket, prefix), listing in _listing_index.items():
+            if listed_bucket == bucket and name.startswith(prefix):
+                listing['blobs'].pop(name, None)
+    save_listing_index()
+    return True
+
+
+def invalidate_listings(bucket=None, prefix=''):
+    'Forgets the listings of bucket, or of all buckets, overlapping prefix.'
+
+    with _listing_lock:
+        for key in list(_listing_index):
+            listed_bucket, listed_prefix = key
+            if bucket is not None and listed_bucket != bucket:
+                continue
+            if listed_prefix.startswith(prefix) or \
+               prefix.startswith(listed_prefix):
+                del _listing_index[key]
+    save_listing_index()
+    return True
+
+
+def listing_stats():
+    'Returns the listing index hit/miss counts and number of listings.'
+
+    with _listing_lock:
+        stats = dict(LISTING_STATS)
+        stats['listings'] = len(_listing_index)
+    return stats
+
+
+# --------------------------------------------------------------
+
 def named_blobs(blob_pathname, bucket=KGML_BUCKET):
     'Returns the blob object corresponding to pathname.'
-    blobs = list(blobs_in_bucket(prefix=blob_pathname, bucket=bucket))
+    blobs = list_blobs_indexed(blob_pathname, bucket=bucket)
     if len(blobs) > 0:
         return blobs
     else:
         return None
 
 
-def blob_exists(name):
+def blob_exists(name, bucket=KGML_BUCKET):
     'Returns True if the named blob exists.'
-    blobs = list(blobs_in_bucket(prefix=name))
+    blobs = list_blobs_indexed(name, bucket=bucket)
     if len(blobs) > 0:
         return True
     else:
         return False
 
 
-def create_blob(name, bucket=KGML_BUCKET):
+def compressed_blob_name(blob_pathname, bucket=KGML_BUCKET):
+    'Returns the name of the most recent plain, gzip or zstd variant of a blob.'
+
+    names = [compressed_filename(blob_pathname, compression)
+             for compression in [None, *COMPRESSION_EXTENSIONS]]
+    blobs = [blob for blob in named_blobs(blob_pathname, bucket=bucket) or []
+             if blob.name in names]
+    if len(blobs) == 0:
+        return blob_pathname
+    return max(blobs, key=lambda blob: blob.updated).name
+
+
+def set_blob_encoding(blob, file_pathname):
+    'Sets the content encoding of blob from the extension of file_pathname.'
+
+    # NB: Google Storage decompresses gzip encoded blobs in transit, so
+    # gcsfs reads them as plain text. zstd blobs are stored as is.
+    if infer_compression(file_pathname) == 'gzip':
+        blob.content_encoding = 'gzip'
+    else:
+        blob.content_encoding = None
+    return blob
+
+
+def read_compression_gs(pathname):
+    'Returns the codec needed to decompress a blob read through gcsfs.'
+
+    compression = infer_compression(pathname)
+    if compression == 'gzip':
+        info = gcs_filesystem().info(pathname)
+        if info.get('contentEncoding') == 'gzip':
+            return None
+    return compression
+
+
+def create_blob(name, bucket=KGML_BUCKET, client=None):
     'Create a new google storgae blob directory.'
 
-    client = storage.Client(project=PROJECT_ID)
+    client = storage_client() if client is None else client
     bucket = client.bucket(bucket)
     blob = bucket.blob(name)
     blob.upload_from_string('')
-    return blob
+    return index_blob(blob)
 
 
-def load_csv_gs(pathname, project=PROJECT_ID):
+def load_csv_gs(pathname, project=PROJECT_ID, usecols=None, dtype=None):
     'Loads a CSV dirtectly from a blob and returns a dataframe.'
 
-    fs = gcsfs.GCSFileSystem()
+    fs = gcs_filesystem()
+    compression = read_compression_gs(pathname)
     with fs.open(pathname) as f:
-        df = pd.read_csv(f)
+        df = pd.read_csv(f, usecols=usecols, dtype=dtype,
+                         compression=compression)
     return df
 
 
+def stream_csv_gs(pathname, chunksize, usecols=None, dtype=None):
+    'Yields dataframes of chunksize rows read directly from a CSV blob.'
+
+    fs = gcs_filesystem()
+    compression = read_compression_gs(pathname)
+    with fs.open(pathname) as f:
+        with pd.read_csv(f, chunksize=chunksize, usecols=usecols,
+                         dtype=dtype, compression=compression) as reader:
+            yield from reader
+
+
+def load_parquet_gs(pathname, columns=None, filters=None):
+    'Loads a parquet file directly from a blob, pushing down the filters.'
+
+    return load_parquet(f'gs://{pathname}', columns=columns, filters=filters)
+
+
+def stream_parquet_gs(pathname, chunksize, columns=None):
+    'Yields dataframes of chunksize rows read directly from a parquet blob.'
+
+    fs = gcs_filesystem()
+    with fs.open(pathname) as f:
+        yield from stream_parquet(f, chunksize, columns=columns)
+
+
 # **************************************************************
 # Part 3: Data Persistence API
 # **************************************************************
@@ -310,9 +1204,9 @@ def data_directory_fs(name, target=None):
     'Return the directory path of a data.'
 
     if target is not None:
-        return os.path.join(DATA_DIR, name, target)
+        return os.path.join(data_dir(), name, target)
     else:
-        return os.path.join(DATA_DIR, name)
+        return os.path.join(data_dir(), name)
         
 
 
@@ -354,20 +1248,18 @@ def results_pathname(model_name, filename):
 def ensure_model_directory_fs(name, folder=None):
     "Create directories if they don't exist."
 
+    # NB: Coroutines and threads may create the same directories at once,
+    # so existing directories are never an error.
     directory = data_directory_fs(name)
-    if os.path.isdir(directory) is False:
-        
-        # This needs to be deprecated (see classifier)
-        os.makedirs(directory)
-        os.makedirs(directory + '/data')
-        os.makedirs(directory + '/model')
-        os.makedirs(directory + '/results')
+
+    # This needs to be deprecated (see classifier)
+    os.makedirs(directory + '/data', exist_ok=True)
+    os.makedirs(directory + '/model', exist_ok=True)
+    os.makedirs(directory + '/results', exist_ok=True)
         
     # Create subdirectory if specified
     if folder is not None:
-        folder_dir = f'{directory}/{folder}'
-        if os.path.isdir(folder_dir) is False:
-            os.makedirs(folder_dir)
+        os.makedirs(f'{directory}/{folder}', exist_ok=True)
             
     return True
 
@@ -429,12 +1321,12 @@ def ensure_model_directory_gs(name, bucket=KGML_BUCKET,
                               storage=KGML_STORAGE):
     'Create data blob if it does not exist.'
 
-    blob_path = data_directory_gs(name, bucket=bucket, storage=storage) + '/'
-    if blob_exists(blob_path) is False:
-        create_blob(blob_path + '/', bucket=KGML_BUCKET)
-        create_blob(blob_path + 'data/', bucket=KGML_BUCKET)
-        create_blob(blob_path + 'model/', bucket=KGML_BUCKET)
-        create_blob(blob_path + 'results/', bucket=KGML_BUCKET)
+    blob_path = target_directory_gs(name, bucket=bucket, storage=storage) + '/'
+    if blob_exists(blob_path, bucket=bucket) is False:
+        create_blob(blob_path, bucket=bucket)
+        create_blob(blob_path + 'data/', bucket=bucket)
+        create_blob(blob_path + 'model/', bucket=bucket)
+        create_blob(blob_path + 'results/', bucket=bucket)
         return True
     else:
         return False
@@ -455,7 +1347,7 @@ def data_blobs(name, bucket=KGML_BUCKET, storage=KGML_STORAGE):
     'Return the list of blobs that comprise the named data.'
 
     blob_path = model_directory_gs(name, bucket=bucket, storage=storage)
-    blobs = list(blobs_in_bucket(prefix=blob_path, bucket=bucket))
+    blobs = list_blobs_indexed(blob_path, bucket=bucket)
     if len(blobs) > 0:
         return blobs[1:]
     else:
@@ -463,159 +1355,955 @@ def data_blobs(name, bucket=KGML_BUCKET, storage=KGML_STORAGE):
 
 
 # -----------------------------------------------------------
-# Downloading Blobs
+# LRU Manifests
 # -----------------------------------------------------------
 
-def download_blob(blob_pathname, file_name, model_name, folder = 'data'):
-    'Downloads a blob from the named model.'
+# NB: A manifest is a JSON dictionary of entries, each of which has at
+# least a local 'path', a 'size' in bytes and an 'accessed' timestamp.
+# Entries may also record the 'mtime' of the file and be 'pinned'.
+# Pinned entries are never evicted. Files whose size or modification
+# time changed since they were recorded are forgotten, not deleted.
 
-    blobs = named_blobs(blob_pathname)
-    if blobs is None:
-        # print(f'Warning:\nNo blob named {blob_filenmae} was found on path {blob_pathname}.')
-        # print(f'The file {file_pathname} was not dowloaded to local filesystem.\n')
-        return False
-    else:
-        directory_path = data_directory_fs(model_name, target=folder)
-        file_path = os.path.join(directory_path, file_name)
-        for blob in blobs:
-            blob.download_to_filename(file_path)
-            return True
+def load_manifest(pathname):
+    'Returns the manifest stored in pathname or an empty manifest.'
 
+    if os.path.isfile(pathname) is False:
+        return {}
+    try:
+        with open(pathname, 'r') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError) as err:
+        logger.error(f'Error reading manifest {pathname}:\n{err}')
+        return {}
 
-def download_data_blob(model_name, file_pathname, storage=KGML_STORAGE,
-                       bucket=KGML_BUCKET, folder='data'):
-    'Downloads a data blob from the named model.'
 
-    blob_path = data_directory_gs(model_name, bucket=bucket, storage=storage,
-                                  folder=folder)
+def save_manifest(manifest, pathname):
+    'Atomically writes manifest to pathname.'
 
-    logger.warning(f'\nBlob path: {blob_path}\nFile pathname: {file_pathname}\n')
-    blob_pathname = blob_path + os.path.basename(file_pathname)
+    tmp_pathname = f'{pathname}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_pathname, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(tmp_pathname, pathname)
+    return True
 
-    download_blob(blob_pathname, file_pathname, model_name, folder=folder)
 
+def cached_file_unchanged(entry):
+    'Returns True if the file of entry exists and was not modified since.'
 
-def download_data_blobs(model_name, bucket=KGML_BUCKET, folder=None):
-    'Downloads all data blobs for the named data.'
+    if os.path.isfile(entry['path']) is False:
+        return False
+    if os.path.getsize(entry['path']) != entry['size']:
+        return False
+    return 'mtime' not in entry or \
+        os.path.getmtime(entry['path']) == entry['mtime']
+
+
+def evict_lru(manifest, max_size, keep=None):
+    'Deletes least recently used entries and files until under max_size.'
+
+    entries = sorted([(key, entry) for key, entry in manifest.items()
+                      if entry.get('pinned') is not True],
+                     key=lambda item: item[1]['accessed'])
+    total_size = sum(entry['size'] for _, entry in entries)
+    evicted = []
+    for key, entry in entries:
+        if total_size <= max_size:
+            break
+        if key == keep:
+            continue
+        if cached_file_unchanged(entry):
+            os.remove(entry['path'])
+        total_size -= entry['size']
+        del manifest[key]
+        evicted.append(key)
+    return evicted
 
-    # Ensure the local directory exists
-    ensure_model_directory_fs(model_name, folder=folder)
 
-    # Get the list of data blobs
-    path = model_directory_gs(model_name)
-    blobs = list(blobs_in_bucket(prefix=path), bucket=bucket)
+# -----------------------------------------------------------
+# Local Blob Cache
+# -----------------------------------------------------------
 
-    # Download each individual blob to local files
-    for blob in blobs[1:]:
-        filename = blob_name(blob)
-        file_pathname = data_pathname(model_name, filename, folder=folder)
-        download_data_blob(model_name, file_pathname, bucket=bucket)
-    return True
+# NB: Downloaded blobs are recorded in a manifest under DATA_DIR along
+# with their generation and hashes. A download is skipped when the local
+# copy is unchanged and still matches the blob. Only local copies of
+# appended segments, which are caches, are evicted and deleted. Other
+# downloads, e.g. into the data folder of a model, are working files
+# that later loads from the file system rely on, so they are recorded
+# as pinned entries. Files written by users are only ever pinned.
+#
+# The manifest is kept in memory. Changes are merged into the manifest
+# file at most every BLOB_CACHE_SAVE_INTERVAL seconds and at exit.
 
+BLOB_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0,
+                    'bytes_saved': 0, 'bytes_downloaded': 0}
 
-def download_results_blob(model_name, filename, storage=KGML_STORAGE, bucket=KGML_BUCKET):
-    'Downloads a results blob from the named model.'
+_blob_cache_lock = threading.RLock()
+_blob_cache = {'pathname': None, 'manifest': {}, 'changes': {}, 'saved': 0}
 
-    blob_path = results_directory_gs(model_name, bucket=bucket, storage=storage)
-    download_blob(blob_path, filename, model_name)
 
+def blob_cache_manifest_pathname():
+    return os.path.join(data_dir(), BLOB_CACHE_MANIFEST)
 
-# -----------------------------------------------------------
-# Uploading Blobs
-# -----------------------------------------------------------
 
-def upload_blob(blob_pathname, file_pathname, bucket=KGML_BUCKET):
-    'Upload a blob to Google Storage.'
+def blob_cache_manifest():
+    'Returns the in-memory blob cache manifest, loading it on first use.'
 
-    blob = create_blob(blob_pathname, bucket=bucket)
-    blob.upload_from_filename(file_pathname)
+    pathname = blob_cache_manifest_pathname()
+    with _blob_cache_lock:
+        if _blob_cache['pathname'] != pathname:
+            save_blob_cache()
+            _blob_cache.update(pathname=pathname,
+                               manifest=load_manifest(pathname),
+                               changes={}, saved=time())
+        return _blob_cache['manifest']
 
 
-def upload_data_blob(name, file_pathname, bucket=KGML_BUCKET,
-                     storage=KGML_STORAGE, folder='data'):
-    'Upload a data blob from the named data.'
+def save_blob_cache():
+    'Merges the pending changes of the manifest into the manifest file.'
 
-    blob_path = data_directory_gs(name, bucket=bucket, storage=storage,
-                                  folder=folder)
+    with _blob_cache_lock:
+        if len(_blob_cache['changes']) == 0:
+            return False
+        pathname = _blob_cache['pathname']
+        manifest = load_manifest(pathname)
+        for key, entry in _blob_cache['changes'].items():
+            if entry is None:
+                manifest.pop(key, None)
+            else:
+                manifest[key] = entry
+        save_manifest(manifest, pathname)
+        _blob_cache.update(manifest=manifest, changes={}, saved=time())
+    return True
 
-    logger.warning(f'Blob path: {blob_path}\nFile pathname: {file_pathname}\n')
 
-    blob_pathname = blob_path + os.path.basename(file_pathname)
-    upload_blob(blob_pathname, file_pathname)
+def blob_cache_changed(keys):
+    'Marks manifest entries as changed and saves them once due.'
 
+    with _blob_cache_lock:
+        for key in keys:
+            _blob_cache['changes'][key] = _blob_cache['manifest'].get(key)
+        if time() - _blob_cache['saved'] >= BLOB_CACHE_SAVE_INTERVAL:
+            save_blob_cache()
 
-def upload_data_blobs(name, bucket=KGML_BUCKET, storage=KGML_STORAGE,
-                      folder=None):
-    'Upload all data blobs for the named data.'
 
-    # Ensure the directory exists
-    ensure_model_directory_gs(name, bucket=bucket, storage=storage)
+def save_blob_cache_at_exit():
+    'Saves the pending changes of the manifest before the interpreter exits.'
+    try:
+        save_blob_cache()
+    except OSError as err:
+        logger.error(f'Error saving the blob cache manifest:\n{err}')
 
-    directory = model_directory_fs(name)
-    files = files_in_dir(directory)
-    for file_pathname in files:
-        upload_data_blob(name, file_pathname)
-    return True
 
+atexit.register(save_blob_cache_at_exit)
 
-def upload_results_blob(name, file_pathname, bucket=KGML_BUCKET,
-                        storage=KGML_STORAGE, folder='results'):
+
+def is_blob_cache_path(file_path):
+    'Returns True if file_path is a cache that may be evicted.'
+    return is_segment_name(file_path.replace(os.sep, '/'))
+
+
+def blob_cache_key(blob):
+    return f'{blob.bucket.name}/{blob.name}'
+
+
+def blob_cache_entry(blob, file_path, pinned=False):
+    'Returns a manifest entry describing the local copy of blob.'
+
+    return {'path': file_path,
+            'size': os.path.getsize(file_path),
+            'mtime': os.path.getmtime(file_path),
+            'generation': blob.generation,
+            'md5_hash': blob.md5_hash,
+            'crc32c': blob.crc32c,
+            'pinned': pinned or is_blob_cache_path(file_path) is False,
+            'accessed': time()}
+
+
+def blob_cache_hit(entry, blob, file_path):
+    'Returns True if entry is an unmodified local copy of blob.'
+
+    if entry is None or entry['path'] != file_path:
+        return False
+    if os.path.isfile(file_path) is False:
+        return False
+    if os.path.getsize(file_path) != entry['size'] or \
+       os.path.getmtime(file_path) != entry['mtime']:
+        return False
+    if blob.generation is not None and entry['generation'] != blob.generation:
+        return False
+    if blob.md5_hash is not None:
+        return entry['md5_hash'] == blob.md5_hash
+    return blob.crc32c is not None and entry['crc32c'] == blob.crc32c
+
+
+def record_cached_blob(blob, file_path, pinned=False):
+    'Records file_path as the local copy of blob and enforces the cache size.'
+
+    with _blob_cache_lock:
+        manifest = blob_cache_manifest()
+        key = blob_cache_key(blob)
+        manifest[key] = blob_cache_entry(blob, file_path, pinned=pinned)
+        evicted = evict_lru(manifest, BLOB_CACHE_MAX_SIZE, keep=key)
+        BLOB_CACHE_STATS['evictions'] += len(evicted)
+        blob_cache_changed([key, *evicted])
+    return True
+
+
+def refresh_blob(blob):
+    'Reloads the metadata of an indexed blob, which may be out of date.'
+
+    # Blobs made with bucket.blob(name) have no generation and are current
+    if blob.generation is None:
+        return blob
+    try:
+        blob.reload()
+    except google_exceptions.NotFound:
+        unindex_blob(blob.name, bucket=blob.bucket.name)
+        raise
+    return blob
+
+
+def download_blob_cached(blob, file_path, cache=True):
+    'Downloads blob to file_path unless an identical local copy is cached.'
+
+    # The indexed generation may predate a write by another process
+    refresh_blob(blob)
+    with _blob_cache_lock:
+        key = blob_cache_key(blob)
+        entry = blob_cache_manifest().get(key)
+        if cache is True and blob_cache_hit(entry, blob, file_path):
+            entry['accessed'] = time()
+            blob_cache_changed([key])
+            BLOB_CACHE_STATS['hits'] += 1
+            BLOB_CACHE_STATS['bytes_saved'] += entry['size']
+            return False
+
+    # Keep gzip encoded blobs compressed, as named by their extension, and
+    # replace the local copy atomically as it may be memory mapped
+    tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        blob.download_to_filename(tmp_path, raw_download=True)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+    with _blob_cache_lock:
+        BLOB_CACHE_STATS['misses'] += 1
+        BLOB_CACHE_STATS['bytes_downloaded'] += os.path.getsize(file_path)
+    record_cached_blob(blob, file_path)
+    return True
+
+
+# -----------------------------------------------------------
+
+def blob_cache_stats():
+    'Returns the cache hit/miss counts, bytes saved and current size.'
+
+    with _blob_cache_lock:
+        manifest = dict(blob_cache_manifest())
+        stats = dict(BLOB_CACHE_STATS)
+    stats['entries'] = len(manifest)
+    stats['size'] = sum(entry['size'] for entry in manifest.values()
+                        if entry.get('pinned') is not True)
+    stats['max_size'] = BLOB_CACHE_MAX_SIZE
+    return stats
+
+
+def reset_blob_cache_stats():
+    with _blob_cache_lock:
+        for key in BLOB_CACHE_STATS:
+            BLOB_CACHE_STATS[key] = 0
+    return True
+
+
+def clear_blob_cache(remove_files=False):
+    'Forgets all cached blobs, optionally deleting the evictable copies.'
+
+    with _blob_cache_lock:
+        manifest = blob_cache_manifest()
+        if remove_files is True:
+            evict_lru(manifest, 0)
+        manifest.clear()
+        _blob_cache['changes'].clear()
+        save_manifest({}, _blob_cache['pathname'])
+    return True
+
+
+# -----------------------------------------------------------
+# Bulk Transfers
+# -----------------------------------------------------------
+
+# NB: A transfer is a tuple (direction, blob, file_pathname) where
+# direction is either 'upload' or 'download'. All the blobs of a bulk
+# transfer should share the same client. Only transient errors, i.e.
+# throttling, server errors and lost connections, are retried: missing
+# blobs or permissions fail at once.
+
+def is_transient_error(err):
+    'Returns True if err is a transient error worth retrying.'
+
+    if isinstance(err, (ConnectionError, TimeoutError)):
+        return True
+    return isinstance(err, (google_exceptions.TooManyRequests,
+                            google_exceptions.ServerError,
+                            google_exceptions.RequestTimeout,
+                            requests.exceptions.ConnectionError,
+                            requests.exceptions.Timeout))
+
+
+def transfer_blob(direction, blob, file_pathname, retries=TRANSFER_RETRIES,
+                  cache=True):
+    'Uploads or downloads a single blob, retrying with backoff on failure.'
+
+    for attempt in range(retries + 1):
+        try:
+            if direction == 'upload':
+                set_blob_encoding(blob, file_pathname)
+                blob.upload_from_filename(file_pathname)
+                index_blob(blob)
+            else:
+                os.makedirs(os.path.dirname(file_pathname) or '.',
+                            exist_ok=True)
+                download_blob_cached(blob, file_pathname, cache=cache)
+            return os.path.getsize(file_pathname)
+        except Exception as err:
+            if attempt == retries or is_transient_error(err) is False:
+                raise
+            logger.warning(f'Retrying {direction} of {blob.name}:\n{err}')
+            sleep(0.5 * 2**attempt)
+
+
+def transfer_blobs(transfers, workers=TRANSFER_WORKERS,
+                   retries=TRANSFER_RETRIES, cache=True):
+    'Runs transfers on a bounded thread pool and returns a transfer report.'
+
+    start = time()
+    total = len(transfers)
+    report = {'files': 0, 'failed': [], 'bytes': 0}
+    step = max(1, total // 10)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(transfer_blob, direction, blob, pathname,
+                                   retries=retries, cache=cache): blob.name
+                   for direction, blob, pathname in transfers}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                report['bytes'] += future.result()
+                report['files'] += 1
+            except Exception as err:
+                logger.error(f'Error transferring {futures[future]}:\n{err}')
+                report['failed'].append(futures[future])
+            if done % step == 0 or done == total:
+                logger.warning(f'Transferred {done}/{total} files.')
+
+    report['elapsed'] = round(time() - start, 2)
+    report['throughput'] = round(report['bytes'] / 2**20 /
+                                 max(report['elapsed'], 1e-3), 2)
+    logger.warning(f"\nTransferred {report['files']} files "
+                   f"({round(report['bytes'] / 2**20, 2)} MB) in "
+                   f"{report['elapsed']}s at {report['throughput']} MB/s, "
+                   f"{len(report['failed'])} failed.\n")
+    return report
+
+
+# -----------------------------------------------------------
+# Downloading Blobs
+# -----------------------------------------------------------
+
+def download_blob(blob_pathname, file_name, model_name, folder='data',
+                  cache=True, bucket=KGML_BUCKET):
+    'Downloads a blob from the named model.'
+
+    blob = find_blob(blob_pathname, bucket=bucket)
+    if blob is None:
+        # print(f'Warning:\nNo blob named {blob_filenmae} was found on path {blob_pathname}.')
+        # print(f'The file {file_pathname} was not dowloaded to local filesystem.\n')
+        return False
+    else:
+        directory_path = data_directory_fs(model_name, target=folder)
+        file_path = os.path.join(directory_path, file_name)
+        download_blob_cached(blob, file_path, cache=cache)
+        return True
+
+
+def download_data_blob(model_name, file_pathname, storage=KGML_STORAGE,
+                       bucket=KGML_BUCKET, folder='data', cache=True):
+    'Downloads a data blob from the named model.'
+
+    blob_path = data_directory_gs(model_name, bucket=bucket, storage=storage,
+                                  folder=folder)
+
+    logger.warning(f'\nBlob path: {blob_path}\nFile pathname: {file_pathname}\n')
+    blob_pathname = blob_path + os.path.basename(file_pathname)
+
+    download_blob(blob_pathname, file_pathname, model_name, folder=folder,
+                  cache=cache, bucket=bucket)
+
+
+# NB: Bulk downloads and uploads mirror a folder of a model, or the
+# whole model directory when folder is None. Blobs keep their names
+# relative to the folder, so nested blobs map to nested local files.
+# Appended segments are left out, as in synchronization below.
+
+def download_data_blobs(model_name, bucket=KGML_BUCKET, folder=None,
+                        storage=KGML_STORAGE, workers=TRANSFER_WORKERS,
+                        retries=TRANSFER_RETRIES, cache=True):
+    'Downloads all data blobs for the named data.'
+
+    # Ensure the local directory exists
+    ensure_model_directory_fs(model_name, folder=folder)
+
+    # List the folder once with a single shared client
+    client = storage_client()
+    prefix = target_directory_gs(model_name, target=folder,
+                                 storage=storage).rstrip('/') + '/'
+    blobs = [blob for blob in list_blobs_indexed(prefix, bucket=bucket,
+                                                 client=client)
+             if blob.name.endswith('/') is False and
+             is_segment_name(blob.name) is False]
+
+    # Download each individual blob to local files
+    directory = data_directory_fs(model_name, target=folder)
+    transfers = [('download', blob,
+                  os.path.join(directory, *blob.name[len(prefix):].split('/')))
+                 for blob in blobs]
+    report = transfer_blobs(transfers, workers=workers, retries=retries,
+                            cache=cache)
+    return len(report['failed']) == 0
+
+
+def download_results_blob(model_name, filename, storage=KGML_STORAGE, bucket=KGML_BUCKET):
+    'Downloads a results blob from the named model.'
+
+    blob_path = results_directory_gs(model_name, bucket=bucket, storage=storage)
+    blob_pathname = blob_path + os.path.basename(filename)
+    download_blob(blob_pathname, filename, model_name, bucket=bucket)
+
+
+# -----------------------------------------------------------
+# Uploading Blobs
+# -----------------------------------------------------------
+
+def upload_blob(blob_pathname, file_pathname, bucket=KGML_BUCKET):
+    'Upload a blob to Google Storage.'
+
+    blob = create_blob(blob_pathname, bucket=bucket)
+    set_blob_encoding(blob, file_pathname)
+    blob.upload_from_filename(file_pathname)
+    index_blob(blob)
+    return blob
+
+
+def upload_data_blob(name, file_pathname, bucket=KGML_BUCKET,
+                     storage=KGML_STORAGE, folder='data'):
+    'Upload a data blob from the named data.'
+
+    blob_path = data_directory_gs(name, bucket=bucket, storage=storage,
+                                  folder=folder)
+
+    logger.warning(f'Blob path: {blob_path}\nFile pathname: {file_pathname}\n')
+
+    blob_pathname = blob_path + os.path.basename(file_pathname)
+    upload_blob(blob_pathname, file_pathname, bucket=bucket)
+
+
+def upload_data_blobs(name, bucket=KGML_BUCKET, storage=KGML_STORAGE,
+                      folder=None, workers=TRANSFER_WORKERS,
+                      retries=TRANSFER_RETRIES):
+    'Upload all data blobs for the named data.'
+
+    # Ensure the directory exists
+    ensure_model_directory_gs(name, bucket=bucket, storage=storage)
+
+    client = storage_client()
+    gs_bucket = client.bucket(bucket)
+    prefix = target_directory_gs(name, target=folder,
+                                 storage=storage).rstrip('/') + '/'
+    directory = data_directory_fs(name, target=folder)
+    names = {os.path.relpath(f, directory).replace(os.sep, '/'): f
+             for f in scan_files(directory, recursive=True, sort='name')}
+    transfers = [('upload', gs_bucket.blob(prefix + relative), f)
+                 for relative, f in names.items()
+                 if is_segment_name(relative) is False]
+    report = transfer_blobs(transfers, workers=workers, retries=retries)
+    return len(report['failed']) == 0
+
+
+def upload_results_blob(name, file_pathname, bucket=KGML_BUCKET,
+                        storage=KGML_STORAGE, folder='results'):
     'Upload a data blob from the named data.'
 
     blob_path = data_directory_gs(name, bucket=bucket, storage=storage, folder=folder)
     blob_pathname = blob_path + os.path.basename(file_pathname)
     
-    upload_blob(blob_pathname, file_pathname)
+    upload_blob(blob_pathname, file_pathname, bucket=bucket)
+
+
+# -----------------------------------------------------------
+# Model Synchronization
+# -----------------------------------------------------------
+
+# NB: sync_model mirrors the data, model and results folders of a model
+# between DATA_DIR and Google Storage in the given direction, either
+# 'upload' or 'download'. Files are compared by size, then by the MD5
+# hash of the blob, or its CRC32C for composite blobs. Files recorded in
+# the blob cache as unchanged copies of a blob are not hashed again.
+
+SYNC_FOLDERS = ('data', 'model', 'results')
+
+SYNC_CHUNKSIZE = 2**20
+
+
+def file_md5(pathname):
+    'Returns the base64 MD5 hash of a file, as reported by Google Storage.'
+
+    md5 = hashlib.md5()
+    with open(pathname, 'rb') as f:
+        for chunk in iter(lambda: f.read(SYNC_CHUNKSIZE), b''):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode('utf-8')
+
+
+def file_crc32c(pathname):
+    'Returns the base64 CRC32C checksum of a file, as reported by Google Storage.'
+
+    checksum = google_crc32c.Checksum()
+    with open(pathname, 'rb') as f:
+        for chunk in iter(lambda: f.read(SYNC_CHUNKSIZE), b''):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode('utf-8')
+
+
+def file_matches_blob(pathname, blob, manifest=None):
+    'Returns True if the local file has the same contents as blob.'
+
+    if os.path.getsize(pathname) != blob.size:
+        return False
+    if manifest is not None and \
+       blob_cache_hit(manifest.get(blob_cache_key(blob)), blob, pathname):
+        return True
+    if blob.md5_hash is not None:
+        return file_md5(pathname) == blob.md5_hash
+    return blob.crc32c is not None and file_crc32c(pathname) == blob.crc32c
+
+
+def local_model_files(model_name, folder):
+    'Returns a dictionary of relative pathnames to the files of a folder.'
+
+    directory = data_directory_fs(model_name, target=folder)
+    if os.path.isdir(directory) is False:
+        return {}
+    files = {os.path.relpath(pathname, directory).replace(os.sep, '/'): pathname
+             for pathname in scan_files(directory, recursive=True)}
+    return {relative: pathname for relative, pathname in files.items()
+            if is_synced_name(relative)}
+
+
+def remote_model_blobs(model_name, folder, bucket=KGML_BUCKET,
+                       storage=KGML_STORAGE):
+    'Returns a dictionary of relative names to the blobs of a folder.'
+
+    # Synchronization always lists the bucket rather than the index
+    prefix = target_directory_gs(model_name, target=folder, storage=storage)
+    return {blob.name[len(prefix):]: blob
+            for blob in list_blobs_indexed(prefix, bucket=bucket, ttl=0)
+            if blob.name.endswith('/') is False and
+            is_synced_name(blob.name)}
+
+
+# NB: Appended segments only exist in Google Storage until they are
+# compacted, and local copies of segments are caches. Both are left out
+# of synchronization so that uploads never delete appended rows. Schema
+# sidecars of CSV files record the local modification time of their CSV
+# file, so they are local caches too and are neither transferred nor
+# deleted.
+
+def is_segment_name(name):
+    'Returns True if name is within the segments of a dataset.'
+    return segment_prefix('') in name
+
+
+def is_synced_name(name):
+    'Returns True if the file or blob name is synchronized by sync_model.'
+    return is_segment_name(name) is False and \
+        name.endswith('.schema.json') is False
+
+
+def sync_plan(model_name, direction, folders=SYNC_FOLDERS, bucket=KGML_BUCKET,
+              storage=KGML_STORAGE, delete=False, workers=TRANSFER_WORKERS):
+    'Returns the transfers and deletions that bring the target up to date.'
+
+    with _blob_cache_lock:
+        manifest = dict(blob_cache_manifest())
+    gs_bucket = storage_client().bucket(bucket)
+    plan = {'upload': [], 'download': [], 'delete': [], 'unchanged': 0}
+
+    for folder in folders:
+        directory = data_directory_fs(model_name, target=folder)
+        prefix = target_directory_gs(model_name, target=folder, storage=storage)
+        files = local_model_files(model_name, folder)
+        blobs = remote_model_blobs(model_name, folder, bucket=bucket,
+                                   storage=storage)
+
+        # Hash the files present on both sides in parallel
+        common = sorted(set(files) & set(blobs))
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            matches = list(executor.map(
+                lambda relative: file_matches_blob(files[relative],
+                                                   blobs[relative], manifest),
+                common))
+        changed = {relative for relative, match in zip(common, matches)
+                   if match is False}
+        plan['unchanged'] += len(common) - len(changed)
+
+        if direction == 'upload':
+            for relative in sorted(changed | (set(files) - set(blobs))):
+                plan['upload'].append((gs_bucket.blob(prefix + relative),
+                                       files[relative]))
+            if delete is True:
+                plan['delete'] += [blobs[relative] for relative
+                                   in sorted(set(blobs) - set(files))]
+        else:
+            for relative in sorted(changed | (set(blobs) - set(files))):
+                pathname = os.path.join(directory, *relative.split('/'))
+                plan['download'].append((blobs[relative], pathname))
+            if delete is True:
+                plan['delete'] += [files[relative] for relative
+                                   in sorted(set(files) - set(blobs))]
+    return plan
+
+
+def print_sync_plan(plan, dry_run=False):
+    'Logs the files a synchronization transfers and deletes.'
+
+    header = 'Dry run of the synchronization:' if dry_run is True else \
+        'Synchronization plan:'
+    lines = [f'\n{header}']
+    for blob, pathname in plan['upload']:
+        lines.append(f'  upload    {pathname} -> '
+                     f'gs://{blob.bucket.name}/{blob.name}')
+    for blob, pathname in plan['download']:
+        lines.append(f'  download  gs://{blob.bucket.name}/{blob.name} -> '
+                     f'{pathname}')
+    for target in plan['delete']:
+        name = target if isinstance(target, str) else \
+            f'gs://{target.bucket.name}/{target.name}'
+        lines.append(f'  delete    {name}')
+    lines.append(f"{len(plan['upload'])} uploads, "
+                 f"{len(plan['download'])} downloads, "
+                 f"{len(plan['delete'])} deletions, "
+                 f"{plan['unchanged']} unchanged.\n")
+    logger.warning('\n'.join(lines))
+
+
+def sync_model(model_name, direction='upload', folders=SYNC_FOLDERS,
+               bucket=KGML_BUCKET, storage=KGML_STORAGE, delete=False,
+               dry_run=False, workers=TRANSFER_WORKERS,
+               retries=TRANSFER_RETRIES):
+    'Transfers only the changed files of a model between DATA_DIR and GCS.'
+
+    if direction not in ['upload', 'download']:
+        logger.error(f'Error: Invalid sync direction {direction}.')
+        return None
+
+    if direction == 'upload':
+        ensure_model_directory_gs(model_name, bucket=bucket, storage=storage)
+    for folder in folders:
+        ensure_model_directory_fs(model_name, folder=folder)
+
+    plan = sync_plan(model_name, direction, folders=folders, bucket=bucket,
+                     storage=storage, delete=delete, workers=workers)
+    print_sync_plan(plan, dry_run=dry_run)
+    if dry_run is True:
+        return plan
+
+    transfers = []
+    for blob, pathname in plan['upload']:
+        transfers.append(('upload', blob, pathname))
+    for blob, pathname in plan['download']:
+        os.makedirs(os.path.dirname(pathname), exist_ok=True)
+        transfers.append(('download', blob, pathname))
+    report = transfer_blobs(transfers, workers=workers, retries=retries,
+                            cache=False)
+
+    # Extraneous files are removed from the target side only
+    report['deleted'] = 0
+    for target in plan['delete']:
+        try:
+            if isinstance(target, str):
+                os.remove(target)
+            else:
+                target.delete()
+                unindex_blob(target.name, bucket=bucket)
+            report['deleted'] += 1
+        except Exception as err:
+            logger.error(f'Error deleting {target}:\n{err}')
+    return report
+
+
+# -----------------------------------------------------------
+# Write-Behind Uploads
+# -----------------------------------------------------------
+
+# NB: In write-behind mode a save returns once the local file is written.
+# A snapshot of the file is uploaded by background workers, so the file
+# may be rewritten immediately. Repeated saves of a blob that is still
+# queued replace its snapshot, so only the latest version is uploaded,
+# and a blob is never uploaded by two workers at once. flush_uploads
+# waits for the queue to drain and raises WriteBehindError if uploads
+# failed since the last flush. Loads from storage do not wait for
+# pending uploads, so flush before reading back from another process.
+
+class WriteBehindError(Exception):
+    'Raised by flush_uploads when background uploads have failed.'
+
+    def __init__(self, failures):
+        self.failures = failures
+        names = ', '.join(name for name, _ in failures)
+        super().__init__(f'{len(failures)} background uploads failed: {names}')
+
+
+def _reset_uploads():
+    'Forgets the upload queue and workers, e.g. in the child of a fork.'
+    global _upload_queue, _upload_condition, _upload_workers
+    _upload_queue = queue.Queue()
+    _upload_condition = threading.Condition()
+    _upload_workers = []
+    _pending_uploads.clear()
+    _active_uploads.clear()
+    _upload_failures.clear()
+
+
+_pending_uploads = {}
+_active_uploads = set()
+_upload_failures = []
+_reset_uploads()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_uploads)
+
+
+def upload_snapshot(file_pathname):
+    'Copies file_pathname to a snapshot file that keeps its extension.'
+
+    directory = os.path.join(data_dir(), WRITE_BEHIND_DIR)
+    os.makedirs(directory, exist_ok=True)
+    filename = f'{uuid4().hex[:8]}-{os.path.basename(file_pathname)}'
+    snapshot = os.path.join(directory, filename)
+    shutil.copyfile(file_pathname, snapshot)
+    return snapshot
+
+
+def upload_worker():
+    'Uploads the queued snapshots until the process exits.'
+
+    while True:
+        key = _upload_queue.get()
+        with _upload_condition:
+            # Blobs being uploaded are queued again once their upload ends
+            if key in _active_uploads or key not in _pending_uploads:
+                continue
+            file_pathname, snapshot = _pending_uploads.pop(key)
+            _active_uploads.add(key)
+
+        bucket, name = key
+        try:
+            blob = storage_client().bucket(bucket).blob(name)
+            transfer_blob('upload', blob, snapshot, cache=False)
+            # The local file, not the snapshot, is a copy of the blob if
+            # unchanged since. It belongs to the user so is never evicted.
+            if os.path.isfile(file_pathname) and \
+               file_md5(file_pathname) == blob.md5_hash:
+                record_cached_blob(blob, file_pathname, pinned=True)
+        except Exception as err:
+            logger.error(f'Error uploading {name} in the background:\n{err}')
+            with _upload_condition:
+                _upload_failures.append((name, err))
+        finally:
+            if os.path.isfile(snapshot):
+                os.remove(snapshot)
+            with _upload_condition:
+                _active_uploads.discard(key)
+                if key in _pending_uploads:
+                    _upload_queue.put(key)
+                _upload_condition.notify_all()
+
+
+def queue_upload(blob_pathname, file_pathname, bucket=KGML_BUCKET):
+    'Queues the upload of a snapshot of file_pathname to blob_pathname.'
+
+    snapshot = upload_snapshot(file_pathname)
+    key = (bucket, blob_pathname)
+    with _upload_condition:
+        # Coalesce with a queued upload of the same blob
+        previous = _pending_uploads.get(key)
+        _pending_uploads[key] = (file_pathname, snapshot)
+        if previous is not None:
+            os.remove(previous[1])
+        else:
+            _upload_queue.put(key)
+
+        while len(_upload_workers) < max(1, WRITE_BEHIND_WORKERS):
+            worker = threading.Thread(target=upload_worker, daemon=True,
+                                      name='utils-write-behind')
+            worker.start()
+            _upload_workers.append(worker)
+    return True
+
+
+def pending_uploads():
+    'Returns the number of queued and running background uploads.'
+    with _upload_condition:
+        return len(_pending_uploads) + len(_active_uploads)
+
+
+def flush_uploads(timeout=None):
+    'Waits for background uploads and raises WriteBehindError on failures.'
+
+    with _upload_condition:
+        done = _upload_condition.wait_for(
+            lambda: len(_pending_uploads) + len(_active_uploads) == 0,
+            timeout=timeout)
+        failures = list(_upload_failures)
+        _upload_failures.clear()
+
+    if len(failures) > 0:
+        raise WriteBehindError(failures)
+    return done
+
+
+def flush_uploads_at_exit():
+    'Completes the background uploads before the interpreter exits.'
+    try:
+        flush_uploads()
+    except WriteBehindError as err:
+        logger.error(f'Error: {err}')
+
+
+atexit.register(flush_uploads_at_exit)
 
 
 # ----------------------------------------------------------
 # Save Data
 # -----------------------------------------------------------
 
-def data_filename(model_name, data_name, data_type):
-    return f'{model_name}-{data_name}.{data_type}'
+# NB: compression is either a parquet codec or, for the data types in
+# COMPRESSIBLE_TYPES, gzip or zstd which add a .gz or .zst extension to
+# the filename. Loads default to inferring the codec from the files.
 
-def data_type_pathname(model_name, data_name, data_type, folder=None):
-    filename = data_filename(model_name, data_name, data_type)
+def file_compression(data_type, compression):
+    'Returns the codec compressing whole files of data_type, if any.'
+    return compression if data_type in COMPRESSIBLE_TYPES else None
+
+
+def data_filename(model_name, data_name, data_type, compression=None):
+    filename = f'{model_name}-{data_name}.{data_type}'
+    return compressed_filename(filename, file_compression(data_type, compression))
+
+def data_type_pathname(model_name, data_name, data_type, folder=None,
+                       compression=None):
+    if compression == 'infer':
+        filename = data_filename(model_name, data_name, data_type)
+        pathname = data_pathname(model_name, filename, folder=folder)
+        return find_compressed_file(pathname)
+    filename = data_filename(model_name, data_name, data_type,
+                             compression=compression)
     return data_pathname(model_name, filename, folder=folder)
 
 
+def data_blob_pathname(model_name, data_name, data_type, bucket=KGML_BUCKET,
+                       storage=KGML_STORAGE, folder='data', compression=None):
+    'Returns the gcsfs pathname of the blob of a dataset.'
+
+    directory = data_directory_gs(model_name, storage=storage, folder=folder)
+    if compression == 'infer':
+        filename = data_filename(model_name, data_name, data_type)
+        blob_name = compressed_blob_name(directory + filename, bucket=bucket)
+        return f'{bucket}/{blob_name}'
+    filename = data_filename(model_name, data_name, data_type,
+                             compression=compression)
+    return f'{bucket}/{directory}{filename}'
+
+
 # -----------------------------------------------------------
 
-def save_data_fs(model_name, data_name, data_type, data, folder='data'):
-    'Saves data to local filesystem.'
-    
-    pathname = data_type_pathname(model_name, data_name, data_type,
-                                  folder=folder)
+def jsonl_records(data):
+    'Returns the records of a dataframe or data unchanged.'
+    return data.to_dict(orient='records') \
+        if isinstance(data, pd.DataFrame) else data
+
+
+def save_data_file(data, pathname, data_type, compression=None):
+    'Saves data to pathname in the format specified by data_type.'
 
-    logger.warning(f'\nSaving to local filesystem:\nPathname: {pathname}\n')
-          
     if data_type == 'csv':
         save_csv(data, pathname)
         
     elif data_type == 'json':
         save_dict(data, pathname)
+
+    elif data_type == 'jsonl':
+        save_jsonl(jsonl_records(data), pathname)
         
     elif data_type == 'xlsx':
         write_excel(data, pathname)
 
+    elif data_type == 'parquet':
+        save_parquet(data, pathname,
+                     compression=compression or PARQUET_COMPRESSION)
+
     elif data_type == 'text' or data_type == 'html':
         save_text_file(data, pathname)
+
+    elif data_type == 'npy':
+        save_npy(data, pathname)
+
+    elif data_type == 'npz':
+        save_npz(data, pathname)
         
     else:
         logger.error(f'Error: Unrecognized data type {data_type}.')
+        return False
+
+    return True
+
+
+# -----------------------------------------------------------
+
+def save_data_fs(model_name, data_name, data_type, data, folder='data',
+                 compression=None):
+    'Saves data to local filesystem.'
+    
+    pathname = data_type_pathname(model_name, data_name, data_type,
+                                  folder=folder, compression=compression)
+
+    logger.warning(f'\nSaving to local filesystem:\nPathname: {pathname}\n')
+
+    return save_data_file(data, pathname, data_type, compression=compression)
 
 
 # -----------------------------------------------------------
 
 def save_data_gs(model_name, data_name, data_type, tdf, bucket=KGML_BUCKET,
-                 storage=KGML_STORAGE, folder='data'):
+                 storage=KGML_STORAGE, folder='data', compression=None,
+                 write_behind=False):
     'Saves data to Google Storage.'
 
     # First save to local filesystem
-    save_data_fs(model_name, data_name, data_type, tdf, folder=folder)
+    save_data_fs(model_name, data_name, data_type, tdf, folder=folder,
+                 compression=compression)
+    file_pathname = data_type_pathname(model_name, data_name, data_type,
+                                       folder=folder, compression=compression)
+
+    # Upload in the background, see flush_uploads
+    if write_behind is True:
+        blob_path = data_directory_gs(model_name, bucket=bucket,
+                                      storage=storage, folder=folder)
+        return queue_upload(blob_path + os.path.basename(file_pathname),
+                            file_pathname, bucket=bucket)
+
     # Now upload to Google storage
-    file_pathname = data_type_pathname(model_name, data_name, data_type, folder=folder)
     upload_data_blob(model_name, file_pathname, bucket=bucket,
                      storage=storage, folder=folder)
     return True
@@ -623,14 +2311,15 @@ def save_data_gs(model_name, data_name, data_type, tdf, bucket=KGML_BUCKET,
 
 # -----------------------------------------------------------
 
-def save_data_bq(model_name, data_name, tdf, project, dataset):
+def save_data_bq(model_name, data_name, tdf, project, dataset, mode='replace',
+                 keys=None):
     'Saves data to Google BQ.'
 
     if project is not None and dataset is not None:
         table_name = f'{model_name}-{data_name}'
         logger.warning(f'\nProject: {project}\nDataset: {dataset}\nTable: {table_name}\n')
-        table_to_bq(tdf, project=project, dataset=dataset, table_name=table_name)
-        return True
+        return table_to_bq(tdf, project=project, dataset=dataset,
+                           table_name=table_name, mode=mode, keys=keys)
     else:
         logger.error('Error: Must specify BQ project and dataset.')
         return False
@@ -641,20 +2330,35 @@ def save_data_bq(model_name, data_name, tdf, project, dataset):
 def save_data(model_name, data_name, data_type, tdf, destination,
               project=PROJECT_ID, dataset=PROJECT_DATASET,
               bucket=KGML_BUCKET, storage=KGML_STORAGE,
-              folder='data'):
+              folder='data', compression=None, partition_cols=None,
+              mode='replace', keys=None, write_behind=False):
     'Saves data to either local filesystem, Google Storage or Google BQ.'
 
     ensure_model_directory_fs(model_name, folder=folder)
+
+    # Partitioned datasets are written as one part file per partition
+    if partition_cols is not None and destination == 'file':
+        save_partitioned_fs(model_name, data_name, data_type, tdf,
+                            partition_cols, folder=folder,
+                            compression=compression)
+
+    elif partition_cols is not None and destination == 'storage':
+        save_partitioned_gs(model_name, data_name, data_type, tdf,
+                            partition_cols, bucket=bucket, storage=storage,
+                            folder=folder, compression=compression)
     
-    if destination == 'file':
-        save_data_fs(model_name, data_name, data_type, tdf, folder=folder)
+    elif destination == 'file':
+        save_data_fs(model_name, data_name, data_type, tdf, folder=folder,
+                     compression=compression)
         
     elif destination == 'storage':
         save_data_gs(model_name, data_name, data_type, tdf,
-                     bucket=bucket, storage=storage, folder=folder)
+                     bucket=bucket, storage=storage, folder=folder,
+                     compression=compression, write_behind=write_behind)
         
     elif destination == 'bq' or destination == 'db':
-        save_data_bq(model_name, data_name, tdf, project, dataset)
+        save_data_bq(model_name, data_name, tdf, project, dataset,
+                     mode=mode, keys=keys)
                      
     else:
         logger.error(f'Error: Invalid destination {destination}.')
@@ -664,20 +2368,36 @@ def save_data(model_name, data_name, data_type, tdf, destination,
 # Load Data
 # -----------------------------------------------------------
 
-def load_data_fs(model_name, data_name, data_type, folder='data'):
-    'Loads data from local filesystem.'
-
-    pathname = data_type_pathname(model_name, data_name, data_type, folder=folder)
+def load_data_file(pathname, data_type, usecols=None, dtype=None,
+                   filters=None):
+    'Loads the data stored in pathname in the format specified by data_type.'
 
-    logger.warning(f'\nLoading from local filesystem:\nPathname: {pathname}\n')
     if data_type == 'csv':
-        return load_csv(pathname)
+        return load_csv(pathname, usecols=usecols, dtype=dtype)
     
     elif data_type == 'json':
         return load_dict(pathname)
+
+    # JSON Lines records are returned as a generator
+    elif data_type == 'jsonl':
+        return iter_jsonl(pathname)
     
     elif data_type == 'xlsx':
         return read_excel(pathname)
+
+    elif data_type == 'parquet':
+        return load_parquet(pathname, columns=usecols, filters=filters)
+
+    elif data_type == 'text' or data_type == 'html':
+        return load_text_file(pathname)
+
+    # Arrays are returned as read-only memory maps
+    elif data_type == 'npy':
+        return load_npy(pathname)
+
+    elif data_type == 'npz':
+        return load_npz(pathname)
+
     else:
         logger.error(f'Error: Unrecognized data type {data_type}.')
         return None
@@ -685,98 +2405,850 @@ def load_data_fs(model_name, data_name, data_type, folder='data'):
 
 # -----------------------------------------------------------
 
-def load_data_gs(model_name, data_name, data_type, bucket=KGML_BUCKET,
-                 storage=KGML_STORAGE, folder='data'):
-    'Loads data from Google Storage.'
+def load_data_fs(model_name, data_name, data_type, folder='data',
+                 usecols=None, dtype=None, filters=None, compression='infer'):
+    'Loads data from local filesystem.'
 
-    filename = f'{model_name}-{data_name}.{data_type}'
-    file_pathname = data_pathname(model_name, filename, folder=folder)
-    
-    # First download from Google storage
-    download_data_blob(model_name, file_pathname, bucket=bucket, storage=storage,
-                       folder=folder)
+    pathname = data_type_pathname(model_name, data_name, data_type,
+                                  folder=folder, compression=compression)
 
-    # Now load from local filesystem
-    data = load_data_fs(model_name, data_name, data_type, folder=folder)
+    logger.warning(f'\nLoading from local filesystem:\nPathname: {pathname}\n')
+
+    return load_data_file(pathname, data_type, usecols=usecols, dtype=dtype,
+                          filters=filters)
+
+
+# -----------------------------------------------------------
+
+def read_data_gs(model_name, data_name, data_type, bucket=KGML_BUCKET,
+                 storage=KGML_STORAGE, folder='data', cache=True,
+                 usecols=None, dtype=None, filters=None, direct=False,
+                 compression='infer'):
+    'Loads a dataset and its appended segments from Google Storage.'
+
+    pathname = data_blob_pathname(model_name, data_name, data_type,
+                                  bucket=bucket, storage=storage,
+                                  folder=folder, compression=compression)
+    name = pathname.split('/', 1)[1]
+    segments = segment_blobs_gs(name, bucket=bucket) \
+        if data_type in APPENDABLE_TYPES else []
+
+    # Direct loads read the blob without staging a local copy
+    if direct is True and data_type in ['csv', 'parquet']:
+        if data_type == 'csv':
+            data = load_csv_gs(pathname, usecols=usecols, dtype=dtype)
+            columns = csv_columns_gs(pathname) if segments else None
+        else:
+            data = load_parquet_gs(pathname, columns=usecols, filters=filters)
+            columns = None
+        segments_directory = None
+
+    else:
+        filename = os.path.basename(pathname)
+        file_pathname = data_pathname(model_name, filename, folder=folder)
+
+        # First download from Google storage unless cached locally
+        download_data_blob(model_name, file_pathname, bucket=bucket,
+                           storage=storage, folder=folder, cache=cache)
+
+        # Now load from local filesystem
+        data = load_data_file(file_pathname, data_type, usecols=usecols,
+                              dtype=dtype, filters=filters)
+        columns = load_csv_header(file_pathname) \
+            if segments and data_type == 'csv' else None
+        segments_directory = segment_prefix(file_pathname)
+
+    # Appended rows are read from the segments not yet compacted
+    if len(segments) > 0:
+        dfs = load_segments_gs(segments, data_type, columns,
+                               directory=segments_directory, usecols=usecols,
+                               dtype=dtype, filters=filters)
+        data = pd.concat([data, *dfs], ignore_index=True)
 
     return data
 
 
+def load_data_gs(model_name, data_name, data_type, bucket=KGML_BUCKET,
+                 storage=KGML_STORAGE, folder='data', cache=True,
+                 usecols=None, dtype=None, filters=None, direct=False,
+                 compression='infer'):
+    'Loads data from Google Storage.'
+
+    # NB: A compaction by another process may replace the dataset blob or
+    # delete its segments after they were listed. The load is then
+    # retried once with a fresh listing.
+    for attempt in range(2):
+        try:
+            return read_data_gs(model_name, data_name, data_type,
+                                bucket=bucket, storage=storage, folder=folder,
+                                cache=cache, usecols=usecols, dtype=dtype,
+                                filters=filters, direct=direct,
+                                compression=compression)
+        except google_exceptions.NotFound as err:
+            if attempt == 1:
+                raise
+            logger.warning(f'Reloading {model_name}-{data_name}:\n{err}')
+            invalidate_listings(bucket, data_directory_gs(
+                model_name, storage=storage, folder=folder))
+
+
 # -----------------------------------------------------------
 
-def load_data_bq(model_name, data_name, project, dataset):
+def load_data_bq(model_name, data_name, project, dataset, fast=False,
+                 max_streams=BQ_READ_STREAMS, as_batches=False, cache=False,
+                 cache_ttl=QUERY_CACHE_TTL):
     'Loads data from Google BQ.'
 
     if project is not None and dataset is not None:
         table_name = f'{model_name}-{data_name}'
         table_id = bq_table_id(table_name)
+
+        # The fast path reads the table directly without running a query
+        if fast is True and cache is False:
+            read_client = bqstorage_client()
+            session = create_bq_read_session(table_id,
+                                             max_streams=max_streams,
+                                             read_client=read_client)
+            batches = read_bq_batches(table_id, read_client=read_client,
+                                      session=session)
+            if as_batches is True:
+                return batches
+            return batches_to_df(batches, schema=bq_session_schema(session))
+
         # print(f'\nBQ Table ID: {table_id}')
         query = f"SELECT * FROM {table_id}"
-        df = run_pdbq(query)
+        df = run_pdbq(query, fast=fast, max_streams=max_streams, cache=cache,
+                      cache_ttl=cache_ttl)
         return df
     else:
         logger.error('Error: Either project or dataset was not specified.')
         return None
     
 
+# -----------------------------------------------------------
+# Stream Data
+# -----------------------------------------------------------
+
+# NB: Streaming loads yield dataframes of at most chunksize rows so that
+# arbitrarily large datasets can be processed in constant memory.
+
+def stream_data_fs(model_name, data_name, data_type, chunksize, folder='data',
+                   usecols=None, dtype=None, compression='infer'):
+    'Yields chunks of a dataset from the local filesystem.'
+
+    pathname = data_type_pathname(model_name, data_name, data_type,
+                                  folder=folder, compression=compression)
+
+    if data_type == 'csv':
+        with load_csv(pathname, usecols=usecols, dtype=dtype,
+                      chunksize=chunksize) as reader:
+            yield from reader
+    elif data_type == 'parquet':
+        yield from stream_parquet(pathname, chunksize, columns=usecols)
+    else:
+        raise ValueError(f'Cannot stream data type {data_type}.')
+
+
+def stream_data_gs(model_name, data_name, data_type, chunksize,
+                   bucket=KGML_BUCKET, storage=KGML_STORAGE, folder='data',
+                   usecols=None, dtype=None, compression='infer'):
+    'Yields chunks of a dataset read directly from Google Storage.'
+
+    pathname = data_blob_pathname(model_name, data_name, data_type,
+                                  bucket=bucket, storage=storage, folder=folder,
+                                  compression=compression)
+    segments = segment_blobs_gs(pathname.split('/', 1)[1], bucket=bucket)
+
+    if data_type == 'csv':
+        yield from stream_csv_gs(pathname, chunksize, usecols=usecols,
+                                 dtype=dtype)
+        columns = csv_columns_gs(pathname) if segments else None
+    elif data_type == 'parquet':
+        yield from stream_parquet_gs(pathname, chunksize, columns=usecols)
+        columns = None
+    else:
+        raise ValueError(f'Cannot stream data type {data_type}.')
+
+    # Appended segments follow the dataset
+    for df in load_segments_gs(segments, data_type, columns, usecols=usecols,
+                               dtype=dtype):
+        yield from df_chunks(df, chunksize)
+
+
+def stream_data_bq(model_name, data_name, project, dataset, chunksize,
+                   usecols=None, dtype=None):
+    'Yields chunks of a Google BQ table, one result page at a time.'
+
+    table_id = bq_table_id(f'{model_name}-{data_name}')
+    columns = '*' if usecols is None else ', '.join(usecols)
+    query = f"SELECT {columns} FROM {table_id}"
+
+    client = bigquery_client()
+    results = client.query(query).result(page_size=chunksize)
+    for df in results.to_dataframe_iterable():
+        yield df if dtype is None else df.astype(dtype)
+
+
+def stream_data(model_name, data_name, data_type, source, chunksize,
+                project=PROJECT_ID, dataset=PROJECT_DATASET,
+                bucket=KGML_BUCKET, storage=KGML_STORAGE,
+                folder='data', usecols=None, dtype=None, compression='infer'):
+    'Returns an iterator of dataframes of at most chunksize rows.'
+
+    if source == 'file':
+        return stream_data_fs(model_name, data_name, data_type, chunksize,
+                              folder=folder, usecols=usecols, dtype=dtype,
+                              compression=compression)
+
+    elif source == 'storage':
+        return stream_data_gs(model_name, data_name, data_type, chunksize,
+                              bucket=bucket, storage=storage, folder=folder,
+                              usecols=usecols, dtype=dtype,
+                              compression=compression)
+
+    elif source == 'bq' or source == 'db':
+        return stream_data_bq(model_name, data_name, project, dataset,
+                              chunksize, usecols=usecols, dtype=dtype)
+
+    else:
+        logger.error(f'Error: Invalid destination {source}.')
+        return None
+
+
 # -----------------------------------------------------------
 
 def load_data(model_name, data_name, data_type, source,
               project=PROJECT_ID, dataset=PROJECT_DATASET,
               bucket=KGML_BUCKET, storage=KGML_STORAGE,
-              folder='data'):
+              folder='data', cache=True, chunksize=None, usecols=None,
+              dtype=None, filters=None, direct=False, partitioned=False,
+              partition_filter=None, workers=TRANSFER_WORKERS, fast=False,
+              max_streams=BQ_READ_STREAMS, query_cache=False,
+              query_cache_ttl=QUERY_CACHE_TTL, optimize_memory=False,
+              compression='infer'):
     'Loads data from either local filesystem, Google Storage or Google BQ.'
 
     ensure_model_directory_fs(model_name, folder=folder)
+
+    # Partitioned datasets only read the partitions matching the filter
+    if partitioned is True or partition_filter is not None:
+        if source == 'file':
+            data = load_partitioned_fs(model_name, data_name, data_type,
+                                       folder=folder,
+                                       partition_filter=partition_filter,
+                                       usecols=usecols, dtype=dtype,
+                                       filters=filters, workers=workers)
+        elif source == 'storage':
+            data = load_partitioned_gs(model_name, data_name, data_type,
+                                       bucket=bucket, storage=storage,
+                                       folder=folder,
+                                       partition_filter=partition_filter,
+                                       usecols=usecols, dtype=dtype,
+                                       filters=filters, workers=workers,
+                                       cache=cache)
+        else:
+            logger.error(f'Error: Partitioned datasets are not supported for {source}.')
+            data = None
+
+    # Streaming mode returns an iterator of dataframes
+    elif chunksize is not None:
+        data = stream_data(model_name, data_name, data_type, source, chunksize,
+                           project=project, dataset=dataset, bucket=bucket,
+                           storage=storage, folder=folder, usecols=usecols,
+                           dtype=dtype, compression=compression)
     
-    if source == 'file':
-        return load_data_fs(model_name, data_name, data_type, folder=folder)
+    elif source == 'file':
+        data = load_data_fs(model_name, data_name, data_type, folder=folder,
+                            usecols=usecols, dtype=dtype, filters=filters,
+                            compression=compression)
     
     elif source == 'storage':
-        return load_data_gs(model_name, data_name, data_type, bucket=bucket,
-                            storage=storage, folder=folder)
+        data = load_data_gs(model_name, data_name, data_type, bucket=bucket,
+                            storage=storage, folder=folder, cache=cache,
+                            usecols=usecols, dtype=dtype, filters=filters,
+                            direct=direct, compression=compression)
     
     elif source == 'bq' or source == 'db':
-        return load_data_bq(model_name, data_name, project, dataset)
+        data = load_data_bq(model_name, data_name, project, dataset,
+                            fast=fast, max_streams=max_streams,
+                            cache=query_cache, cache_ttl=query_cache_ttl)
     
     else:
         logger.error(f'Error: Invalid destination {source}.')
+        data = None
+
+    # Downcast the dtypes of dataframes if specified
+    if optimize_memory is True and isinstance(data, pd.DataFrame):
+        data = compact_dtypes(data)
+
+    return data
+
+
+# ----------------------------------------------------------
+# Append Data
+# -----------------------------------------------------------
+
+# NB: Rows appended to a dataset in Google Storage are uploaded as small
+# segment blobs under <dataset blob>.segments/ and loads return the union
+# of the dataset and its segments, so an append costs O(rows appended).
+# CSV segments have no header and are compacted on the server by
+# composing them into the dataset blob. Other data types, and gzip
+# datasets, are compacted by merging them locally. The dataset blob
+# records the segments it absorbed in its metadata, so that a segment
+# left over by a failed deletion is never read twice. Leftovers are
+# deleted again, and kept in the metadata, on the next compaction.
+
+APPENDABLE_TYPES = ['csv', 'parquet']
+
+# JSON Lines files are only appended to in the local filesystem
+APPENDABLE_FILE_TYPES = APPENDABLE_TYPES + ['jsonl']
+
+# A compose request accepts at most 32 sources, the dataset and 31 segments
+APPEND_COMPACT_SEGMENTS = 31
+
+
+def segment_prefix(name):
+    'Returns the prefix of the segments of a dataset blob or file.'
+    return f'{name}.segments/'
+
+
+def segment_filename(data_type):
+    'Returns a unique segment filename that sorts in append order.'
+    return f'seg-{int(time() * 1e6):020d}-{uuid4().hex[:8]}.{data_type}'
+
+
+def absorbed_segments(blob):
+    'Returns the names of the segments already composed into blob.'
+    metadata = blob.metadata or {}
+    return set(filter(None, metadata.get('absorbed_segments', '').split(',')))
+
+
+def segment_blobs_gs(name, bucket=KGML_BUCKET):
+    'Returns the segments of a dataset blob not yet absorbed, in append order.'
+
+    dataset_blob = find_blob(name, bucket=bucket)
+    if dataset_blob is None:
+        return []
+    absorbed = absorbed_segments(dataset_blob)
+    return [blob for blob in list_blobs_indexed(segment_prefix(name),
+                                                bucket=bucket)
+            if blob_name(blob) not in absorbed]
+
+
+def csv_columns_gs(pathname):
+    'Returns the column names in the header of a CSV blob.'
+
+    fs = gcs_filesystem()
+    with fs.open(pathname, 'rt', block_size=2**16,
+                 compression=read_compression_gs(pathname)) as f:
+        return next(csv.reader([f.readline()]), [])
+
+
+def read_segment(source, data_type, columns, usecols=None, dtype=None,
+                 filters=None):
+    'Returns the dataframe of a segment file or file object.'
+
+    if data_type == 'csv':
+        return pd.read_csv(source, header=None, names=columns,
+                           usecols=usecols, dtype=dtype)
+    return load_parquet(source, columns=usecols, filters=filters)
+
+
+def load_segments_gs(segments, data_type, columns, directory=None,
+                     cache=True, usecols=None, dtype=None, filters=None):
+    'Returns the dataframes of segments, read directly or from local copies.'
+
+    dfs = []
+    for blob in segments:
+        if directory is None:
+            with gcs_filesystem().open(f'{blob.bucket.name}/{blob.name}',
+                                       'rb') as f:
+                dfs.append(read_segment(f, data_type, columns, usecols=usecols,
+                                        dtype=dtype, filters=filters))
+        else:
+            os.makedirs(directory, exist_ok=True)
+            pathname = os.path.join(directory, blob_name(blob))
+            download_blob_cached(blob, pathname, cache=cache)
+            dfs.append(read_segment(pathname, data_type, columns,
+                                    usecols=usecols, dtype=dtype,
+                                    filters=filters))
+
+    # Local copies of compacted segments are no longer needed
+    if directory is not None and os.path.isdir(directory):
+        current = {blob_name(blob) for blob in segments}
+        for filename in os.listdir(directory):
+            if filename not in current and filename.endswith('.tmp') is False:
+                os.remove(os.path.join(directory, filename))
+    return dfs
+
+
+# -----------------------------------------------------------
+
+def append_data_fs(model_name, data_name, data_type, df, folder='data'):
+    'Appends the rows of df to a dataset in the local filesystem.'
+
+    pathname = data_type_pathname(model_name, data_name, data_type,
+                                  folder=folder, compression='infer')
+    if os.path.isfile(pathname) is False:
+        return save_data_fs(model_name, data_name, data_type, df,
+                            folder=folder)
+
+    # CSV rows are appended in place in the column order of the header
+    if data_type == 'csv':
+        columns = load_csv_header(pathname)
+        df.reindex(columns=columns).to_csv(pathname, mode='a', header=False,
+                                           index=False)
+    elif data_type == 'jsonl':
+        append_jsonl(jsonl_records(df), pathname)
+    else:
+        data = load_data_file(pathname, data_type)
+        save_data_file(pd.concat([data, df], ignore_index=True), pathname,
+                       data_type)
+    return True
+
+
+def append_data_gs(model_name, data_name, data_type, df, bucket=KGML_BUCKET,
+                   storage=KGML_STORAGE, folder='data',
+                   compact_segments=APPEND_COMPACT_SEGMENTS):
+    'Uploads the rows of df as a new segment of a dataset in Google Storage.'
+
+    directory = data_directory_gs(model_name, storage=storage, folder=folder)
+    name = compressed_blob_name(directory + data_filename(
+        model_name, data_name, data_type), bucket=bucket)
+    if find_blob(name, bucket=bucket) is None:
+        return save_data_gs(model_name, data_name, data_type, df,
+                            bucket=bucket, storage=storage, folder=folder)
+
+    with tempfile.TemporaryDirectory() as tmp_directory:
+        pathname = os.path.join(tmp_directory, segment_filename(data_type))
+        if data_type == 'csv':
+            columns = csv_columns_gs(f'{bucket}/{name}')
+            df.reindex(columns=columns).to_csv(pathname, header=False,
+                                               index=False)
+        else:
+            save_data_file(df, pathname, data_type)
+        blob = storage_client().bucket(bucket).blob(
+            segment_prefix(name) + os.path.basename(pathname))
+        blob.upload_from_filename(pathname)
+        index_blob(blob)
+
+    if len(segment_blobs_gs(name, bucket=bucket)) >= compact_segments:
+        compact_data_gs(model_name, data_name, data_type, bucket=bucket,
+                        storage=storage, folder=folder)
+    return True
+
+
+def append_data(model_name, data_name, data_type, df, destination,
+                project=PROJECT_ID, dataset=PROJECT_DATASET,
+                bucket=KGML_BUCKET, storage=KGML_STORAGE, folder='data',
+                compact_segments=APPEND_COMPACT_SEGMENTS):
+    'Appends the rows of df to a dataset without rewriting the dataset.'
+
+    ensure_model_directory_fs(model_name, folder=folder)
+
+    if (destination == 'file' and data_type not in APPENDABLE_FILE_TYPES) or \
+       (destination == 'storage' and data_type not in APPENDABLE_TYPES):
+        logger.error(f'Error: Cannot append to data type {data_type}.')
+        return False
+
+    if destination == 'file':
+        return append_data_fs(model_name, data_name, data_type, df,
+                              folder=folder)
+
+    elif destination == 'storage':
+        return append_data_gs(model_name, data_name, data_type, df,
+                              bucket=bucket, storage=storage, folder=folder,
+                              compact_segments=compact_segments)
+
+    elif destination == 'bq' or destination == 'db':
+        return save_data_bq(model_name, data_name, df, project, dataset,
+                            mode='append')
+
+    else:
+        logger.error(f'Error: Invalid destination {destination}.')
+        return False
+
+
+# -----------------------------------------------------------
+
+def delete_segment(blob, bucket=KGML_BUCKET):
+    'Deletes a segment blob, returns False if it could not be deleted.'
+
+    try:
+        blob.delete()
+    except google_exceptions.NotFound:
+        pass
+    except Exception as err:
+        logger.error(f'Error deleting segment {blob.name}:\n{err}')
+        return False
+    unindex_blob(blob.name, bucket=bucket)
+    return True
+
+
+def compact_data_gs(model_name, data_name, data_type, bucket=KGML_BUCKET,
+                    storage=KGML_STORAGE, folder='data'):
+    'Folds the segments of a dataset into its blob, returns their number.'
+
+    directory = data_directory_gs(model_name, storage=storage, folder=folder)
+    filename = data_filename(model_name, data_name, data_type)
+    invalidate_listings(bucket, directory)
+    name = compressed_blob_name(directory + filename, bucket=bucket)
+    dataset_blob = find_blob(name, bucket=bucket)
+    if dataset_blob is None:
+        return 0
+    segments = segment_blobs_gs(name, bucket=bucket)
+    compose = data_type == 'csv' and infer_compression(name) is None
+    if compose is True:
+        segments = segments[:APPEND_COMPACT_SEGMENTS]
+    if len(segments) == 0:
+        return 0
+
+    # Segments absorbed earlier whose deletion failed remain recorded
+    previous = absorbed_segments(dataset_blob)
+    leftovers = [blob_name(blob)
+                 for blob in list_blobs_indexed(segment_prefix(name),
+                                                bucket=bucket)
+                 if blob_name(blob) in previous and
+                 delete_segment(blob, bucket=bucket) is False]
+    metadata = dict(dataset_blob.metadata or {})
+    metadata['absorbed_segments'] = ','.join(
+        leftovers + [blob_name(blob) for blob in segments])
+
+    # Headerless CSV segments are concatenated on the server
+    if compose is True:
+        dataset_blob.metadata = metadata
+        dataset_blob.compose([dataset_blob, *segments],
+                             if_generation_match=dataset_blob.generation)
+        index_blob(dataset_blob)
+
+    # Other datasets are merged locally, with exactly the listed segments,
+    # and uploaded again
+    else:
+        pathname = data_pathname(model_name, os.path.basename(name),
+                                 folder=folder)
+        download_blob_cached(dataset_blob, pathname)
+        data = load_data_file(pathname, data_type)
+        columns = load_csv_header(pathname) if data_type == 'csv' else None
+        dfs = load_segments_gs(segments, data_type, columns,
+                               directory=segment_prefix(pathname))
+        save_data_file(pd.concat([data, *dfs], ignore_index=True), pathname,
+                       data_type)
+        blob = storage_client().bucket(bucket).blob(name)
+        blob.metadata = metadata
+        set_blob_encoding(blob, pathname)
+        blob.upload_from_filename(pathname,
+                                  if_generation_match=dataset_blob.generation)
+        index_blob(blob)
+        record_cached_blob(blob, pathname)
+
+    for blob in segments:
+        delete_segment(blob, bucket=bucket)
+
+    logger.warning(f'\nCompacted {len(segments)} segments into {name}.\n')
+    return len(segments)
+
+
+# ----------------------------------------------------------
+# Partitioned Datasets
+# -----------------------------------------------------------
+
+# NB: Partitioned datasets use a Hive style layout in which each
+# partition is a directory of part files, e.g.
+#
+#   <model>/data/<model>-<data_name>/year=2023/month=01/part-00000.csv
+#
+# The same layout is used under the storage folder in Google Storage.
+# Partition values are strings and compared as such, so numeric keys
+# such as months should be zero padded. Partition columns are kept in
+# the part files so that their dtypes are preserved on load.
+#
+# Rows whose partition key is null are saved in the Hive default
+# partition, e.g. year=__HIVE_DEFAULT_PARTITION__. Integer keys read as
+# floats because of nulls are written as integers, e.g. year=2023 rather
+# than year=2023.0.
+#
+# Transfers of part files that fail raise an IOError, rather than
+# leaving a dataset partially saved or loading stale local parts.
+#
+# A partition filter is either a callable taking a partition dictionary
+# or a dictionary mapping keys to a value, a list of values or an
+# inclusive (low, high) range where either bound may be None.
+
+def partitioned_directory_fs(model_name, data_name, folder='data'):
+    directory = data_directory_fs(model_name, target=folder)
+    return os.path.join(directory, f'{model_name}-{data_name}')
+
+
+def partitioned_directory_gs(model_name, data_name, storage=KGML_STORAGE,
+                             folder='data'):
+    directory = data_directory_gs(model_name, storage=storage, folder=folder)
+    return f'{directory}{model_name}-{data_name}/'
+
+
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+def partition_value(value):
+    'Returns the string of a partition key as written in partition paths.'
+
+    if pd.isna(value):
+        return HIVE_DEFAULT_PARTITION
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def partition_path(partition_cols, values):
+    'Returns the relative directory of a partition, e.g. year=2023/month=01'
+    return '/'.join(f'{col}={partition_value(value)}'
+                    for col, value in zip(partition_cols, values))
+
+
+def parse_partition_path(path):
+    'Returns the partition dictionary of a relative partition path.'
+    parts = [part for part in path.split('/') if '=' in part]
+    return dict(part.split('=', 1) for part in parts)
+
+
+def partition_matches(partition, partition_filter):
+    'Returns True if partition satisfies partition_filter.'
+
+    if partition_filter is None:
+        return True
+    if callable(partition_filter):
+        return partition_filter(partition)
+
+    for key, condition in partition_filter.items():
+        value = partition.get(key)
+        if value is None:
+            return False
+        if isinstance(condition, tuple):
+            low, high = condition
+            if low is not None and value < str(low):
+                return False
+            if high is not None and value > str(high):
+                return False
+        elif isinstance(condition, (list, set)):
+            if value not in [str(c) for c in condition]:
+                return False
+        elif value != str(condition):
+            return False
+    return True
+
+
+# -----------------------------------------------------------
+
+def save_partitioned_fs(model_name, data_name, data_type, df, partition_cols,
+                        folder='data', compression=None):
+    'Saves df as one part file per partition and returns their pathnames.'
+
+    directory = partitioned_directory_fs(model_name, data_name, folder=folder)
+    pathnames = []
+    for values, group in df.groupby(partition_cols, sort=False, dropna=False):
+        values = values if isinstance(values, tuple) else (values,)
+        partition_dir = os.path.join(directory,
+                                     partition_path(partition_cols, values))
+        os.makedirs(partition_dir, exist_ok=True)
+
+        # Overwrite the partition, leaving the other partitions untouched
+        for filename in os.listdir(partition_dir):
+            if filename.startswith('part-'):
+                os.remove(os.path.join(partition_dir, filename))
+        filename = compressed_filename(f'part-00000.{data_type}',
+                                       file_compression(data_type, compression))
+        pathname = os.path.join(partition_dir, filename)
+        save_data_file(group, pathname, data_type, compression=compression)
+        pathnames.append(pathname)
+
+    logger.warning(f'\nSaved {len(pathnames)} partitions to:\n{directory}\n')
+    return pathnames
+
+
+def save_partitioned_gs(model_name, data_name, data_type, df, partition_cols,
+                        bucket=KGML_BUCKET, storage=KGML_STORAGE,
+                        folder='data', compression=None,
+                        workers=TRANSFER_WORKERS):
+    'Saves df partitions locally and uploads them to Google Storage.'
+
+    pathnames = save_partitioned_fs(model_name, data_name, data_type, df,
+                                    partition_cols, folder=folder,
+                                    compression=compression)
+
+    directory = partitioned_directory_fs(model_name, data_name, folder=folder)
+    prefix = partitioned_directory_gs(model_name, data_name, storage=storage,
+                                      folder=folder)
+    gs_bucket = storage_client().bucket(bucket)
+    transfers = []
+    for pathname in pathnames:
+        relative = os.path.relpath(pathname, directory).replace(os.sep, '/')
+        transfers.append(('upload', gs_bucket.blob(prefix + relative), pathname))
+    report = transfer_blobs(transfers, workers=workers)
+    if report['failed']:
+        raise IOError(f"Failed to upload {len(report['failed'])} partitions: "
+                      f"{', '.join(report['failed'])}")
+    return pathnames
+
+
+# -----------------------------------------------------------
+
+def partition_files_fs(model_name, data_name, folder='data',
+                       partition_filter=None):
+    'Returns (partition, pathname) pairs of the matching local part files.'
+
+    directory = partitioned_directory_fs(model_name, data_name, folder=folder)
+    files = []
+    for dirpath, _, filenames in os.walk(directory):
+        relative = os.path.relpath(dirpath, directory).replace(os.sep, '/')
+        partition = parse_partition_path(relative)
+        if partition_matches(partition, partition_filter) is False:
+            continue
+        for filename in sorted(filenames):
+            if filename.startswith('part-'):
+                files.append((partition, os.path.join(dirpath, filename)))
+    return files
+
+
+def partition_blobs_gs(model_name, data_name, bucket=KGML_BUCKET,
+                       storage=KGML_STORAGE, folder='data',
+                       partition_filter=None):
+    'Returns (partition, blob) pairs of the matching part blobs.'
+
+    prefix = partitioned_directory_gs(model_name, data_name, storage=storage,
+                                      folder=folder)
+    blobs = []
+    for blob in list_blobs_indexed(prefix, bucket=bucket):
+        relative = blob.name[len(prefix):]
+        if blob_name(blob).startswith('part-') is False:
+            continue
+        partition = parse_partition_path(relative.rsplit('/', 1)[0])
+        if partition_matches(partition, partition_filter):
+            blobs.append((partition, blob))
+    return blobs
+
+
+def list_partitions(model_name, data_name, source, bucket=KGML_BUCKET,
+                    storage=KGML_STORAGE, folder='data', partition_filter=None):
+    'Returns the sorted partition dictionaries of a partitioned dataset.'
+
+    if source == 'file':
+        files = partition_files_fs(model_name, data_name, folder=folder,
+                                   partition_filter=partition_filter)
+    elif source == 'storage':
+        files = partition_blobs_gs(model_name, data_name, bucket=bucket,
+                                   storage=storage, folder=folder,
+                                   partition_filter=partition_filter)
+    else:
+        logger.error(f'Error: Invalid source {source}.')
         return None
 
+    partitions = {tuple(partition.items()) for partition, _ in files}
+    return [dict(partition) for partition in sorted(partitions)]
+
+
+# -----------------------------------------------------------
+
+def load_partitioned_fs(model_name, data_name, data_type, folder='data',
+                        partition_filter=None, usecols=None, dtype=None,
+                        filters=None, workers=TRANSFER_WORKERS):
+    'Loads and concatenates the matching partitions of a local dataset.'
+
+    files = partition_files_fs(model_name, data_name, folder=folder,
+                               partition_filter=partition_filter)
+    return load_part_files([pathname for _, pathname in files], data_type,
+                           usecols=usecols, dtype=dtype, filters=filters,
+                           workers=workers)
+
+
+def load_part_files(pathnames, data_type, usecols=None, dtype=None,
+                    filters=None, workers=TRANSFER_WORKERS):
+    'Loads and concatenates part files in parallel.'
+
+    if len(pathnames) == 0:
+        return pd.DataFrame()
+
+    def load_part(pathname):
+        return load_data_file(pathname, data_type, usecols=usecols,
+                              dtype=dtype, filters=filters)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        dfs = list(executor.map(load_part, pathnames))
+
+    return pd.concat(dfs, ignore_index=True)
+
+
+def load_partitioned_gs(model_name, data_name, data_type, bucket=KGML_BUCKET,
+                        storage=KGML_STORAGE, folder='data',
+                        partition_filter=None, usecols=None, dtype=None,
+                        filters=None, workers=TRANSFER_WORKERS, cache=True):
+    'Downloads the matching partitions of a dataset and loads them.'
+
+    blobs = partition_blobs_gs(model_name, data_name, bucket=bucket,
+                               storage=storage, folder=folder,
+                               partition_filter=partition_filter)
+
+    # Mirror the matching part blobs in the local partition layout
+    prefix = partitioned_directory_gs(model_name, data_name, storage=storage,
+                                      folder=folder)
+    directory = partitioned_directory_fs(model_name, data_name, folder=folder)
+    transfers = []
+    for _, blob in blobs:
+        pathname = os.path.join(directory, *blob.name[len(prefix):].split('/'))
+        os.makedirs(os.path.dirname(pathname), exist_ok=True)
+        transfers.append(('download', blob, pathname))
+    report = transfer_blobs(transfers, workers=workers, cache=cache)
+    if report['failed']:
+        raise IOError(f"Failed to download {len(report['failed'])} partitions: "
+                      f"{', '.join(report['failed'])}")
+
+    # Local part files deleted remotely since are not read
+    return load_part_files([pathname for _, _, pathname in transfers],
+                           data_type, usecols=usecols, dtype=dtype,
+                           filters=filters, workers=workers)
+
 
 # ----------------------------------------------------------
 # Save Results
 # -----------------------------------------------------------
 
-def results_type_pathname(model_name, data_name, data_type):
-    filename = f'{model_name}-{data_name}.{data_type}'
+def results_type_pathname(model_name, data_name, data_type, compression=None):
+    if compression == 'infer':
+        filename = data_filename(model_name, data_name, data_type)
+        return find_compressed_file(results_pathname(model_name, filename))
+    filename = data_filename(model_name, data_name, data_type,
+                             compression=compression)
     return results_pathname(model_name, filename)
 
 
-def save_results_fs(model_name, results_name, data_type, results):
+def save_results_fs(model_name, results_name, data_type, results,
+                    compression=None):
     'Saves data to local filesystem.'
 
-    pathname = results_type_pathname(model_name, results_name, data_type)
+    pathname = results_type_pathname(model_name, results_name, data_type,
+                                     compression=compression)
 
-    if data_type == 'csv':
-        save_csv(results, pathname)
-    elif data_type == 'json':
-        save_dict(results, pathname)
-    elif data_type == 'xlsx':
-        write_excel(results, pathname)
-    else:
-        logger.error(f'Error: Unrecognized data type {data_type}.')
+    return save_data_file(results, pathname, data_type,
+                          compression=compression)
 
 
 def save_results_gs(model_name, results_name, data_type, results,
-                    bucket=KGML_BUCKET, storage=KGML_STORAGE):
+                    bucket=KGML_BUCKET, storage=KGML_STORAGE, compression=None,
+                    write_behind=False):
     'Saves data to Google Storage.'
 
     # First save to local filesystem
-    save_results_fs(model_name, results_name, data_type, results)
+    save_results_fs(model_name, results_name, data_type, results,
+                    compression=compression)
+    pathname = results_type_pathname(model_name, results_name, data_type,
+                                     compression=compression)
+
+    # Upload in the background, see flush_uploads
+    if write_behind is True:
+        blob_path = results_directory_gs(model_name, bucket=bucket,
+                                         storage=storage)
+        return queue_upload(blob_path + os.path.basename(pathname), pathname,
+                            bucket=bucket)
     
     # Now upload to Google storage
-    pathname = results_type_pathname(model_name, results_name, data_type)
     upload_results_blob(model_name, pathname, bucket=bucket, storage=storage)
     
     return True
@@ -785,12 +3257,14 @@ def save_results_gs(model_name, results_name, data_type, results,
 # ----------------------------------------------------------
 
 def save_results_bq(model_name, results_name, results,
-                    project=PROJECT_ID, dataset=PROJECT_DATASET):
+                    project=PROJECT_ID, dataset=PROJECT_DATASET,
+                    mode='replace', keys=None):
     'Saves data to Google Big Query.'
 
     if project is not None and dataset is not None:
-        table_name = f'{model_name}-{data_name}'
-        table_to_bq(tdf, project=project, dataset=data_set, table_name=table_name)
+        table_name = f'{model_name}-{results_name}'
+        return table_to_bq(results, project=project, dataset=dataset,
+                           table_name=table_name, mode=mode, keys=keys)
     else:
         logger.error('Error: Must specify BQ project and dataset.')
         return False
@@ -800,17 +3274,19 @@ def save_results_bq(model_name, results_name, results,
 def save_results(model_name, results_name, data_type, results, destination,
                  project=PROJECT_ID, dataset=PROJECT_DATASET,
                  bucket=KGML_BUCKET, storage=KGML_STORAGE,
-                 folder='results'):
+                 folder='results', compression=None, write_behind=False):
     'Saves results to local filesystem or to Google Storage.'
 
     ensure_model_directory_fs(model_name, folder=folder)
     
     if destination == 'file':
-        save_results_fs(model_name, results_name, data_type, results)
+        save_results_fs(model_name, results_name, data_type, results,
+                        compression=compression)
         
     elif destination == 'storage':
         save_results_gs(model_name, results_name, data_type, results,
-                        storage=results)
+                        bucket=bucket, storage=storage,
+                        compression=compression, write_behind=write_behind)
         
     elif destination == 'bq' or destination == 'db':
         save_results_bq(model_name, results_name, results,
@@ -826,39 +3302,42 @@ def save_results(model_name, results_name, data_type, results, destination,
 # Load Results
 # -----------------------------------------------------------
 
-def load_results_fs(model_name, results_name, data_type):
+def load_results_fs(model_name, results_name, data_type, usecols=None,
+                    filters=None, compression='infer'):
     'Loads data from local filesystem.'
     
-    pathname = results_type_pathname(model_name, results_name, data_type)
-    
-    if data_type == 'csv':
-        return load_csv(pathname)
-    
-    elif data_type == 'json':
-        return load_dict(pathname)
-    
-    elif data_type == 'xlsx':
-        return read_excel(pathname)
-    
-    elif data_type == 'text' or data_type == 'html':
-        save_text_file(data, pathname)
-        
-    else:
-        logger.error(f'Error: Unrecognized data type {data_type}.')
-        return None
+    pathname = results_type_pathname(model_name, results_name, data_type,
+                                     compression=compression)
+
+    return load_data_file(pathname, data_type, usecols=usecols,
+                          filters=filters)
 
 
 # -----------------------------------------------------------
 
-def load_results_gs(model_name, results_name, data_type):
+def load_results_gs(model_name, results_name, data_type, bucket=KGML_BUCKET,
+                    storage=KGML_STORAGE, usecols=None, filters=None,
+                    compression='infer'):
     'Loads data from Google Storage.'
 
+    # Find the blob of the results, whichever codec compressed it
+    if compression == 'infer':
+        filename = data_filename(model_name, results_name, data_type)
+        blob_path = results_directory_gs(model_name, bucket=bucket,
+                                         storage=storage)
+        filename = os.path.basename(compressed_blob_name(blob_path + filename,
+                                                         bucket=bucket))
+    else:
+        filename = data_filename(model_name, results_name, data_type,
+                                 compression=compression)
+
     # First download from Google storage
-    pathname = results_type_pathname(model_name, results_name, data_type)
-    download_results_blob(model_name, pathname)
+    pathname = results_pathname(model_name, filename)
+    download_results_blob(model_name, pathname, bucket=bucket, storage=storage)
     
     # Now load from local filesystem
-    results = load_results_fs(model_name, results_name, data_type)
+    results = load_data_file(pathname, data_type, usecols=usecols,
+                             filters=filters)
     
     return results
 
@@ -868,17 +3347,22 @@ def load_results_gs(model_name, results_name, data_type):
 def load_results(model_name, results_name, data_type, source,
                  project=PROJECT_ID, dataset=PROJECT_DATASET,
                  bucket=KGML_BUCKET, storage=KGML_STORAGE,
-                 folder='results'):
+                 folder='results', usecols=None, filters=None,
+                 compression='infer'):
     'Loads data from either filesystem or Google Storage.'
 
     ensure_model_directory_fs(model_name, folder=folder)
     
     if source == 'file':
-        return load_results_fs(model_name, results_name, data_type)
+        return load_results_fs(model_name, results_name, data_type,
+                               usecols=usecols, filters=filters,
+                               compression=compression)
     
     elif source == 'storage':
         return load_results_gs(model_name, results_name, data_type,
-                               bucket=bucket, storage=storage)
+                               bucket=bucket, storage=storage,
+                               usecols=usecols, filters=filters,
+                               compression=compression)
     
     elif source == 'bq' or source == 'db':
         return load_data_bq(model_name, data_name, project, dataset)
@@ -888,12 +3372,66 @@ def load_results(model_name, results_name, data_type, source,
         return None
 
 
+# ----------------------------------------------------------
+# Asynchronous API
+# -----------------------------------------------------------
+
+# NB: The coroutines below run the blocking load and save functions on
+# a bounded executor shared by the process, so that gathering the loads
+# of many datasets takes about as long as the slowest one. Streaming
+# loads still return a synchronous iterator of dataframes.
+
+def async_executor():
+    'Returns the shared executor running the blocking I/O of coroutines.'
+    return get_client('executor', None,
+                      lambda: ThreadPoolExecutor(max_workers=ASYNC_WORKERS,
+                                                 thread_name_prefix='utils-async'))
+
+
+async def run_blocking(func, *args, **kwargs):
+    'Runs func(*args, **kwargs) on the async executor and returns its value.'
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(async_executor(),
+                                      partial(func, *args, **kwargs))
+
+
+async def aload_data(*args, **kwargs):
+    'Coroutine version of load_data.'
+    return await run_blocking(load_data, *args, **kwargs)
+
+
+async def asave_data(*args, **kwargs):
+    'Coroutine version of save_data.'
+    return await run_blocking(save_data, *args, **kwargs)
+
+
+async def aappend_data(*args, **kwargs):
+    'Coroutine version of append_data.'
+    return await run_blocking(append_data, *args, **kwargs)
+
+
+async def aload_results(*args, **kwargs):
+    'Coroutine version of load_results.'
+    return await run_blocking(load_results, *args, **kwargs)
+
+
+async def asave_results(*args, **kwargs):
+    'Coroutine version of save_results.'
+    return await run_blocking(save_results, *args, **kwargs)
+
+
+async def aload_datasets(loads):
+    'Loads a dictionary of names to load_data arguments concurrently.'
+
+    names = list(loads)
+    data = await asyncio.gather(*[aload_data(**loads[name]) for name in names])
+    return dict(zip(names, data))
+
+
 # ****************************************************************
 # Google Sheets 
 # ****************************************************************
 
-AUTH_FILE = os.environ['GOOGLE_APPLICATION_CREDENTIALS']
-
 # In this code:
 
 # We first import the necessary libraries.
@@ -906,70 +3444,203 @@ AUTH_FILE = os.environ['GOOGLE_APPLICATION_CREDENTIALS']
 # We convert the list of dictionaries into a DataFrame using pd.DataFrame.
 # Finally, we return the DataFrame.
 
-def get_google_client(json_key_file=AUTH_FILE):
-    # Define the scope of permissions
-    scope = [
-        'https://spreadsheets.google.com/feeds',
-        'https://www.googleapis.com/auth/drive'
-    ]
-
-    # Load the credentials
-    creds = ServiceAccountCredentials.from_json_keyfile_name(json_key_file, scope)
-    
-    # Authorize the clientsheet 
-    return gspread.authorize(creds)
+def get_google_client(json_key_file=None):
+    # Authorized clients are shared, see sheets_client
+    return sheets_client(json_key_file)
 
 
 # -----------------------------------------------------------
 
-def get_google_sheet(url: str, json_key_file=AUTH_FILE):
+def get_google_sheet(url: str, json_key_file=None, worksheet_name='Sheet1',
+                     create=False):
 
     # Get an authorized client
     client = get_google_client(json_key_file=json_key_file)
 
     # Get the instance of the Spreadsheet
     try:
-    # Get the instance of the Spreadsheet
         sheet = client.open_by_url(url)
-        # Get the first sheet of the spreadsheet
-        return sheet.worksheet('Sheet1'), client
-
     except Exception as err:
         print(f'\nError accessing Google sheet:\n{url}')
         return None, client
+
+    # Get the worksheet, creating it if specified
+    try:
+        return sheet.worksheet(worksheet_name), client
+    except gspread.WorksheetNotFound:
+        if create is True:
+            return sheet.add_worksheet(title=worksheet_name, rows=1000,
+                                       cols=26), client
+        print(f'\nNo worksheet {worksheet_name} in Google sheet:\n{url}')
+        return None, client
     
 
 # -----------------------------------------------------------
 
-def load_google_sheet(sheet_url: str, json_key_file=AUTH_FILE):
+# NB: Sheets are read as unformatted values, so numbers and booleans
+# keep their type, and one column at a time. Loaded sheets are cached
+# in memory along with the version of the spreadsheet reported by Drive,
+# so reading an unchanged spreadsheet again costs one metadata request.
+
+_sheet_cache = {}
+_sheet_cache_lock = threading.Lock()
+
+
+def spreadsheet_revision(spreadsheet_id, json_key_file=None):
+    'Returns the Drive version of a spreadsheet or None if unavailable.'
+
+    try:
+        metadata = drive_service(json_key_file).files().get(
+            fileId=spreadsheet_id, fields='version, modifiedTime',
+            supportsAllDrives=True).execute()
+        return f"{metadata.get('version')}-{metadata.get('modifiedTime')}"
+    except Exception as err:
+        logger.warning(f'Cannot get the revision of {spreadsheet_id}:\n{err}')
+        return None
+
+
+def worksheet_to_df(worksheet):
+    'Returns a dataframe of a worksheet built column by column.'
+
+    columns = worksheet.get(major_dimension='COLUMNS',
+                            value_render_option='UNFORMATTED_VALUE',
+                            date_time_render_option='FORMATTED_STRING')
+    columns = [column for column in columns if len(column) > 0]
+    if len(columns) == 0:
+        return pd.DataFrame()
+
+    # Columns are trimmed of their trailing empty cells
+    rows = max(len(column) for column in columns) - 1
+    data = {}
+    for i, column in enumerate(columns):
+        values = [None if value == '' else value for value in column[1:]]
+        data[i] = pd.Series(values + [None] * (rows - len(values)))
+    df = pd.DataFrame(data)
+    df.columns = [column[0] for column in columns]
+    return df
+
+
+def load_google_sheet(sheet_url: str, json_key_file=None,
+                      worksheet_name='Sheet1', cache=True):
+
+    # Skip the read if the spreadsheet has not changed since it was cached
+    key = (gspread.utils.extract_id_from_url(sheet_url), worksheet_name)
+    revision = spreadsheet_revision(key[0], json_key_file) \
+        if cache is True else None
+    with _sheet_cache_lock:
+        cached = _sheet_cache.get(key)
+    if revision is not None and cached is not None and cached[0] == revision:
+        return cached[1].copy()
 
     # Get the instance of the Spreadsheet
-    worksheet, client = get_google_sheet(sheet_url, json_key_file=json_key_file)
+    worksheet, client = get_google_sheet(sheet_url, json_key_file=json_key_file,
+                                         worksheet_name=worksheet_name)
 
     if worksheet is not None:
-        # Get all the records of the data
-        data = worksheet.get_all_records()
-    
-        # Convert the list of dictionaries into a DataFrame
-        df = pd.DataFrame(data)
-        return df
+        df = worksheet_to_df(worksheet)
+        if revision is not None:
+            with _sheet_cache_lock:
+                _sheet_cache[key] = (revision, df)
+        return df.copy()
     else:
         return None
 
 
 # -----------------------------------------------------------
 
-def save_google_sheet(df, sheet_url, json_key_file=AUTH_FILE):
-
-    # Get the instance of the Spreadsheet
-    worksheet, client = get_google_sheet(sheet_url, json_key_file=json_key_file)
-
-    # Create worksheet if needed
+# NB: Saving a dataframe only writes the rows whose cells differ from the
+# current contents of the worksheet. Cells are compared by type and value,
+# so that 1, 1.0 and True are different cells. Consecutive changed rows
+# are written as one range and ranges are sent in batch updates of at most
+# SHEETS_BATCH_CELLS cells. Cells beyond the dataframe are cleared.
+
+def sheet_value(value):
+    'Returns a JSON serializable cell value.'
+
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return ''
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (int, float, bool, str)):
+        return value
+    return str(value)
+
+
+def sheet_cells(row):
+    'Returns the (type, value) pairs of the cells of a row.'
+    return [(type(value), value) for value in row]
+
+
+def sheet_updates(current, values, max_cells=SHEETS_BATCH_CELLS):
+    'Returns the batches of row ranges of values that differ from current.'
+
+    height = max(len(current), len(values))
+    width = max([len(row) for row in current + values] + [1])
+
+    def row(grid, i):
+        cells = list(grid[i]) if i < len(grid) else []
+        return cells + [''] * (width - len(cells))
+
+    # Group consecutive changed rows in ranges of at most max_cells cells
+    max_rows = max(1, max_cells // width)
+    ranges = []
+    for i in range(height):
+        if sheet_cells(row(current, i)) == sheet_cells(row(values, i)):
+            continue
+        if ranges and ranges[-1][1] == i - 1 and \
+           ranges[-1][1] - ranges[-1][0] + 1 < max_rows:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+
+    batches, batch, cells = [], [], 0
+    for start, end in ranges:
+        update = {'range': f'{gspread.utils.rowcol_to_a1(start + 1, 1)}:'
+                           f'{gspread.utils.rowcol_to_a1(end + 1, width)}',
+                  'values': [row(values, i) for i in range(start, end + 1)]}
+        size = (end - start + 1) * width
+        if batch and cells + size > max_cells:
+            batches.append(batch)
+            batch, cells = [], 0
+        batch.append(update)
+        cells += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def save_google_sheet(df, sheet_url, json_key_file=None,
+                      worksheet_name='Sheet1', max_cells=SHEETS_BATCH_CELLS):
+
+    # Get the instance of the Spreadsheet, creating the worksheet if needed
+    worksheet, client = get_google_sheet(sheet_url, json_key_file=json_key_file,
+                                         worksheet_name=worksheet_name,
+                                         create=True)
     if worksheet is None:
-        worksheet =  worksheet.create(sheet_url)
+        logger.error(f'Error: Cannot save to Google sheet {sheet_url}.')
+        return False
 
-    # Replace contents with dataframe(sheet_url
-    worksheet.update([df.columns.values.tolist()] + df.values.tolist())
+    # Compare the dataframe with the current contents
+    values = [[sheet_value(value) for value in row]
+              for row in [df.columns.tolist()] + df.values.tolist()]
+    current = worksheet.get_values(value_render_option='UNFORMATTED_VALUE',
+                                   date_time_render_option='FORMATTED_STRING')
+    batches = sheet_updates(current, values, max_cells=max_cells)
+
+    # Grow the worksheet so that every range fits
+    rows = max(len(current), len(values))
+    cols = max([len(row) for row in current + values] + [1])
+    if worksheet.row_count < rows or worksheet.col_count < cols:
+        worksheet.resize(rows=max(worksheet.row_count, rows),
+                         cols=max(worksheet.col_count, cols))
+
+    for batch in batches:
+        worksheet.batch_update(batch, value_input_option='RAW')
+
+    logger.warning(f'\nUpdated {sum(len(batch) for batch in batches)} row '
+                   f'ranges in {len(batches)} requests.\n')
+    with _sheet_cache_lock:
+        _sheet_cache.pop((worksheet.spreadsheet.id, worksheet_name), None)
     return True
 
 
@@ -988,35 +3659,43 @@ def extract_folder_id(folder_url):
 
 # -----------------------------------------------------------
 
-def list_files_in_folder(folder_url, json_key_file=AUTH_FILE):
+DRIVE_FOLDER_TYPE = 'application/vnd.google-apps.folder'
+
+
+def list_files_in_folder(folder_url, json_key_file=None, page_size=1000,
+                         verbose=True):
+    'Returns the files of a Drive folder, following every result page.'
 
     # Get the folder id
     folder_id = extract_folder_id(folder_url)
     
-    # Load the credentials
-    creds = service_account.Credentials.from_service_account_file(
-        json_key_file,
-        scopes=['https://www.googleapis.com/auth/drive']
-    )
-
-    # Build the service
-    service = build('drive', 'v3', credentials=creds)
-
-    # Call the Drive v3 API to list the files in the folder
-    results = service.files().list(
-        q=f"'{folder_id}' in parents",
-        fields="nextPageToken, files(id, name)"
-    ).execute()
-
-    # Get the list of files
-    files = results.get('files', [])
-
-    if not files:
-        print('No files found.')
-    else:
-        print('Files:')
-        for file in files:
-            print(f'{file["name"]} ({file["id"]})')
+    # Get the shared service
+    service = drive_service(json_key_file)
+
+    # Call the Drive v3 API once per page of files in the folder
+    files = []
+    page_token = None
+    while True:
+        results = service.files().list(
+            q=f"'{folder_id}' in parents and trashed = false",
+            fields="nextPageToken, files(id, name, mimeType, size, md5Checksum)",
+            pageSize=page_size,
+            pageToken=page_token,
+            supportsAllDrives=True,
+            includeItemsFromAllDrives=True
+        ).execute()
+        files += results.get('files', [])
+        page_token = results.get('nextPageToken')
+        if page_token is None:
+            break
+
+    if verbose is True:
+        if not files:
+            print('No files found.')
+        else:
+            print('Files:')
+            for file in files:
+                print(f'{file["name"]} ({file["id"]})')
 
     return files
 
@@ -1028,34 +3707,78 @@ def list_files_in_folder(folder_url, json_key_file=AUTH_FILE):
 
 # -----------------------------------------------------------
 
-def download_file(file_id, json_key_file, local_file_path):
-    # Load the credentials
-    creds = service_account.Credentials.from_service_account_file(
-        json_key_file,
-        scopes=['https://www.googleapis.com/auth/drive']
-    )
+# NB: Drive files are streamed chunk by chunk to <local path>.part which
+# is renamed once complete and verified against the Drive MD5 checksum.
+# A failed download resumes from the bytes already written, including
+# across calls, by requesting the remaining bytes with a Range header.
+# Files without a reported size are fetched in a single request.
 
-    # Build the service
-    service = build('drive', 'v3', credentials=creds)
+def file_md5_hex(pathname):
+    'Returns the hexadecimal MD5 digest of a file, as reported by Drive.'
 
-    # Request the file metadata
-    file_metadata = service.files().get(fileId=file_id).execute()
-    file_name = file_metadata['name']
+    md5 = hashlib.md5()
+    with open(pathname, 'rb') as f:
+        for chunk in iter(lambda: f.read(DRIVE_CHUNKSIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
 
-    # Request the file content
-    request = service.files().get_media(fileId=file_id)
-    downloaded_io = io.BytesIO()
-    downloader = MediaIoBaseDownload(downloaded_io, request)
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-        print(f'Download {int(status.progress() * 100)}%.')
 
-    # Save the file to the local file system
-    with open(local_file_path, 'wb') as out_file:
-        out_file.write(downloaded_io.getvalue())
+def download_file(file_id, json_key_file, local_file_path,
+                  chunksize=DRIVE_CHUNKSIZE, retries=DRIVE_RETRIES,
+                  verbose=True):
+    'Streams a Drive file to local_file_path, resuming after failures.'
 
-    print(f'File {file_name} downloaded to {local_file_path}.')
+    # Get the shared service
+    service = drive_service(json_key_file)
+
+    # Request the file metadata
+    file_metadata = service.files().get(
+        fileId=file_id, fields='name, size, md5Checksum',
+        supportsAllDrives=True).execute()
+    file_name = file_metadata['name']
+    size = int(file_metadata.get('size', 0))
+
+    part_path = f'{local_file_path}.part'
+    attempt = 0
+    while True:
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        if offset >= size > 0:
+            break
+        try:
+            # Request the remaining file content, appending to the part file
+            with open(part_path, 'ab' if size > 0 else 'wb') as out_file:
+                while True:
+                    request = service.files().get_media(
+                        fileId=file_id, supportsAllDrives=True)
+                    if size > 0:
+                        end = min(offset + chunksize, size) - 1
+                        request.headers['Range'] = f'bytes={offset}-{end}'
+                    content = request.execute()
+                    out_file.write(content)
+                    offset += len(content)
+                    if verbose is True and size > 0:
+                        print(f'Download {int(offset / size * 100)}%.')
+                    if size == 0 or offset >= size or not content:
+                        break
+            break
+        except Exception as err:
+            attempt += 1
+            if attempt > retries:
+                logger.error(f'Error downloading {file_name}:\n{err}')
+                raise
+            logger.warning(f'Resuming download of {file_name}:\n{err}')
+            sleep(0.5 * 2**attempt)
+
+    # Discard a corrupted download rather than resuming it later
+    md5 = file_metadata.get('md5Checksum')
+    if md5 is not None and file_md5_hex(part_path) != md5:
+        os.remove(part_path)
+        raise IOError(f'Checksum mismatch downloading {file_name}.')
+    os.replace(part_path, local_file_path)
+
+    if verbose is True:
+        print(f'File {file_name} downloaded to {local_file_path}.')
+    return local_file_path
 
 # Usage:
 # Replace 'your-file-id' with the ID of your Google Drive file
@@ -1063,6 +3786,66 @@ def download_file(file_id, json_key_file, local_file_path):
 # Replace 'your-local-file-path' with the path where you want to save the file
 # download_file('your-file-id', 'your-json-key-file.json', 'your-local-file-path')
 
+# -----------------------------------------------------------
+
+def drive_file_path(file, directory, names=None):
+    'Returns the local path of a Drive file, unique among names.'
+
+    name = file['name']
+    if names is not None and names[name] > 1:
+        stem, ext = os.path.splitext(name)
+        name = f"{stem}-{file['id']}{ext}"
+    return os.path.join(directory, name)
+
+
+def download_files(files, directory, json_key_file=None,
+                   workers=DRIVE_WORKERS, retries=DRIVE_RETRIES):
+    'Downloads Drive files to directory in parallel, returns a report.'
+
+    # NB: Each thread uses its own Drive service, see drive_service.
+    # Drive allows several files with the same name in a folder, those
+    # are saved as <name>-<file id><extension> so none is overwritten.
+    os.makedirs(directory, exist_ok=True)
+    start = time()
+    report = {'files': 0, 'failed': [], 'bytes': 0}
+
+    def download(file, pathname):
+        download_file(file['id'], json_key_file, pathname, retries=retries,
+                      verbose=False)
+        return os.path.getsize(pathname)
+
+    files = list({file['id']: file for file in files}.values())
+    names = Counter(file['name'] for file in files)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(download, file,
+                                   drive_file_path(file, directory, names)):
+                   file['name'] for file in files}
+        for future in as_completed(futures):
+            try:
+                report['bytes'] += future.result()
+                report['files'] += 1
+            except Exception as err:
+                logger.error(f'Error downloading {futures[future]}:\n{err}')
+                report['failed'].append(futures[future])
+
+    report['elapsed'] = round(time() - start, 2)
+    logger.warning(f"\nDownloaded {report['files']} files "
+                   f"({round(report['bytes'] / 2**20, 2)} MB) in "
+                   f"{report['elapsed']}s, {len(report['failed'])} failed.\n")
+    return report
+
+
+def download_folder(folder_url, directory, json_key_file=None,
+                    workers=DRIVE_WORKERS, retries=DRIVE_RETRIES):
+    'Downloads the files of a Drive folder to directory in parallel.'
+
+    files = [file for file in list_files_in_folder(folder_url, json_key_file,
+                                                   verbose=False)
+             if file.get('mimeType') != DRIVE_FOLDER_TYPE]
+    return download_files(files, directory, json_key_file=json_key_file,
+                          workers=workers, retries=retries)
+
+
 # ****************************************************************
 # End of File
 # ****************************************************************
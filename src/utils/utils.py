@@ -3,6 +3,8 @@
 # *********************************************************************
 
 # Standard Python imports
+import types
+import importlib
 from time import time
 from functools import wraps
 
@@ -23,6 +25,36 @@ def timing(func):
     return wrap
 
 
+# --------------------------------------------------------------
+# Lazy Imports
+# --------------------------------------------------------------
+
+# NB: Third party packages such as pandas or the GCP client libraries
+# take seconds to import. Modules of this package bind them with
+# lazy_import so that they are only imported when first used.
+
+class LazyModule(types.ModuleType):
+    'A module placeholder that imports the module on first attribute access.'
+
+    def _load(self):
+        module = self.__dict__.get('_module')
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    'Returns a placeholder for module name that imports it on first use.'
+    return LazyModule(name)
+
+
 # ****************************************************************
 # End of File
 # ****************************************************************
@@ -8,14 +8,26 @@ from itertools import chain, zip_longest
 import re
 
 # HTML Tools imports
-import requests
 import urllib
-import html2text
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse, quote, unquote
-from selenium import webdriver
 
-CHROME_OPTIONS = webdriver.ChromeOptions()
+from utils.utils import lazy_import
+
+requests = lazy_import('requests')
+html2text = lazy_import('html2text')
+bs4 = lazy_import('bs4')
+webdriver = lazy_import('selenium.webdriver')
+
+
+def chrome_options():
+    'Returns default options for the Chrome web driver.'
+    return webdriver.ChromeOptions()
+
+
+def __getattr__(name):
+    if name == 'CHROME_OPTIONS':
+        return chrome_options()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # --------------------------------------------------------------------
@@ -66,7 +78,8 @@ def get_url_data(url, params={}):
     else:
         return str(response.content)
 
-def get_chrome_page_source(url, options=CHROME_OPTIONS):
+def get_chrome_page_source(url, options=None):
+    options = chrome_options() if options is None else options
     browser = webdriver.Chrome(options=options)
     browser.get(url)
     return browser.page_source
@@ -94,7 +107,7 @@ def get_url_content(url):
 # --------------------------------------------------------------------
 
 def parse_page_source(url, page_source):
-    htmlcontent = BeautifulSoup(page_source, "html.parser")
+    htmlcontent = bs4.BeautifulSoup(page_source, "html.parser")
     text = htmlcontent.get_text()
     title = htmlcontent.find("h1")
     title = title.string.replace('\n', '').strip() if title is not None else ''
@@ -0,0 +1,520 @@
+# ****************************************************************
+# Unit Tests for files.py
+# ****************************************************************
+
+import io
+import os
+import sys
+import tempfile
+import threading
+import contextlib
+import unittest
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils import files
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    np = pd = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+# CLI: python -m unittest tests/test_files.py
+
+# ----------------------------------------------------------------
+# File Discovery
+# ----------------------------------------------------------------
+
+class TestScanFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        os.makedirs(os.path.join(self.directory, 'sub', 'deep'))
+        for name, size, mtime in [('a.csv', 10, 1000), ('b.json', 30, 2000),
+                                  ('sub/c.csv', 20, 3000),
+                                  ('sub/deep/d.csv', 40, 4000)]:
+            pathname = os.path.join(self.directory, *name.split('/'))
+            with open(pathname, 'wb') as f:
+                f.write(b'x' * size)
+            os.utime(pathname, (mtime, mtime))
+
+    def tearDown(self):
+        files.clear_scan_cache()
+        self.tmp.cleanup()
+
+    def scan(self, **kwargs):
+        return [os.path.relpath(pathname, self.directory).replace(os.sep, '/')
+                for pathname in files.scan_files(self.directory, **kwargs)]
+
+    def test_recursive(self):
+        self.assertEqual(self.scan(sort='name'), ['a.csv', 'b.json'])
+        self.assertEqual(self.scan(recursive=True, sort='name'),
+                         ['a.csv', 'b.json', 'sub/c.csv', 'sub/deep/d.csv'])
+
+    def test_pattern_and_regex(self):
+        self.assertEqual(self.scan(pattern='*.csv', recursive=True,
+                                   sort='name'),
+                         ['a.csv', 'sub/c.csv', 'sub/deep/d.csv'])
+        self.assertEqual(self.scan(regex=r'^sub/[^/]+$', recursive=True),
+                         ['sub/c.csv'])
+
+    def test_size_and_time(self):
+        self.assertEqual(self.scan(min_size=20, max_size=30, recursive=True,
+                                   sort='name'),
+                         ['b.json', 'sub/c.csv'])
+        self.assertEqual(self.scan(after=2000, before=4000, recursive=True,
+                                   sort='mtime'),
+                         ['b.json', 'sub/c.csv'])
+
+    def test_sort(self):
+        self.assertEqual(self.scan(recursive=True, sort='size', reverse=True),
+                         ['sub/deep/d.csv', 'b.json', 'sub/c.csv', 'a.csv'])
+        with self.assertRaises(ValueError):
+            self.scan(sort='owner')
+
+    def test_cache_follows_directory_changes(self):
+        self.assertEqual(self.scan(cache=True, sort='name'),
+                         ['a.csv', 'b.json'])
+        with open(os.path.join(self.directory, 'e.csv'), 'w') as f:
+            f.write('x')
+        os.utime(self.directory, (5000, 5000))
+        self.assertEqual(self.scan(cache=True, sort='name'),
+                         ['a.csv', 'b.json', 'e.csv'])
+
+    def test_files_in_dir(self):
+        self.assertEqual(files.files_in_dir(self.directory, filter='.csv'),
+                         [os.path.join(self.directory, 'a.csv')])
+
+
+# ----------------------------------------------------------------
+# CSV Files
+# ----------------------------------------------------------------
+
+class TestLoadCSV(unittest.TestCase):
+
+    def read_csv_options(self, dtype):
+        read_csv = mock.Mock(return_value='df')
+        with mock.patch.object(files, 'pd', SimpleNamespace(read_csv=read_csv)):
+            self.assertEqual(files.load_csv('data.csv', dtype=dtype), 'df')
+        return read_csv.call_args.kwargs
+
+    def test_date_format_only_with_dates(self):
+        options = self.read_csv_options({'a': 'int64'})
+        self.assertNotIn('date_format', options)
+        self.assertNotIn('parse_dates', options)
+        options = self.read_csv_options(None)
+        self.assertNotIn('date_format', options)
+
+    def test_dates_are_parsed_separately(self):
+        options = self.read_csv_options({'a': 'int64',
+                                         'day': 'datetime64[ns]'})
+        self.assertEqual(options['dtype'], {'a': 'int64'})
+        self.assertEqual(options['parse_dates'], ['day'])
+        self.assertEqual(options['date_format'], 'ISO8601')
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_optimized_loads_are_quiet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pathname = os.path.join(directory, 'data.csv')
+            pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'x', 'y']}).to_csv(
+                pathname, index=False)
+            stdout = io.StringIO()
+            with contextlib.redirect_stdout(stdout):
+                df = files.load_csv(pathname, optimize_memory=True)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(str(df['a'].dtype), 'int8')
+        self.assertIn('memory_usage', df.attrs)
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_strings_become_categories(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pathname = os.path.join(directory, 'orders.csv')
+            pd.DataFrame({'orderId': [f'o-{i}' for i in range(100)],
+                          'vendorName': ['acme', 'globex'] * 50,
+                          'orderStatus': ['open', 'paid', 'void', 'paid'] * 25,
+                          'total': [1.5] * 100}).to_csv(pathname, index=False)
+            df = files.load_csv(pathname, optimize_memory=True)
+        self.assertEqual(str(df['vendorName'].dtype), 'category')
+        self.assertEqual(str(df['orderStatus'].dtype), 'category')
+        self.assertNotEqual(str(df['orderId'].dtype), 'category')
+        self.assertEqual(df['orderStatus'].tolist()[:3], ['open', 'paid', 'void'])
+
+
+@unittest.skipIf(pd is None or pa is None, 'pandas or pyarrow is not installed')
+class TestCSVSchema(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pathname = os.path.join(directory.name, 'data.csv')
+        self.sidecar = self.pathname + '.schema.json'
+        self.df = pd.DataFrame({'a': range(10), 'b': ['x', 'y'] * 5,
+                                'c': [0.5 * i for i in range(10)]})
+        self.df.to_csv(self.pathname, index=False)
+
+    def test_sidecar_is_written_on_first_load(self):
+        self.assertFalse(os.path.isfile(self.sidecar))
+        files.load_csv(self.pathname, schema=True)
+        schema = files.load_dict(self.sidecar)
+        self.assertEqual(schema['dtypes']['a'], 'int64')
+        self.assertEqual(schema['size'], os.path.getsize(self.pathname))
+
+    def test_sidecar_is_reused_while_the_file_is_unchanged(self):
+        files.load_csv(self.pathname, schema=True)
+        schema = files.load_dict(self.sidecar)
+        schema['dtypes']['a'] = 'float64'
+        files.save_dict(schema, self.sidecar)
+        df = files.load_csv(self.pathname, schema=True)
+        self.assertEqual(str(df['a'].dtype), 'float64')
+        df = files.load_csv(self.pathname, schema=True, dtype={'a': 'int32'})
+        self.assertEqual(str(df['a'].dtype), 'int32')
+
+    def test_sidecar_is_ignored_after_the_file_changes(self):
+        files.load_csv(self.pathname, schema=True)
+        schema = files.load_dict(self.sidecar)
+        schema['dtypes']['a'] = 'float64'
+        files.save_dict(schema, self.sidecar)
+        info = os.stat(self.pathname)
+        os.utime(self.pathname, (info.st_atime, info.st_mtime + 10))
+        self.assertIsNone(files.load_csv_schema(self.pathname))
+        df = files.load_csv(self.pathname, schema=True)
+        self.assertEqual(str(df['a'].dtype), 'int64')
+        # The stale sidecar is replaced by the dtypes of the new load
+        self.assertEqual(files.load_csv_schema(self.pathname)['dtypes']['a'],
+                         'int64')
+        self.df.head(5).to_csv(self.pathname, index=False)
+        self.assertIsNone(files.load_csv_schema(self.pathname))
+
+    def test_arrow_types(self):
+        self.assertEqual(files.arrow_type('int32'), pa.int32())
+        self.assertEqual(files.arrow_type('category'), pa.string())
+        self.assertIsNone(files.arrow_type('Int64'))
+
+    def test_pyarrow_engine_maps_dtypes(self):
+        df = files.load_csv(self.pathname, engine='pyarrow',
+                            dtype={'a': 'int32', 'b': 'category',
+                                   'c': 'Int64'})
+        self.assertEqual(str(df['a'].dtype), 'int32')
+        self.assertEqual(str(df['b'].dtype), 'category')
+        # Unsupported dtypes are left to type inference
+        self.assertEqual(str(df['c'].dtype), 'float64')
+        self.assertEqual(df['b'].tolist(), self.df['b'].tolist())
+
+    def test_pyarrow_engine_uses_the_sidecar(self):
+        files.load_csv(self.pathname, schema=True)
+        schema = files.load_dict(self.sidecar)
+        schema['dtypes']['a'] = 'int16'
+        files.save_dict(schema, self.sidecar)
+        df = files.load_csv(self.pathname, engine='pyarrow', schema=True,
+                            usecols=['a', 'b'])
+        self.assertEqual(list(df.columns), ['a', 'b'])
+        self.assertEqual(str(df['a'].dtype), 'int16')
+
+    def test_chunked_pyarrow_reads(self):
+        gzipped = self.pathname + '.gz'
+        self.df.to_csv(gzipped, index=False)
+        for pathname in [self.pathname, gzipped]:
+            with files.load_csv(pathname, engine='pyarrow', chunksize=3,
+                                dtype={'a': 'int8', 'b': 'category'}) as chunks:
+                self.assertIsInstance(chunks, files.CSVChunks)
+                chunks = list(chunks)
+            self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 1])
+            self.assertEqual(str(chunks[0]['a'].dtype), 'int8')
+            self.assertEqual(str(chunks[-1]['b'].dtype), 'category')
+            df = pd.concat(chunks, ignore_index=True)
+            self.assertEqual(df['a'].tolist(), list(range(10)))
+
+    def test_stream_csv_arrow_chunks_span_batches(self):
+        chunks = list(files.stream_csv_arrow(self.pathname, 4,
+                                             usecols=['a']))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 2])
+        self.assertEqual(list(chunks[0].columns), ['a'])
+        self.assertEqual(chunks[2]['a'].tolist(), [8, 9])
+
+
+class TestCSVAppender(unittest.TestCase):
+
+    def read_rows(self, filename):
+        with files.open_file(filename, 'rt') as f:
+            return [line.rstrip('\r\n') for line in f]
+
+    def test_rotated_filename(self):
+        self.assertEqual(files.rotated_filename(os.path.join('d', 'x.csv.gz'),
+                                                2),
+                         os.path.join('d', 'x.2.csv.gz'))
+        self.assertEqual(files.rotated_filename('x', 1), 'x.1')
+
+    def test_header_is_written_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.csv')
+            for i in range(2):
+                with files.CSVAppender(filename, header=['a', 'b']) as writer:
+                    writer.writerow([i, i])
+            self.assertEqual(self.read_rows(filename), ['a,b', '0,0', '1,1'])
+
+    def test_rows_are_buffered(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.csv')
+            writer = files.CSVAppender(filename, buffer_rows=3,
+                                       flush_interval=3600)
+            writer.writerows([[1], [2]])
+            self.assertEqual(os.path.getsize(filename), 0)
+            writer.writerow([3])
+            self.assertEqual(self.read_rows(filename), ['1', '2', '3'])
+            writer.close()
+
+    def test_buffered_rows_are_flushed_on_time(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.csv')
+            with files.CSVAppender(filename, buffer_rows=100,
+                                   flush_interval=0.05) as writer:
+                writer.writerow([1])
+                self.assertIsNotNone(writer.timer)
+                writer.timer.join(5)
+                self.assertEqual(self.read_rows(filename), ['1'])
+                self.assertIsNone(writer.timer)
+                # A flush cancels the pending timer
+                writer.writerow([2])
+                timer = writer.timer
+                writer.flush()
+                self.assertIsNone(writer.timer)
+                self.assertTrue(timer.finished.is_set())
+            self.assertEqual(self.read_rows(filename), ['1', '2'])
+
+    def test_files_are_rotated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'log.csv.gz')
+            with files.CSVAppender(filename, header=['n'], buffer_rows=1,
+                                   max_bytes=1) as writer:
+                for i in range(3):
+                    writer.writerow([i])
+            names = ['log.1.csv.gz', 'log.2.csv.gz', 'log.csv.gz']
+            self.assertEqual(sorted(os.listdir(directory)), names)
+            self.assertEqual([self.read_rows(os.path.join(directory, name))
+                              for name in names],
+                             [['n', '0'], ['n', '1'], ['n', '2']])
+
+
+# ----------------------------------------------------------------
+# Parquet Files
+# ----------------------------------------------------------------
+
+@unittest.skipIf(pd is None or pa is None, 'pandas or pyarrow is not installed')
+class TestParquet(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pathname = os.path.join(directory.name, 'data.parquet')
+        self.df = pd.DataFrame({'year': [2021, 2022, 2023, 2024] * 25,
+                                'status': [True, False] * 50,
+                                'price': [float(i) for i in range(100)]})
+
+    def test_round_trip(self):
+        self.assertTrue(files.save_parquet(self.df, self.pathname,
+                                           compression='zstd'))
+        df = files.load_parquet(self.pathname)
+        self.assertTrue(df.equals(self.df))
+
+    def test_columns_and_filters_are_pushed_down(self):
+        # Sorted by year, each row group holds one year
+        self.df.sort_values('year').to_parquet(self.pathname, index=False,
+                                               row_group_size=25)
+        df = files.load_parquet(self.pathname, columns=['year', 'price'],
+                                filters=[('year', '>=', 2023),
+                                         ('status', '==', True)])
+        self.assertEqual(list(df.columns), ['year', 'price'])
+        self.assertEqual(sorted(set(df['year'])), [2023])
+        self.assertEqual(len(df), 25)
+        # Filters in disjunctive normal form
+        df = files.load_parquet(self.pathname, columns=['year'],
+                                filters=[[('year', '==', 2021)],
+                                         [('year', '==', 2024)]])
+        self.assertEqual(sorted(set(df['year'])), [2021, 2024])
+
+    def test_stream_parquet(self):
+        files.save_parquet(self.df, self.pathname)
+        chunks = list(files.stream_parquet(self.pathname, 30,
+                                           columns=['price']))
+        self.assertEqual([len(chunk) for chunk in chunks], [30, 30, 30, 10])
+        self.assertEqual(pd.concat(chunks)['price'].tolist(),
+                         self.df['price'].tolist())
+
+
+# ----------------------------------------------------------------
+# Excel Files
+# ----------------------------------------------------------------
+
+@unittest.skipIf(pd is None or openpyxl is None,
+                 'pandas or openpyxl is not installed')
+class TestExcel(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'book.xlsx')
+
+    def frame(self, rows):
+        return pd.DataFrame({'n': range(rows),
+                             'label': [f'row{i}' for i in range(rows)],
+                             'value': [i / 2 for i in range(rows)]})
+
+    def test_large_frames_are_streamed(self):
+        df = self.frame(files.EXCEL_STREAMING_ROWS + 5)
+        with mock.patch.object(files, 'write_excel_streaming',
+                               wraps=files.write_excel_streaming) as streaming:
+            self.assertTrue(files.write_excel(df, self.filename))
+        self.assertEqual(streaming.call_count, 1)
+        pd.testing.assert_frame_equal(files.read_excel(self.filename), df)
+
+    def test_small_frames_are_not_streamed(self):
+        df = self.frame(10)
+        with mock.patch.object(files, 'write_excel_streaming') as streaming:
+            files.write_excel(df, self.filename)
+        self.assertEqual(streaming.call_count, 0)
+        pd.testing.assert_frame_equal(files.read_excel(self.filename), df)
+
+    def test_multiple_sheets(self):
+        sheets = {'first': self.frame(3),
+                  'second': iter([self.frame(2), self.frame(2)])}
+        self.assertTrue(files.write_excel(sheets, self.filename))
+        self.assertEqual(files.excel_sheet_names(self.filename),
+                         ['first', 'second'])
+        frames = files.read_excel(self.filename, sheet_name=None)
+        self.assertEqual(list(frames), ['first', 'second'])
+        pd.testing.assert_frame_equal(frames['first'], self.frame(3))
+        self.assertEqual(frames['second']['n'].tolist(), [0, 1, 0, 1])
+        frames = files.read_excel(self.filename, sheet_name=['second'])
+        self.assertEqual(list(frames), ['second'])
+
+    def test_sheets_are_read_serially_by_default(self):
+        files.write_excel({'a': self.frame(2), 'b': self.frame(3)},
+                          self.filename)
+        with mock.patch.object(files, 'ProcessPoolExecutor') as executor:
+            frames = files.read_excel(self.filename, sheet_name=None)
+        self.assertEqual(executor.call_count, 0)
+        self.assertEqual([len(df) for df in frames.values()], [2, 3])
+
+    def test_stream_chunk_sizes(self):
+        files.write_excel(self.frame(25), self.filename)
+        chunks = list(files.stream_excel(self.filename, chunksize=10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(list(chunks[0].columns), ['n', 'label', 'value'])
+        self.assertEqual(chunks[2]['label'].tolist()[-1], 'row24')
+        chunks = list(files.stream_excel(self.filename, chunksize=25))
+        self.assertEqual([len(chunk) for chunk in chunks], [25])
+
+
+# ----------------------------------------------------------------
+# JSON Files
+# ----------------------------------------------------------------
+
+RECORDS = [{'id': 1, 'name': 'café', 'tags': ['a', 'b']},
+           {'id': 2, 'name': None, 'score': 0.5, 'nested': {'x': [1, 2]}}]
+
+
+class TestJSONLines(unittest.TestCase):
+
+    def codecs(self):
+        'Runs each test with the standard json module and orjson if any.'
+
+        yield 'json', mock.patch.object(files, '_orjson', False)
+        if files.fast_json() is not None:
+            yield 'orjson', contextlib.nullcontext()
+
+    def test_round_trip(self):
+        for codec, patch in self.codecs():
+            for name in ['records.jsonl', 'records.jsonl.gz']:
+                with self.subTest(codec=codec, name=name), patch, \
+                     tempfile.TemporaryDirectory() as directory:
+                    filename = os.path.join(directory, name)
+                    self.assertTrue(files.save_jsonl(iter(RECORDS), filename))
+                    self.assertEqual(files.load_jsonl(filename), RECORDS)
+
+    def test_append(self):
+        for codec, patch in self.codecs():
+            for name in ['records.jsonl', 'records.jsonl.gz']:
+                with self.subTest(codec=codec, name=name), patch, \
+                     tempfile.TemporaryDirectory() as directory:
+                    filename = os.path.join(directory, name)
+                    files.append_jsonl(RECORDS[:1], filename)
+                    files.append_jsonl(RECORDS[1:], filename)
+                    self.assertEqual(list(files.iter_jsonl(filename)),
+                                     RECORDS)
+
+    def test_lines_are_compact(self):
+        for codec, patch in self.codecs():
+            with self.subTest(codec=codec), patch:
+                self.assertEqual(files.dumps_json({'a': [1, 'é']}),
+                                 '{"a":[1,"é"]}'.encode('utf-8'))
+                self.assertEqual(files.dumps_json({'d': date(2024, 1, 2)}),
+                                 b'{"d":"2024-01-02"}')
+
+    def test_blank_lines_are_skipped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'records.jsonl')
+            with open(filename, 'wb') as f:
+                f.write(b'{"a":1}\n\n{"a":2}\n')
+            self.assertEqual(files.load_jsonl(filename), [{'a': 1}, {'a': 2}])
+
+
+# ----------------------------------------------------------------
+# NumPy Arrays
+# ----------------------------------------------------------------
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestArrays(unittest.TestCase):
+
+    def test_threads_save_the_same_file(self):
+        barrier = threading.Barrier(2)
+        save = np.save
+        errors = []
+
+        def wait_and_save(*args, **kwargs):
+            barrier.wait(timeout=5)
+            save(*args, **kwargs)
+
+        def save_array(filename, value):
+            try:
+                files.save_npy(np.full(10, value), filename)
+            except Exception as err:
+                errors.append(err)
+
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.object(np, 'save', wait_and_save):
+            filename = os.path.join(directory, 'a.npy')
+            threads = [threading.Thread(target=save_array, args=(filename, i))
+                       for i in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(os.listdir(directory), ['a.npy'])
+            self.assertIn(int(files.load_npy(filename)[0]), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# ****************************************************************
+# End of File
+# ****************************************************************
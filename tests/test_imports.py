@@ -0,0 +1,88 @@
+# ****************************************************************
+# Import Time Benchmark for the utils package
+# ****************************************************************
+
+import os
+import sys
+import json
+import unittest
+import importlib.util
+import subprocess
+
+
+# CLI: python -m unittest tests/test_imports.py
+# CLI: IMPORT_BUDGET=0.2 python -m unittest tests/test_imports.py
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+
+# Maximum number of seconds allowed to import one utils module
+IMPORT_BUDGET = float(os.environ.get('IMPORT_BUDGET', 0.5))
+
+MODULES = ['data', 'files', 'gpt', 'graph', 'mail', 'nlp', 'pdf', 'queries',
+           'scraper', 'storage', 'utils', 'web']
+
+# Third party packages that must not be imported by import utils.<module>
+HEAVY_MODULES = ['numpy', 'pandas', 'pyarrow', 'google.cloud', 'gcsfs',
+                 'gspread', 'googleapiclient', 'pandas_gbq', 'selenium',
+                 'exchangelib', 'openai', 'vertexai', 'nltk', 'neo4j',
+                 'PyPDF2', 'bs4', 'requests']
+
+# Packages without which the lazy imports are not exercised
+REQUIRED_MODULES = ['pandas', 'google.cloud']
+
+# Configuration that must only be read on first use
+CONFIG_VARIABLES = ['DATA_DIR', 'GOOGLE_APPLICATION_CREDENTIALS',
+                    'HOTMAIL_USER', 'HOTMAIL_PWD']
+
+SCRIPT = '''
+import sys, json
+from time import perf_counter
+start = perf_counter()
+import utils.{module}
+elapsed = perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def installed(module):
+    'Returns True if module can be imported.'
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        return False
+
+
+def time_import(module):
+    'Imports utils.module in a fresh interpreter, returns elapsed and modules.'
+    env = {k: v for k, v in os.environ.items() if k not in CONFIG_VARIABLES}
+    paths = [SRC_DIR, env.get('PYTHONPATH')]
+    env['PYTHONPATH'] = os.pathsep.join(path for path in paths if path)
+    output = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module)],
+                            env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+# NB: Without the heavy packages nothing heavy can be imported, so the
+# test would pass whether or not the imports are lazy.
+
+@unittest.skipIf(not all(installed(module) for module in REQUIRED_MODULES),
+                 'pandas or google-cloud is not installed')
+class TestImports(unittest.TestCase):
+
+    def test_import_time(self):
+        for module in MODULES:
+            with self.subTest(module=module):
+                result = time_import(module)
+                self.assertLess(result['elapsed'], IMPORT_BUDGET)
+                imported = [m for m in HEAVY_MODULES
+                            if m in result['modules']]
+                self.assertEqual(imported, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# ****************************************************************
+# End of File
+# ****************************************************************
@@ -0,0 +1,1449 @@
+# ****************************************************************
+# Unit Tests for storage.py
+# ****************************************************************
+
+import gc
+import io
+import base64
+import hashlib
+import os
+import sys
+import asyncio
+import weakref
+import threading
+import tempfile
+import unittest
+import contextlib
+from types import SimpleNamespace
+from unittest import mock
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils import storage
+
+try:
+    import pandas as pd
+    import pyarrow as pa
+except ImportError:
+    pd = None
+
+
+# CLI: python -m unittest tests/test_storage.py
+
+# ----------------------------------------------------------------
+# Fake Google Storage
+# ----------------------------------------------------------------
+
+class NotFound(Exception):
+    pass
+
+
+class FakeBlob:
+
+    def __init__(self, store, name, metadata=None):
+        self.store = store
+        self.name = name
+        self.metadata = metadata
+        self.generation = 1
+        self.bucket = SimpleNamespace(name='bucket')
+        self.composed = None
+
+    def delete(self):
+        if self.name in self.store.failing:
+            raise RuntimeError('delete failed')
+        self.store.blobs.pop(self.name, None)
+
+    def compose(self, sources, if_generation_match=None):
+        self.composed = [source.name for source in sources]
+        self.generation += 1
+        self.store.blobs[self.name] = self
+
+    def upload_from_filename(self, pathname, if_generation_match=None):
+        if os.path.isfile(pathname):
+            with open(pathname, 'rb') as f:
+                self.data = f.read()
+        self.store.blobs[self.name] = self
+
+
+class FakeStore:
+
+    def __init__(self, names):
+        self.blobs = {name: FakeBlob(self, name) for name in names}
+        self.failing = set()
+
+    def find_blob(self, name, bucket=None):
+        return self.blobs.get(name)
+
+    def list_blobs_indexed(self, prefix, bucket=None, ttl=None, client=None):
+        return [self.blobs[name] for name in sorted(self.blobs)
+                if name.startswith(prefix)]
+
+    def patches(self):
+        client = SimpleNamespace(bucket=lambda name: SimpleNamespace(
+            blob=lambda blob_name: self.blobs.get(blob_name) or
+            FakeBlob(self, blob_name)))
+        return {'find_blob': self.find_blob,
+                'list_blobs_indexed': self.list_blobs_indexed,
+                'data_directory_gs': lambda *args, **kwargs: 'm/data/',
+                'compressed_blob_name': lambda name, bucket=None: name,
+                'invalidate_listings': lambda *args, **kwargs: None,
+                'index_blob': lambda blob: None,
+                'unindex_blob': lambda name, bucket=None: None,
+                'storage_client': lambda: client,
+                'google_exceptions': SimpleNamespace(NotFound=NotFound)}
+
+
+# ----------------------------------------------------------------
+# Fake BigQuery
+# ----------------------------------------------------------------
+
+class LocalBigQueryReadClient:
+    'An in-memory stand-in for BigQueryReadClient.'
+
+    def __init__(self, data, batch_size=10):
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        self.table = data
+        self.batch_size = batch_size
+        self.stream_counts = []
+
+    def create_read_session(self, parent, read_session, max_stream_count=1):
+        table = self.table
+        read_options = read_session.get('read_options')
+        if read_options is not None:
+            table = table.select(read_options['selected_fields'])
+        batches = table.to_batches(max_chunksize=self.batch_size)
+        count = max(1, min(max_stream_count, len(batches)))
+        self.stream_counts.append(count)
+        streams = [batches[i::count] for i in range(count)]
+        return SimpleNamespace(
+            streams=[SimpleNamespace(name=str(i)) for i in range(count)],
+            stream_batches=streams,
+            arrow_schema=SimpleNamespace(
+                serialized_schema=table.schema.serialize().to_pybytes()))
+
+    def read_rows(self, name):
+        def rows(session):
+            batches = session.stream_batches[int(name)]
+            pages = [SimpleNamespace(to_arrow=lambda batch=batch: batch)
+                     for batch in batches]
+            return SimpleNamespace(pages=pages)
+        return SimpleNamespace(rows=rows)
+
+
+class LocalBigQueryClient:
+
+    def query(self, query):
+        destination = SimpleNamespace(project='p', dataset_id='d',
+                                      table_id='t')
+        return SimpleNamespace(result=lambda: None, destination=destination)
+
+
+DATASET = 'm/data/m-sales.csv'
+SEGMENTS = DATASET + '.segments/'
+
+
+# ----------------------------------------------------------------
+# Bucket Listing Index
+# ----------------------------------------------------------------
+
+class ListedBlob:
+    'A blob as returned by a listing, bound to the generation listed.'
+
+    def __init__(self, bucket, name):
+        self.bucket = SimpleNamespace(name='bucket')
+        self.name = name
+        self.store = bucket
+        self.set_properties()
+
+    def set_properties(self):
+        data = self.store.data[self.name]
+        self.generation = self.store.generations[self.name]
+        self.updated = self.store.updated[self.name]
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode()
+        self.crc32c = None
+
+    def reload(self):
+        if self.name not in self.store.data:
+            raise NotFound(self.name)
+        self.set_properties()
+
+    def download_to_filename(self, pathname, raw_download=False):
+        if self.store.generations.get(self.name) != self.generation:
+            raise NotFound(f'{self.name}#{self.generation}')
+        self.store.downloads.append(self.name)
+        with open(pathname, 'wb') as f:
+            f.write(self.store.data[self.name])
+
+
+class ListedBucket:
+    'A bucket whose listings are recorded, with versioned blobs.'
+
+    def __init__(self, data):
+        self.data = dict(data)
+        self.generations = {name: 1 for name in data}
+        self.updated = {name: i for i, name in enumerate(data)}
+        self.listings = []
+        self.downloads = []
+
+    def write(self, name, data):
+        self.data[name] = data
+        self.generations[name] = self.generations.get(name, 0) + 1
+        self.updated[name] = max(self.updated.values()) + 1
+
+    def bucket(self, name):
+        return self
+
+    def list_blobs(self, bucket, prefix='', delimiter=None):
+        self.listings.append((prefix, delimiter))
+        names = [name for name in sorted(self.data) if name.startswith(prefix)]
+        if delimiter is not None:
+            names = [name for name in names
+                     if delimiter not in name[len(prefix):]]
+        return iter([ListedBlob(self, name) for name in names])
+
+
+class TestListingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = ListedBucket({
+            'o/m/': b'', 'o/m/data/m-sales.csv': b'a\n1\n',
+            'o/m/data/m-sales.csv.gz': b'gz',
+            'o/m/data/m-sales.csv.segments/seg-1.csv': b'2\n',
+            'o/m/model/m.bin': b'model', 'o/n/data/n.csv': b'n'})
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patches = [mock.patch.dict(os.environ, {'DATA_DIR': directory.name}),
+                   mock.patch.multiple(storage,
+                                       storage_client=lambda: self.bucket,
+                                       **TRANSFER_PATCHES)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        storage._forget_listings()
+        self.addCleanup(storage._forget_listings)
+        self.addCleanup(storage.save_blob_cache)
+        self.directory = directory.name
+
+    def names(self, blobs):
+        return [blob.name for blob in blobs]
+
+    def test_names_list_their_directory_only(self):
+        self.assertIsNotNone(storage.find_blob('o/m/data/m-sales.csv',
+                                               bucket='bucket'))
+        self.assertEqual(self.bucket.listings, [('o/m/data/', '/')])
+        self.assertEqual(storage.compressed_blob_name('o/m/data/m-sales.csv',
+                                                      bucket='bucket'),
+                         'o/m/data/m-sales.csv.gz')
+        self.assertEqual(len(self.bucket.listings), 1)
+
+        # A prefix without a trailing slash never lists the parent tree
+        self.assertEqual(self.names(storage.list_blobs_indexed(
+            'o/m', bucket='bucket')), [])
+        self.assertEqual(self.bucket.listings[-1], ('o/', '/'))
+
+    def test_directories_are_listed_recursively(self):
+        self.assertEqual(self.names(storage.list_blobs_indexed(
+            'o/m/data/', bucket='bucket')),
+            ['o/m/data/m-sales.csv', 'o/m/data/m-sales.csv.gz',
+             'o/m/data/m-sales.csv.segments/seg-1.csv'])
+        self.assertEqual(self.bucket.listings, [('o/m/data/', None)])
+
+        # Subdirectories are served by the recursive listing
+        segments = storage.list_blobs_indexed('o/m/data/m-sales.csv.segments/',
+                                              bucket='bucket')
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(len(self.bucket.listings), 1)
+
+    def test_shallow_listings_do_not_cover_subdirectories(self):
+        storage.find_blob('o/m/data/m-sales.csv', bucket='bucket')
+        segments = storage.list_blobs_indexed('o/m/data/m-sales.csv.segments/',
+                                              bucket='bucket')
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(self.bucket.listings,
+                         [('o/m/data/', '/'),
+                          ('o/m/data/m-sales.csv.segments/', None)])
+
+    def test_listings_expire(self):
+        storage.find_blob('o/m/data/m-sales.csv', bucket='bucket')
+        storage.find_blob('o/m/data/m-sales.csv', bucket='bucket')
+        self.assertEqual(len(self.bucket.listings), 1)
+        storage.find_blob('o/m/data/m-sales.csv', bucket='bucket', ttl=0)
+        self.assertEqual(len(self.bucket.listings), 2)
+
+    def test_writes_update_the_index(self):
+        storage.find_blob('o/m/data/m-sales.csv', bucket='bucket')
+        self.bucket.write('o/m/data/new.csv', b'x')
+        storage.index_blob(ListedBlob(self.bucket, 'o/m/data/new.csv'))
+        self.assertIsNotNone(storage.find_blob('o/m/data/new.csv',
+                                               bucket='bucket'))
+        storage.unindex_blob('o/m/data/m-sales.csv', bucket='bucket')
+        self.assertIsNone(storage.find_blob('o/m/data/m-sales.csv',
+                                            bucket='bucket'))
+        self.assertEqual(len(self.bucket.listings), 1)
+
+        # Nested blobs are not added to a shallow listing
+        storage.index_blob(ListedBlob(self.bucket,
+                                      'o/m/data/m-sales.csv.segments/seg-1.csv'))
+        listing = storage.indexed_listing('o/m/data/x', bucket='bucket')
+        self.assertNotIn('o/m/data/m-sales.csv.segments/seg-1.csv',
+                         listing['blobs'])
+
+        storage.invalidate_listings(bucket='bucket', prefix='o/m/data/')
+        storage.find_blob('o/m/data/new.csv', bucket='bucket')
+        self.assertEqual(len(self.bucket.listings), 2)
+
+    def test_stale_listings_do_not_serve_old_copies(self):
+        name = 'o/m/data/m-sales.csv'
+        pathname = os.path.join(self.directory, 'm-sales.csv')
+        blob = storage.find_blob(name, bucket='bucket')
+        self.assertTrue(storage.download_blob_cached(blob, pathname))
+        self.assertFalse(storage.download_blob_cached(
+            storage.find_blob(name, bucket='bucket'), pathname))
+
+        # Another process rewrites the blob within the listing TTL
+        self.bucket.write(name, b'a\n2\n')
+        blob = storage.find_blob(name, bucket='bucket')
+        self.assertEqual(blob.generation, 1)
+        self.assertTrue(storage.download_blob_cached(blob, pathname))
+        with open(pathname, 'rb') as f:
+            self.assertEqual(f.read(), b'a\n2\n')
+        self.assertEqual(storage.find_blob(name, bucket='bucket').generation, 2)
+        self.assertEqual(self.bucket.downloads, [name, name])
+
+
+# ----------------------------------------------------------------
+# LRU Eviction
+# ----------------------------------------------------------------
+
+class TestEviction(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def entry(self, name, size, accessed, **kwargs):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return dict({'path': path, 'size': size, 'accessed': accessed,
+                     'mtime': os.path.getmtime(path)}, **kwargs)
+
+    def test_least_recently_used_first(self):
+        manifest = {'a': self.entry('a', 10, 1), 'b': self.entry('b', 10, 2),
+                    'c': self.entry('c', 10, 3)}
+        self.assertEqual(storage.evict_lru(manifest, 15), ['a', 'b'])
+        self.assertEqual(list(manifest), ['c'])
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'a')))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, 'c')))
+
+    def test_keep_and_pinned_entries(self):
+        manifest = {'a': self.entry('a', 10, 1, pinned=True),
+                    'b': self.entry('b', 10, 2), 'c': self.entry('c', 10, 3)}
+        self.assertEqual(storage.evict_lru(manifest, 0, keep='b'), ['c'])
+        self.assertEqual(sorted(manifest), ['a', 'b'])
+        self.assertTrue(os.path.exists(manifest['a']['path']))
+
+    def test_modified_files_are_not_deleted(self):
+        manifest = {'a': self.entry('a', 10, 1), 'b': self.entry('b', 10, 2)}
+        with open(manifest['a']['path'], 'ab') as f:
+            f.write(b'user data')
+        self.assertEqual(storage.evict_lru(manifest, 0), ['a', 'b'])
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, 'a')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'b')))
+
+
+class TestBlobCache(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = ListedBucket({'o/m/data/m-a.csv': b'a' * 10,
+                                    'o/m/data/m-b.csv': b'b' * 10,
+                                    'o/m/data/m-a.csv.segments/s1.csv': b'1' * 10,
+                                    'o/m/data/m-a.csv.segments/s2.csv': b'2' * 10})
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patches = [mock.patch.dict(os.environ, {'DATA_DIR': directory.name}),
+                   mock.patch.multiple(storage,
+                                       storage_client=lambda: self.bucket,
+                                       BLOB_CACHE_MAX_SIZE=15,
+                                       BLOB_CACHE_SAVE_INTERVAL=3600,
+                                       **TRANSFER_PATCHES)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        storage._forget_listings()
+        self.addCleanup(storage._forget_listings)
+        self.addCleanup(storage.save_blob_cache)
+
+    def download(self, name):
+        pathname = os.path.join(self.directory, *name.split('/'))
+        os.makedirs(os.path.dirname(pathname), exist_ok=True)
+        storage.download_blob_cached(storage.find_blob(name, bucket='bucket'),
+                                     pathname)
+        return pathname
+
+    def test_working_files_are_never_evicted(self):
+        a = self.download('o/m/data/m-a.csv')
+        b = self.download('o/m/data/m-b.csv')
+        self.assertTrue(os.path.isfile(a))
+        self.assertTrue(os.path.isfile(b))
+        manifest = storage.blob_cache_manifest()
+        self.assertTrue(all(entry['pinned'] for entry in manifest.values()))
+        self.assertEqual(storage.blob_cache_stats()['size'], 0)
+
+    def test_segment_copies_are_evicted(self):
+        s1 = self.download('o/m/data/m-a.csv.segments/s1.csv')
+        s2 = self.download('o/m/data/m-a.csv.segments/s2.csv')
+        self.assertFalse(os.path.exists(s1))
+        self.assertTrue(os.path.isfile(s2))
+        self.assertEqual(list(storage.blob_cache_manifest()),
+                         ['bucket/o/m/data/m-a.csv.segments/s2.csv'])
+
+    def test_manifest_writes_are_batched(self):
+        pathname = storage.blob_cache_manifest_pathname()
+        with mock.patch.object(storage, 'save_manifest',
+                               wraps=storage.save_manifest) as save_manifest:
+            a = self.download('o/m/data/m-a.csv')
+            self.download('o/m/data/m-b.csv')
+            self.download('o/m/data/m-a.csv')
+            self.assertEqual(save_manifest.call_count, 0)
+            self.assertFalse(os.path.exists(pathname))
+
+            # Entries saved meanwhile by another process are kept
+            storage.save_manifest({'bucket/other': {'path': 'x', 'size': 1,
+                                                    'accessed': 0,
+                                                    'pinned': True}},
+                                  pathname)
+            self.assertTrue(storage.save_blob_cache())
+            self.assertFalse(storage.save_blob_cache())
+        self.assertEqual(sorted(storage.load_manifest(pathname)),
+                         ['bucket/o/m/data/m-a.csv', 'bucket/o/m/data/m-b.csv',
+                          'bucket/other'])
+        self.assertGreaterEqual(storage.blob_cache_stats()['hits'], 1)
+        self.assertEqual(self.bucket.downloads.count('o/m/data/m-a.csv'), 1)
+
+
+# ----------------------------------------------------------------
+# Bulk Transfers
+# ----------------------------------------------------------------
+
+class ServerError(Exception):
+    pass
+
+
+TRANSFER_PATCHES = {
+    'google_exceptions': SimpleNamespace(
+        NotFound=NotFound, TooManyRequests=ServerError,
+        ServerError=ServerError, RequestTimeout=ServerError),
+    'requests': SimpleNamespace(exceptions=SimpleNamespace(
+        ConnectionError=ServerError, Timeout=ServerError)),
+    'sleep': lambda seconds: None}
+
+
+class TestTransfers(unittest.TestCase):
+
+    def download(self, errors):
+        calls = []
+
+        def download_blob_cached(blob, pathname, cache=True):
+            calls.append(blob.name)
+            if errors:
+                raise errors.pop(0)
+            with open(pathname, 'w') as f:
+                f.write(blob.name)
+
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.multiple(storage, download_blob_cached=
+                                 download_blob_cached, **TRANSFER_PATCHES):
+            blob = SimpleNamespace(name='m/data/a.csv')
+            try:
+                storage.transfer_blob('download', blob,
+                                      os.path.join(directory, 'a.csv'))
+            finally:
+                return calls
+
+    def test_transient_errors_are_retried(self):
+        calls = self.download([ServerError(), ConnectionError()])
+        self.assertEqual(len(calls), 3)
+
+    def test_missing_blobs_are_not_retried(self):
+        calls = self.download([NotFound()])
+        self.assertEqual(len(calls), 1)
+
+    def test_nested_blob_names_are_kept(self):
+        store = FakeStore(['s/m/', 's/m/data/a.csv', 's/m/data/x/a.csv',
+                           's/m/model/a.csv',
+                           's/m/data/a.csv.segments/seg-1.csv'])
+
+        def download_blob_cached(blob, pathname, cache=True):
+            with open(pathname, 'w') as f:
+                f.write(blob.name)
+
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.dict(os.environ, {'DATA_DIR': directory}), \
+             mock.patch.multiple(
+                 storage, list_blobs_indexed=store.list_blobs_indexed,
+                 storage_client=lambda: None,
+                 download_blob_cached=download_blob_cached,
+                 target_directory_gs=lambda model_name, target=None, **kwargs:
+                     's/m' if target is None else f's/m/{target}/'):
+            self.assertIs(storage.download_data_blobs('m'), True)
+            root = os.path.join(directory, 'm')
+            self.assertEqual(
+                sorted(os.path.relpath(pathname, root).replace(os.sep, '/')
+                       for pathname in storage.scan_files(root,
+                                                          recursive=True)),
+                ['data/a.csv', 'data/x/a.csv', 'model/a.csv'])
+            with open(os.path.join(root, 'data', 'x', 'a.csv')) as f:
+                self.assertEqual(f.read(), 's/m/data/x/a.csv')
+
+
+# ----------------------------------------------------------------
+# Write-behind Uploads
+# ----------------------------------------------------------------
+
+class UploadBlob:
+
+    def __init__(self, uploads, name):
+        self.uploads = uploads
+        self.name = name
+        self.md5_hash = None
+
+    def upload_from_filename(self, pathname):
+        self.uploads.started.set()
+        self.uploads.release.wait(timeout=5)
+        with open(pathname, 'rb') as f:
+            data = f.read()
+        if self.uploads.failing is True:
+            raise RuntimeError('upload failed')
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode()
+        self.uploads.append((self.name, data))
+
+
+class Uploads(list):
+    'Records the uploads of UploadBlobs, which wait for release.'
+
+    def __init__(self, failing=False):
+        super().__init__()
+        self.failing = failing
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+
+class TestWriteBehind(unittest.TestCase):
+
+    def setUp(self):
+        self.uploads = Uploads()
+        self.recorded = []
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pathname = os.path.join(directory.name, 'm-sales.csv')
+        client = SimpleNamespace(bucket=lambda name: SimpleNamespace(
+            blob=lambda blob_name: UploadBlob(self.uploads, blob_name)))
+        patches = [
+            mock.patch.dict(os.environ, {'DATA_DIR': directory.name}),
+            mock.patch.multiple(
+                storage, storage_client=lambda: client,
+                set_blob_encoding=lambda blob, pathname: None,
+                index_blob=lambda blob: None,
+                record_cached_blob=lambda blob, pathname, pinned=False:
+                    self.recorded.append((blob.name, pathname, pinned)),
+                **TRANSFER_PATCHES)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def save(self, data):
+        with open(self.pathname, 'w') as f:
+            f.write(data)
+        storage.queue_upload('m/data/m-sales.csv', self.pathname,
+                             bucket='bucket')
+
+    def snapshots(self):
+        directory = os.path.join(os.environ['DATA_DIR'],
+                                 storage.WRITE_BEHIND_DIR)
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+    def test_queued_saves_are_coalesced(self):
+        # Workers wait for the condition while both saves are queued
+        with storage._upload_condition:
+            self.save('v1')
+            self.save('v2')
+        self.assertTrue(storage.flush_uploads(timeout=5))
+        self.assertEqual(self.uploads, [('m/data/m-sales.csv', b'v2')])
+        self.assertEqual(self.recorded,
+                         [('m/data/m-sales.csv', self.pathname, True)])
+        self.assertEqual(self.snapshots(), [])
+
+    def test_saves_during_an_upload_are_uploaded_after(self):
+        self.uploads.release.clear()
+        self.save('v1')
+        self.assertTrue(self.uploads.started.wait(timeout=5))
+        self.save('v2')
+        self.save('v3')
+        self.assertEqual(storage.pending_uploads(), 2)
+        self.uploads.release.set()
+        self.assertTrue(storage.flush_uploads(timeout=5))
+        self.assertEqual([data for _, data in self.uploads], [b'v1', b'v3'])
+        self.assertEqual(self.snapshots(), [])
+
+    def test_failures_are_raised_by_flush(self):
+        self.uploads.failing = True
+        self.save('v1')
+        with self.assertRaises(storage.WriteBehindError) as context:
+            storage.flush_uploads(timeout=5)
+        self.assertEqual([name for name, _ in context.exception.failures],
+                         ['m/data/m-sales.csv'])
+        self.assertEqual(self.recorded, [])
+        self.assertEqual(self.snapshots(), [])
+
+        # Failures are reported once
+        self.assertTrue(storage.flush_uploads(timeout=5))
+
+
+# ----------------------------------------------------------------
+# BigQuery Storage Read API
+# ----------------------------------------------------------------
+
+@unittest.skipIf(pd is None, 'pandas is not installed')
+class TestStorageQuery(unittest.TestCase):
+
+    def run_query(self, query, df, **kwargs):
+        read_client = LocalBigQueryReadClient(df)
+        arrow = SimpleNamespace(DataFormat=SimpleNamespace(ARROW='ARROW'))
+        with mock.patch.object(storage, 'bigquery_storage',
+                               SimpleNamespace(types=arrow)):
+            result = storage.run_bq_storage_query(
+                query, max_streams=4, client=LocalBigQueryClient(),
+                read_client=read_client, **kwargs)
+        return result, read_client.stream_counts
+
+    def test_ordered_queries_use_one_stream(self):
+        df = pd.DataFrame({'x': range(100)})
+        result, counts = self.run_query('SELECT x FROM t\norder  by x', df)
+        self.assertEqual(counts, [1])
+        self.assertEqual(result['x'].tolist(), list(range(100)))
+
+    def test_unordered_queries_use_parallel_streams(self):
+        df = pd.DataFrame({'x': range(100)})
+        result, counts = self.run_query('SELECT x FROM t', df)
+        self.assertEqual(counts, [4])
+        self.assertEqual(sorted(result['x'].tolist()), list(range(100)))
+        result, counts = self.run_query('SELECT x FROM t ORDER BY x', df,
+                                        ordered=False)
+        self.assertEqual(counts, [4])
+
+    def test_empty_results_keep_the_schema(self):
+        df = pd.DataFrame({'x': pd.Series([], dtype='int64'),
+                           'y': pd.Series([], dtype='float64')})
+        result, _ = self.run_query('SELECT x, y FROM t', df)
+        self.assertEqual(list(result.columns), ['x', 'y'])
+        self.assertEqual(str(result['x'].dtype), 'int64')
+
+    def test_fast_loads_of_empty_tables_keep_the_schema(self):
+        df = pd.DataFrame({'x': pd.Series([], dtype='int64'),
+                           'y': pd.Series([], dtype='float64')})
+        read_client = LocalBigQueryReadClient(df)
+        arrow = SimpleNamespace(DataFormat=SimpleNamespace(ARROW='ARROW'))
+        with mock.patch.object(storage, 'bigquery_storage',
+                               SimpleNamespace(types=arrow)), \
+                mock.patch.object(storage, 'bqstorage_client',
+                                  return_value=read_client):
+            result = storage.load_data_bq('m', 'sales', 'p', 'd', fast=True)
+        self.assertEqual(list(result.columns), ['x', 'y'])
+        self.assertEqual(str(result['y'].dtype), 'float64')
+
+
+# ----------------------------------------------------------------
+# Query Result Cache
+# ----------------------------------------------------------------
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.now = 1000.0
+        patches = [mock.patch.dict(os.environ, {'DATA_DIR': directory.name}),
+                   mock.patch.object(storage, 'time', lambda: self.now)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        storage.reset_query_cache_stats()
+        self.addCleanup(storage.reset_query_cache_stats)
+
+    def cache(self, query, value=0):
+        self.now += 1
+        df = pd.DataFrame({'x': [value] * 100})
+        self.assertTrue(storage.cache_query_result(query, df, project_id='p'))
+
+    def cached(self, query, ttl=storage.QUERY_CACHE_TTL):
+        self.now += 1
+        return storage.cached_query_result(query, project_id='p', ttl=ttl)
+
+    def test_normalize_sql(self):
+        self.assertEqual(storage.normalize_sql('SELECT  x\n  FROM t -- all\n;'),
+                         'SELECT x FROM t')
+        self.assertEqual(storage.normalize_sql('SELECT /* x */ y # z\nFROM t'),
+                         'SELECT y FROM t')
+        self.assertEqual(storage.normalize_sql("SELECT 'a  --b' FROM `t  u`"),
+                         "SELECT 'a  --b' FROM `t  u`")
+
+    def test_keys_ignore_formatting_but_not_literals(self):
+        key = storage.query_cache_key('SELECT x FROM t', project_id='p')
+        self.assertEqual(storage.query_cache_key(' SELECT x\n\tFROM t; ', 'p'),
+                         key)
+        self.assertNotEqual(storage.query_cache_key('SELECT x FROM t', 'q'),
+                            key)
+        self.assertNotEqual(
+            storage.query_cache_key("SELECT 'a b' FROM t", 'p'),
+            storage.query_cache_key("SELECT 'a  b' FROM t", 'p'))
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_hits_are_keyed_by_normalized_sql(self):
+        self.assertIsNone(self.cached('SELECT x FROM t'))
+        self.cache('SELECT x FROM t', value=7)
+        df = self.cached('SELECT x\n  FROM t  -- cached\n')
+        self.assertEqual(df['x'].tolist(), [7] * 100)
+        stats = storage.query_cache_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (1, 1, 1))
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_expired_results_are_misses(self):
+        self.cache('SELECT x FROM t')
+        self.now += 100
+        self.assertIsNone(self.cached('SELECT x FROM t', ttl=50))
+        self.assertIsNotNone(self.cached('SELECT x FROM t', ttl=200))
+        self.assertIsNotNone(self.cached('SELECT x FROM t', ttl=None))
+        stats = storage.query_cache_stats()
+        self.assertEqual((stats['expired'], stats['hits']), (1, 2))
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_least_recently_used_results_are_evicted(self):
+        self.cache('SELECT 1')
+        size = storage.query_cache_stats()['size']
+        with mock.patch.object(storage, 'QUERY_CACHE_MAX_SIZE',
+                               2 * size + size // 2):
+            self.cache('SELECT 2')
+            self.assertIsNotNone(self.cached('SELECT 1'))
+            self.cache('SELECT 3')
+            self.assertIsNone(self.cached('SELECT 2'))
+            self.assertIsNotNone(self.cached('SELECT 1'))
+            self.assertIsNotNone(self.cached('SELECT 3'))
+        stats = storage.query_cache_stats()
+        self.assertEqual((stats['entries'], stats['evictions']), (2, 1))
+        directory = storage.query_cache_directory()
+        self.assertEqual(len([name for name in os.listdir(directory)
+                              if name.endswith('.parquet')]), 2)
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_invalidation(self):
+        for query in ['SELECT 1', 'SELECT 2', 'SELECT 3']:
+            self.cache(query)
+        storage.invalidate_query_cache('SELECT  1;', project_id='p')
+        self.assertIsNone(self.cached('SELECT 1'))
+        self.assertIsNotNone(self.cached('SELECT 2'))
+        self.assertEqual(storage.query_cache_stats()['entries'], 2)
+        storage.invalidate_query_cache()
+        self.assertIsNone(self.cached('SELECT 3'))
+        stats = storage.query_cache_stats()
+        self.assertEqual((stats['entries'], stats['invalidations']), (0, 3))
+        self.assertEqual(os.listdir(storage.query_cache_directory()),
+                         ['manifest.json'])
+
+
+# ----------------------------------------------------------------
+# BigQuery Upserts
+# ----------------------------------------------------------------
+
+class TestMergeSQL(unittest.TestCase):
+
+    def sql(self, keys, columns):
+        return ' '.join(storage.merge_bq_sql('p.d.t', 'p.d.s', keys,
+                                             columns).split())
+
+    def test_inserts_by_column_name(self):
+        sql = self.sql(['id'], ['price', 'id'])
+        self.assertIn('MERGE `p.d.t` T USING `p.d.s` S ON T.`id` = S.`id`', sql)
+        self.assertIn('WHEN MATCHED THEN UPDATE SET `price` = S.`price`', sql)
+        self.assertIn('WHEN NOT MATCHED THEN INSERT (`price`, `id`) '
+                      'VALUES (S.`price`, S.`id`)', sql)
+        self.assertNotIn('INSERT ROW', sql)
+
+    def test_string_and_composite_keys(self):
+        self.assertIn('ON T.`id` = S.`id` WHEN', self.sql('id', ['id', 'x']))
+        sql = self.sql(['a', 'b'], ['a', 'b', 'x'])
+        self.assertIn('ON T.`a` = S.`a` AND T.`b` = S.`b`', sql)
+        self.assertIn('UPDATE SET `x` = S.`x` WHEN', sql)
+
+    def test_key_only_tables_only_insert(self):
+        sql = self.sql('id', ['id'])
+        self.assertNotIn('WHEN MATCHED', sql)
+        self.assertIn('INSERT (`id`) VALUES (S.`id`)', sql)
+
+
+# ----------------------------------------------------------------
+# Asynchronous API
+# ----------------------------------------------------------------
+
+class TestAsync(unittest.TestCase):
+
+    def test_concurrent_model_directories(self):
+        async def ensure_all():
+            return await asyncio.gather(*[
+                storage.run_blocking(storage.ensure_model_directory_fs, 'm',
+                                     folder='cache')
+                for _ in range(20)])
+
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.dict(os.environ, {'DATA_DIR': directory}):
+            self.assertEqual(asyncio.run(ensure_all()), [True] * 20)
+            self.assertTrue(os.path.isdir(os.path.join(directory, 'm', 'cache')))
+
+    def test_reset_clients_shuts_down_the_executor(self):
+        executor = storage.async_executor()
+        storage.reset_clients('executor')
+        with self.assertRaises(RuntimeError):
+            executor.submit(int)
+        self.assertIsNot(storage.async_executor(), executor)
+
+
+# ----------------------------------------------------------------
+# Google Sheets
+# ----------------------------------------------------------------
+
+def rowcol_to_a1(row, col):
+    return f'{chr(ord("A") + col - 1)}{row}'
+
+
+class TestSheetUpdates(unittest.TestCase):
+
+    def updates(self, current, values, max_cells=1000):
+        gspread = SimpleNamespace(utils=SimpleNamespace(
+            rowcol_to_a1=rowcol_to_a1))
+        with mock.patch.object(storage, 'gspread', gspread):
+            return storage.sheet_updates(current, values, max_cells=max_cells)
+
+    def test_unchanged_rows_are_skipped(self):
+        current = [['a', 'b'], [1, 2], [3, 4], [5, 6]]
+        values = [['a', 'b'], [1, 9], [3, 4], [5, 6], [7, 8]]
+        self.assertEqual(self.updates(current, values),
+                         [[{'range': 'A2:B2', 'values': [[1, 9]]},
+                           {'range': 'A5:B5', 'values': [[7, 8]]}]])
+
+    def test_removed_rows_are_cleared(self):
+        current = [['a', 'b'], [1, 2], [3, 4]]
+        values = [['a', 'b'], [1, 2]]
+        self.assertEqual(self.updates(current, values),
+                         [[{'range': 'A3:B3', 'values': [['', '']]}]])
+
+    def test_ranges_are_batched_by_cells(self):
+        current = []
+        values = [[i, i] for i in range(5)]
+        batches = self.updates(current, values, max_cells=4)
+        self.assertEqual([[update['range'] for update in batch]
+                          for batch in batches],
+                         [['A1:B2'], ['A3:B4'], ['A5:B5']])
+
+    def test_no_changes(self):
+        self.assertEqual(self.updates([['a'], [1]], [['a'], [1]]), [])
+
+    def test_cells_are_compared_by_type(self):
+        current = [['a', 'b'], [1, True], [1.5, '2']]
+        values = [['a', 'b'], [1.0, 1], [1.5, 2]]
+        self.assertEqual(self.updates(current, values),
+                         [[{'range': 'A2:B3',
+                            'values': [[1.0, 1], [1.5, 2]]}]])
+        self.assertEqual(self.updates([[True, 0]], [[True, False]]),
+                         [[{'range': 'A1:B1', 'values': [[True, False]]}]])
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_missing_values_are_blank(self):
+        for value in [None, float('nan'), pd.NA, pd.NaT]:
+            self.assertEqual(storage.sheet_value(value), '')
+        self.assertEqual(storage.sheet_value(pd.Series([1]).iloc[0]), 1)
+        self.assertEqual(storage.sheet_value('x'), 'x')
+        self.assertEqual(storage.sheet_value([1, 2]), '[1, 2]')
+
+
+# ----------------------------------------------------------------
+# Google Drive
+# ----------------------------------------------------------------
+
+class Service:
+    pass
+
+
+class TestDriveServices(unittest.TestCase):
+
+    def test_services_are_released_with_their_thread(self):
+        services = []
+
+        def use_service():
+            service = storage.drive_service('key.json')
+            self.assertIs(storage.drive_service('key.json'), service)
+            services.append(weakref.ref(service))
+
+        discovery = SimpleNamespace(build=lambda *args, **kwargs: Service())
+        with mock.patch.multiple(storage, discovery=discovery,
+                                 drive_credentials=lambda key: None):
+            threads = [threading.Thread(target=use_service) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        gc.collect()
+        self.assertEqual(len(services), 4)
+        self.assertEqual([ref() for ref in services], [None] * 4)
+
+
+class MediaRequest:
+
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+        self.headers = {}
+
+    def execute(self):
+        self.drive.ranges.append(self.headers.get('Range'))
+        if self.drive.failures:
+            self.drive.failures -= 1
+            raise ConnectionError('connection reset')
+        content = self.drive.contents[self.file_id]
+        if 'Range' not in self.headers:
+            return content
+        start, end = self.headers['Range'][len('bytes='):].split('-')
+        return content[int(start):int(end) + 1]
+
+
+class FakeDrive:
+    'Drive files service serving contents by id, honouring Range headers.'
+
+    def __init__(self, contents, failures=0):
+        self.contents = contents
+        self.failures = failures
+        self.ranges = []
+
+    def files(self):
+        return self
+
+    def get(self, fileId, **kwargs):
+        content = self.contents[fileId]
+        return SimpleNamespace(execute=lambda: {
+            'name': fileId, 'size': str(len(content)),
+            'md5Checksum': hashlib.md5(content).hexdigest()})
+
+    def get_media(self, fileId, **kwargs):
+        return MediaRequest(self, fileId)
+
+
+class TestDriveDownloads(unittest.TestCase):
+
+    def test_download_resumes_with_range(self):
+        drive = FakeDrive({'f1': bytes(range(256)) * 4}, failures=1)
+        with tempfile.TemporaryDirectory() as directory:
+            pathname = os.path.join(directory, 'f1.bin')
+            with open(f'{pathname}.part', 'wb') as f:
+                f.write(drive.contents['f1'][:100])
+            with mock.patch.multiple(storage, drive_service=lambda key: drive,
+                                     sleep=lambda seconds: None):
+                storage.download_file('f1', None, pathname, chunksize=400,
+                                      verbose=False)
+            with open(pathname, 'rb') as f:
+                self.assertEqual(f.read(), drive.contents['f1'])
+            self.assertFalse(os.path.exists(f'{pathname}.part'))
+        self.assertEqual(drive.ranges, ['bytes=100-499', 'bytes=100-499',
+                                        'bytes=500-899', 'bytes=900-1023'])
+
+    def test_duplicate_names_are_kept_apart(self):
+        drive = FakeDrive({'a1': b'first', 'a2': b'second', 'b1': b'other'})
+        files = [{'id': 'a1', 'name': 'data.csv'},
+                 {'id': 'a2', 'name': 'data.csv'},
+                 {'id': 'b1', 'name': 'other.csv'},
+                 {'id': 'b1', 'name': 'other.csv'}]
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(storage, 'drive_service',
+                                   lambda key: drive):
+                report = storage.download_files(files, directory, workers=2)
+            self.assertEqual(report['files'], 3)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['data-a1.csv', 'data-a2.csv', 'other.csv'])
+            with open(os.path.join(directory, 'data-a2.csv'), 'rb') as f:
+                self.assertEqual(f.read(), b'second')
+
+
+# ----------------------------------------------------------------
+# Streaming Loads
+# ----------------------------------------------------------------
+
+@unittest.skipIf(pd is None, 'pandas is not installed')
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patch = mock.patch.dict(os.environ, {'DATA_DIR': directory.name})
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.df = pd.DataFrame({'id': range(25), 'label': ['a', 'b'] * 12 +
+                                ['c'], 'price': [0.5] * 25})
+
+    def stream(self, data_type, **kwargs):
+        return list(storage.load_data('m', 'sales', data_type, 'file',
+                                      chunksize=10, **kwargs))
+
+    def test_csv_chunks(self):
+        storage.save_data('m', 'sales', 'csv', self.df, 'file')
+        chunks = self.stream('csv', usecols=['id', 'label'],
+                             dtype={'id': 'int32', 'label': 'category'})
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(list(chunks[0].columns), ['id', 'label'])
+        self.assertEqual(str(chunks[0]['id'].dtype), 'int32')
+        self.assertEqual(str(chunks[2]['label'].dtype), 'category')
+        df = pd.concat(chunks, ignore_index=True)
+        self.assertEqual(df['id'].tolist(), list(range(25)))
+
+    def test_compressed_csv_chunks(self):
+        storage.save_data('m', 'sales', 'csv', self.df, 'file',
+                          compression='gzip')
+        chunks = self.stream('csv')
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(chunks[2]['label'].tolist()[-1], 'c')
+
+    def test_parquet_chunks(self):
+        storage.save_data('m', 'sales', 'parquet', self.df, 'file')
+        chunks = self.stream('parquet', usecols=['price'])
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(list(chunks[1].columns), ['price'])
+
+    def test_unsupported_types_raise(self):
+        storage.save_data('m', 'sales', 'json', {'a': 1}, 'file')
+        with self.assertRaises(ValueError):
+            self.stream('json')
+
+
+@unittest.skipIf(pd is None, 'pandas is not installed')
+class TestParquetData(unittest.TestCase):
+
+    def test_file_round_trip_with_pushdown(self):
+        df = pd.DataFrame({'year': [2022, 2023] * 5, 'price': range(10)})
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.dict(os.environ, {'DATA_DIR': directory}):
+            storage.save_data('m', 'sales', 'parquet', df, 'file',
+                              compression='gzip')
+            self.assertTrue(os.path.isfile(os.path.join(
+                directory, 'm', 'data', 'm-sales.parquet')))
+            self.assertTrue(storage.load_data('m', 'sales', 'parquet',
+                                              'file').equals(df))
+            loaded = storage.load_data('m', 'sales', 'parquet', 'file',
+                                       usecols=['price'],
+                                       filters=[('year', '==', 2023)])
+        self.assertEqual(list(loaded.columns), ['price'])
+        self.assertEqual(loaded['price'].tolist(), [1, 3, 5, 7, 9])
+
+
+# ----------------------------------------------------------------
+# Compressed Data Files
+# ----------------------------------------------------------------
+
+class TestCompression(unittest.TestCase):
+
+    def test_json_is_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            pathname = os.path.join(directory, 'm-labels.json.gz')
+            self.assertTrue(storage.save_data_file({'a': [1, 2]}, pathname,
+                                                   'json'))
+            with open(pathname, 'rb') as f:
+                self.assertEqual(f.read(2), b'\x1f\x8b')
+            self.assertEqual(storage.load_data_file(pathname, 'json'),
+                             {'a': [1, 2]})
+
+    def test_data_filenames(self):
+        self.assertEqual(storage.data_filename('m', 'x', 'json', 'gzip'),
+                         'm-x.json.gz')
+        self.assertEqual(storage.data_filename('m', 'x', 'parquet', 'gzip'),
+                         'm-x.parquet')
+
+
+# ----------------------------------------------------------------
+# Partitioned Datasets
+# ----------------------------------------------------------------
+
+@unittest.skipIf(pd is None, 'pandas is not installed')
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patch = mock.patch.dict(os.environ, {'DATA_DIR': directory.name})
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.df = pd.DataFrame({'region': ['east', None, 'west', 'east'],
+                                'sales': [1, 2, 3, 4]})
+
+    def test_null_keys_round_trip(self):
+        pathnames = storage.save_partitioned_fs('m', 'sales', 'csv', self.df,
+                                                ['region'])
+        self.assertEqual(len(pathnames), 3)
+        self.assertEqual(storage.list_partitions('m', 'sales', 'file'),
+                         [{'region': storage.HIVE_DEFAULT_PARTITION},
+                          {'region': 'east'}, {'region': 'west'}])
+        df = storage.load_partitioned_fs('m', 'sales', 'csv')
+        self.assertEqual(sorted(df['sales'].tolist()), [1, 2, 3, 4])
+        self.assertEqual(df['region'].isna().sum(), 1)
+
+        df = storage.load_partitioned_fs(
+            'm', 'sales', 'csv',
+            partition_filter={'region': storage.HIVE_DEFAULT_PARTITION})
+        self.assertEqual(df['sales'].tolist(), [2])
+
+    def test_storage_loads_only_downloaded_parts(self):
+        storage.save_partitioned_fs('m', 'sales', 'csv', self.df, ['region'])
+        prefix = 'orphans/m/data/m-sales/'
+        store = FakeStore([prefix + 'region=east/part-00000.csv'])
+        transfers = []
+
+        def transfer_blobs(batch, workers=None, cache=True):
+            transfers.extend(batch)
+            return {'files': len(batch), 'failed': [], 'bytes': 0}
+
+        with mock.patch.multiple(
+                storage, list_blobs_indexed=store.list_blobs_indexed,
+                partitioned_directory_gs=lambda *args, **kwargs: prefix,
+                transfer_blobs=transfer_blobs):
+            df = storage.load_partitioned_gs('m', 'sales', 'csv')
+
+        self.assertEqual(len(transfers), 1)
+        self.assertEqual(sorted(df['sales'].tolist()), [1, 4])
+
+    def test_failed_transfers_raise(self):
+        storage.save_partitioned_fs('m', 'sales', 'csv', self.df, ['region'])
+        prefix = 'orphans/m/data/m-sales/'
+        store = FakeStore([prefix + 'region=east/part-00000.csv'])
+
+        def transfer_blobs(batch, workers=None, cache=True):
+            return {'files': 0, 'failed': [blob.name for _, blob, _ in batch],
+                    'bytes': 0}
+
+        with mock.patch.multiple(
+                storage, **store.patches(),
+                partitioned_directory_gs=lambda *args, **kwargs: prefix,
+                transfer_blobs=transfer_blobs):
+            with self.assertRaises(IOError):
+                storage.load_partitioned_gs('m', 'sales', 'csv')
+            with self.assertRaises(IOError):
+                storage.save_partitioned_gs('m', 'sales', 'csv', self.df,
+                                            ['region'])
+
+    def test_integer_keys_with_nulls(self):
+        df = pd.DataFrame({'year': [2023, None, 2024, 2023],
+                           'sales': [1, 2, 3, 4]})
+        self.assertEqual(str(df['year'].dtype), 'float64')
+        storage.save_partitioned_fs('m', 'sales', 'csv', df, ['year'])
+        self.assertEqual(storage.list_partitions('m', 'sales', 'file'),
+                         [{'year': '2023'}, {'year': '2024'},
+                          {'year': storage.HIVE_DEFAULT_PARTITION}])
+        df = storage.load_partitioned_fs('m', 'sales', 'csv',
+                                         partition_filter={'year': 2023})
+        self.assertEqual(sorted(df['sales'].tolist()), [1, 4])
+        df = storage.load_partitioned_fs('m', 'sales', 'csv',
+                                         partition_filter={'year': (2023, 2024)})
+        self.assertEqual(sorted(df['sales'].tolist()), [1, 3, 4])
+
+
+# ----------------------------------------------------------------
+# Segment Compaction
+# ----------------------------------------------------------------
+
+@unittest.skipIf(pd is None, 'pandas is not installed')
+class TestAppend(unittest.TestCase):
+
+    def append(self, store, dfs, compact_segments=100):
+        errors = []
+
+        def append(df):
+            try:
+                storage.append_data_gs('m', 'sales', 'csv', df,
+                                       compact_segments=compact_segments)
+            except Exception as err:
+                errors.append(err)
+
+        with mock.patch.multiple(storage, **store.patches(),
+                                 csv_columns_gs=lambda name: ['a', 'b']):
+            threads = [threading.Thread(target=append, args=(df,))
+                       for df in dfs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_appends_add_segments(self):
+        store = FakeStore([DATASET])
+        dfs = [pd.DataFrame({'b': [i], 'a': [-i]}) for i in range(8)]
+        self.append(store, dfs)
+        segments = [name for name in store.blobs if name.startswith(SEGMENTS)]
+        self.assertEqual(len(segments), 8)
+        self.assertEqual(sorted(store.blobs[name].data for name in segments),
+                         sorted(f'{-i},{i}\n'.encode() for i in range(8)))
+
+    def test_appends_are_compacted(self):
+        store = FakeStore([DATASET])
+        df = pd.DataFrame({'a': [1], 'b': [2]})
+        for _ in range(3):
+            self.append(store, [df], compact_segments=3)
+        dataset = store.blobs[DATASET]
+        self.assertEqual(len(dataset.composed), 4)
+        self.assertEqual(len(storage.absorbed_segments(dataset)), 3)
+        self.assertEqual(sorted(store.blobs), [DATASET])
+
+
+class TestCompaction(unittest.TestCase):
+
+    def test_failed_deletes_stay_absorbed(self):
+        store = FakeStore([DATASET, SEGMENTS + 'seg-1.csv',
+                           SEGMENTS + 'seg-2.csv'])
+        store.failing.add(SEGMENTS + 'seg-1.csv')
+        with mock.patch.multiple(storage, **store.patches()):
+            self.assertEqual(storage.compact_data_gs('m', 'sales', 'csv'), 2)
+            self.assertEqual(storage.segment_blobs_gs(DATASET), [])
+
+            # The leftover remains absorbed after the next compaction
+            store.blobs[SEGMENTS + 'seg-3.csv'] = \
+                FakeBlob(store, SEGMENTS + 'seg-3.csv')
+            self.assertEqual(storage.compact_data_gs('m', 'sales', 'csv'), 1)
+            dataset = store.blobs[DATASET]
+            self.assertEqual(dataset.composed, [DATASET, SEGMENTS + 'seg-3.csv'])
+            self.assertEqual(storage.absorbed_segments(dataset),
+                             {'seg-1.csv', 'seg-3.csv'})
+            self.assertEqual(storage.segment_blobs_gs(DATASET), [])
+
+            # Leftovers are deleted once deletion succeeds
+            store.failing.clear()
+            store.blobs[SEGMENTS + 'seg-4.csv'] = \
+                FakeBlob(store, SEGMENTS + 'seg-4.csv')
+            storage.compact_data_gs('m', 'sales', 'csv')
+            self.assertEqual(storage.absorbed_segments(dataset), {'seg-4.csv'})
+            self.assertEqual(sorted(store.blobs), [DATASET])
+
+    @unittest.skipIf(pd is None, 'pandas is not installed')
+    def test_merge_reads_listed_segments_only(self):
+        dataset = 'm/data/m-sales.parquet'
+        prefix = dataset + '.segments/'
+        store = FakeStore([dataset, prefix + 'seg-1.parquet'])
+        loaded = []
+
+        def load_segments_gs(segments, data_type, columns, directory=None):
+            # A concurrent append lands while the segments are read
+            store.blobs[prefix + 'seg-2.parquet'] = \
+                FakeBlob(store, prefix + 'seg-2.parquet')
+            loaded.extend(blob.name for blob in segments)
+            return [pd.DataFrame({'x': [2]})]
+
+        saved = []
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.dict(os.environ, {'DATA_DIR': directory}), \
+             mock.patch.multiple(
+                 storage, **store.patches(),
+                 download_blob_cached=lambda blob, pathname, cache=True: True,
+                 load_data_file=lambda pathname, data_type:
+                     pd.DataFrame({'x': [1]}),
+                 load_segments_gs=load_segments_gs,
+                 save_data_file=lambda data, pathname, data_type:
+                     saved.append(data),
+                 set_blob_encoding=lambda blob, pathname: None,
+                 record_cached_blob=lambda blob, pathname: None):
+            self.assertEqual(
+                storage.compact_data_gs('m', 'sales', 'parquet'), 1)
+
+        self.assertEqual(loaded, [prefix + 'seg-1.parquet'])
+        self.assertEqual(saved[0]['x'].tolist(), [1, 2])
+        self.assertEqual(storage.absorbed_segments(store.blobs[dataset]),
+                         {'seg-1.parquet'})
+        self.assertEqual(sorted(store.blobs),
+                         [dataset, prefix + 'seg-2.parquet'])
+
+
+# ----------------------------------------------------------------
+# Model Synchronization
+# ----------------------------------------------------------------
+
+class TestSync(unittest.TestCase):
+
+    def test_segments_are_not_synchronized(self):
+        store = FakeStore(['orphans/m/data/m-sales.csv',
+                           'orphans/m/data/m-sales.csv.segments/seg-1.csv'])
+        with tempfile.TemporaryDirectory() as directory, \
+             mock.patch.dict(os.environ, {'DATA_DIR': directory}), \
+             mock.patch.multiple(
+                 storage, list_blobs_indexed=store.list_blobs_indexed,
+                 target_directory_gs=lambda *args, **kwargs:
+                     'orphans/m/data/'):
+            segments = os.path.join(directory, 'm', 'data',
+                                    'm-sales.csv.segments')
+            os.makedirs(segments)
+            for filename in ['m-sales.csv', 'm-sales.csv.segments/seg-1.csv']:
+                with open(os.path.join(directory, 'm', 'data', filename),
+                          'w') as f:
+                    f.write('x\n')
+            self.assertEqual(list(storage.local_model_files('m', 'data')),
+                             ['m-sales.csv'])
+            self.assertEqual(list(storage.remote_model_blobs('m', 'data')),
+                             ['m-sales.csv'])
+
+
+class SyncBlob:
+
+    def __init__(self, name, data, md5=True):
+        self.name = name
+        self.bucket = SimpleNamespace(name='bucket')
+        self.size = len(data)
+        self.generation = 1
+        digest = hashlib.md5(data).digest() if md5 else None
+        self.md5_hash = base64.b64encode(digest).decode() if md5 else None
+        self.crc32c = None if md5 else base64.b64encode(
+            data[::-1]).decode()
+
+
+class TestSyncPlan(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.blobs = {}
+        self.hashed = []
+
+        def file_md5(pathname):
+            self.hashed.append(os.path.basename(pathname))
+            return md5(pathname)
+
+        def file_crc32c(pathname):
+            # Stands in for the CRC32C of google_crc32c, see SyncBlob
+            self.hashed.append(os.path.basename(pathname))
+            with open(pathname, 'rb') as f:
+                return base64.b64encode(f.read()[::-1]).decode()
+
+        md5 = storage.file_md5
+        bucket = SimpleNamespace(name='bucket')
+        client = SimpleNamespace(bucket=lambda name: SimpleNamespace(
+            blob=lambda name: SimpleNamespace(name=name, bucket=bucket)))
+        patches = [mock.patch.dict(os.environ, {'DATA_DIR': self.directory}),
+                   mock.patch.multiple(
+                       storage, storage_client=lambda: client,
+                       list_blobs_indexed=self.list_blobs,
+                       target_directory_gs=lambda name, target, **kwargs:
+                           f'o/{name}/{target}/',
+                       file_md5=file_md5, file_crc32c=file_crc32c,
+                       BLOB_CACHE_SAVE_INTERVAL=3600)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(storage.save_blob_cache)
+
+    def list_blobs(self, prefix, bucket=None, ttl=None):
+        return [blob for name, blob in sorted(self.blobs.items())
+                if name.startswith(prefix)]
+
+    def local(self, relative, data):
+        pathname = os.path.join(self.directory, 'm', 'data', relative)
+        os.makedirs(os.path.dirname(pathname), exist_ok=True)
+        with open(pathname, 'wb') as f:
+            f.write(data)
+        return pathname
+
+    def remote(self, relative, data, md5=True):
+        name = f'o/m/data/{relative}'
+        self.blobs[name] = SyncBlob(name, data, md5=md5)
+        return self.blobs[name]
+
+    def plan(self, direction, delete=False):
+        return storage.sync_plan('m', direction, folders=('data',),
+                                 delete=delete, workers=2)
+
+    def test_files_are_matched_by_size_and_hash(self):
+        for name, data in [('same.csv', b'abc'), ('size.csv', b'abc'),
+                           ('md5.csv', b'abc'), ('crc.csv', b'abc'),
+                           ('crc-changed.csv', b'abc')]:
+            self.local(name, data)
+        self.remote('same.csv', b'abc')
+        self.remote('size.csv', b'abcd')
+        self.remote('md5.csv', b'abd')
+        self.remote('crc.csv', b'abc', md5=False)
+        self.remote('crc-changed.csv', b'abd', md5=False)
+        plan = self.plan('upload')
+        self.assertEqual(sorted(blob.name for blob, _ in plan['upload']),
+                         ['o/m/data/crc-changed.csv', 'o/m/data/md5.csv',
+                          'o/m/data/size.csv'])
+        self.assertEqual(plan['unchanged'], 2)
+        # Files of a different size are not hashed
+        self.assertNotIn('size.csv', self.hashed)
+
+    def test_cached_copies_are_not_hashed(self):
+        pathname = self.local('cached.csv', b'abc')
+        blob = self.remote('cached.csv', b'abc')
+        storage.record_cached_blob(blob, pathname)
+        plan = self.plan('download')
+        self.assertEqual((plan['download'], plan['unchanged']), ([], 1))
+        self.assertEqual(self.hashed, [])
+        # A newer generation of the blob is hashed again
+        blob.generation = 2
+        plan = self.plan('download')
+        self.assertEqual((plan['download'], plan['unchanged']), ([], 1))
+        self.assertEqual(self.hashed, ['cached.csv'])
+
+    def test_downloads_and_deletions(self):
+        self.local('local.csv', b'a')
+        self.local('sales.csv.schema.json', b'{}')
+        self.local('sales.csv.segments/seg-1.csv', b'x')
+        self.remote('sales.csv', b'abc')
+        self.remote('nested/remote.csv', b'b')
+        plan = self.plan('download')
+        self.assertEqual([pathname for _, pathname in plan['download']],
+                         [os.path.join(self.directory, 'm', 'data', 'nested',
+                                       'remote.csv'),
+                          os.path.join(self.directory, 'm', 'data',
+                                       'sales.csv')])
+        self.assertEqual(plan['delete'], [])
+        plan = self.plan('download', delete=True)
+        # Schema sidecars and segments are local caches and are kept
+        self.assertEqual(plan['delete'],
+                         [os.path.join(self.directory, 'm', 'data',
+                                       'local.csv')])
+
+    def test_uploads_delete_only_unmatched_blobs(self):
+        self.local('sales.csv', b'abc')
+        self.local('sales.csv.schema.json', b'{}')
+        self.remote('sales.csv', b'abc')
+        self.remote('old.csv', b'x')
+        self.remote('sales.csv.segments/seg-1.csv', b'x')
+        plan = self.plan('upload', delete=True)
+        self.assertEqual(plan['upload'], [])
+        self.assertEqual([blob.name for blob in plan['delete']],
+                         ['o/m/data/old.csv'])
+        plan = self.plan('upload')
+        self.assertEqual(plan['delete'], [])
+
+    def test_plans_are_logged(self):
+        self.local('local.csv', b'a')
+        plan = self.plan('upload')
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), \
+             self.assertLogs(storage.logger, 'WARNING') as logs:
+            storage.print_sync_plan(plan, dry_run=True)
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertIn('1 uploads, 0 downloads', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# ****************************************************************
+# End of File
+# ****************************************************************